@@ -0,0 +1,74 @@
+"""
+Compares the encode cost and payload size of each image encoding.
+
+Usage:
+    python -m benchmarks.bench_encoding [--num-images 1000] [--image-width 512] [--data-dir mnist/] [--json results.json]
+"""
+
+from number_generator.script.dataload import get_loader
+from number_generator.script.encoding import encode_image
+from number_generator.script.generate import generate_phone_number_batch
+
+import argparse
+import json
+import time
+
+#Each benchmarked case, as (label, encoding, png_level)
+CASES = [
+    ("png (default level)", "png", None),
+] + [
+    (f"png level {level}", "png", level) for level in range(10)
+] + [
+    ("npy", "npy", None),
+    ("pgm", "pgm", None),
+    ("raw", "raw", None),
+]
+
+
+def bench_encodings(images) -> list:
+    """
+    Encodes every image with every case, returning one result dict per case.
+    """
+
+    results = []
+
+    for label, encoding, png_level in CASES:
+        start = time.perf_counter()
+        sizes = [len(encode_image(image, encoding, png_level)) for image in images]
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            "case": label,
+            "encoding": encoding,
+            "png_level": png_level,
+            "us_per_image": 1e6 * elapsed / len(images),
+            "mean_bytes": sum(sizes) / len(sizes),
+        })
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-images", type=int, default=1000)
+    parser.add_argument("--image-width", type=int, default=512)
+    parser.add_argument("--data-dir", default="mnist/")
+    parser.add_argument("--json", default=None, help="An optional path to also write the results to, as JSON")
+    args = parser.parse_args()
+
+    loader = get_loader(args.data_dir)
+    images = generate_phone_number_batch(args.num_images, (0, 10), args.image_width, random_seed=0, loader=loader)
+
+    results = bench_encodings(images)
+
+    print(f"{'case':<22}{'us/image':>12}{'bytes/image':>14}")
+    for result in results:
+        print(f"{result['case']:<22}{result['us_per_image']:>12.1f}{result['mean_bytes']:>14.0f}")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Measures the cold start of the package with `python -X importtime`, so that slow
+imports do not creep back into the CLI.
+
+Each target runs in a fresh interpreter. The import time of a target is the
+cumulative time `-X importtime` reports for its top-level imports, and the wall time
+covers the whole process, interpreter startup included.
+
+Usage:
+    python -m benchmarks.bench_import [--repeat 5] [--json results.json]
+
+Exits with status 1 if the CLI loads any of the heavy modules in `CLI_FORBIDDEN`.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+#Each target, as name: the code it runs
+TARGETS = {
+    "package": "import number_generator",
+    "cli": "import number_generator.cli.cli",
+    "cli --help": "from number_generator.cli.cli import app; app(['--help'])",
+    "generate": "import number_generator.script.generate",
+    "api": "import number_generator.api.api",
+}
+
+#Modules a CLI invocation must not pay for before a command actually runs
+CLI_FORBIDDEN = ("numpy", "cv2", "idx2numpy", "wget", "fastapi", "pydantic")
+
+
+def import_profile(code: str) -> dict:
+    """
+    Runs `code` in a fresh interpreter under `-X importtime`.
+
+    Returns
+    -------
+    result, a dict with the total "import_us" of the top-level imports, the
+    "wall_seconds" of the process, and the cumulative microseconds of each imported
+    "modules" entry.
+    """
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    wall_seconds = time.perf_counter() - start
+
+    modules = {}
+    import_us = 0
+
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+
+        try:
+            cumulative = int(cumulative)
+        except ValueError:
+            #The header line
+            continue
+
+        modules[name.strip()] = cumulative
+
+        #Top-level imports are the ones without indentation after the separator
+        if name.startswith(" ") and not name.startswith("  "):
+            import_us += cumulative
+
+    return {"import_us": import_us, "wall_seconds": wall_seconds, "modules": modules}
+
+
+def bench_startup(repeat: int = 5) -> dict:
+    """
+    Profiles every target `repeat` times, keeping the fastest run of each.
+
+    Returns
+    -------
+    results, a dict mapping "startup.<target>" to its "seconds" of import time and
+    "wall_seconds", along with the "modules" of its fastest run.
+    """
+
+    results = {}
+
+    for target, code in TARGETS.items():
+        best = min((import_profile(code) for _ in range(repeat)), key=lambda profile: profile["import_us"])
+
+        results[f"startup.{target}"] = {
+            "seconds": best["import_us"] / 1e6,
+            "wall_seconds": best["wall_seconds"],
+            "modules": best["modules"],
+        }
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="The number of runs per target, of which the fastest is kept")
+    parser.add_argument("--top", type=int, default=5, help="The number of slowest imports to list per target")
+    parser.add_argument("--json", default=None, help="An optional path to also write the results to, as JSON")
+    args = parser.parse_args()
+
+    results = bench_startup(args.repeat)
+
+    print(f"{'target':<22}{'import ms':>12}{'wall ms':>12}")
+    for target, result in results.items():
+        print(f"{target:<22}{1e3 * result['seconds']:>12.1f}{1e3 * result['wall_seconds']:>12.1f}")
+
+    for target, result in results.items():
+        slowest = sorted(result["modules"].items(), key=lambda item: -item[1])[:args.top]
+        print(f"\nslowest imports of {target}:")
+        for name, cumulative in slowest:
+            print(f"  {name:<40}{cumulative / 1e3:>10.1f} ms")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    loaded = sorted(
+        {name for target in ("startup.cli", "startup.cli --help") for name in results[target]["modules"]} & set(CLI_FORBIDDEN)
+    )
+
+    if loaded:
+        print(f"\nThe CLI imports {', '.join(loaded)} before running a command")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
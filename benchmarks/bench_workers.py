@@ -0,0 +1,165 @@
+"""
+Measures the memory of each worker process of a multi-worker API deployment, for
+each way a worker can get at the dataset:
+    - private: reads the IDX files into its own memory
+    - mmap: memory-maps the IDX files, the default
+    - shared: attaches to a copy in shared memory, as under `number_generator.api.server`
+
+All workers of a run are alive together, each having loaded the dataset and generated
+a batch of images, when their memory is read from /proc/<pid>/smaps_rollup. USS, the
+memory only the worker holds, is what adding a worker costs, and PSS splits each
+shared page evenly between the processes mapping it. RSS counts every shared page in
+full. Linux only.
+
+Usage:
+    python -m benchmarks.bench_workers [--workers 4] [--num-images 60000] [--json results.json]
+"""
+
+from number_generator.script.dataload import get_loader, invalidate_loader
+import number_generator
+
+from .fixtures import write_synthetic_mnist
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+MODES = ("private", "mmap", "shared")
+
+#Run by each worker: loads the dataset, generates, reports ready, then its memory once told
+WORKER = """
+import json, os, sys, time
+start = time.perf_counter()
+from number_generator.script.dataload import MNIST_Loader, preload_MNIST
+from number_generator.script.generate import generate_numbers_sequence_batch
+mode, download_directory = sys.argv[1:]
+if mode == "shared":
+    loader = preload_MNIST(download_directory)
+else:
+    loader = MNIST_Loader(download_directory, memory_map=mode == "mmap")
+    loader.load_MNIST()
+generate_numbers_sequence_batch([[1, 2, 3, 4, 5, 6, 7, 8, 9, 0]] * 256, (0, 10), 512, random_seed=0, loader=loader)
+ready_seconds = time.perf_counter() - start
+print("ready", flush=True)
+sys.stdin.readline()
+memory = {}
+with open("/proc/self/smaps_rollup") as f:
+    for line in f:
+        name, _, value = line.partition(":")
+        if value.strip().endswith("kB"):
+            memory[name] = 1024 * int(value.split()[0])
+print(json.dumps({"seconds": ready_seconds, "rss_bytes": memory["Rss"], "pss_bytes": memory["Pss"], "uss_bytes": memory["Private_Clean"] + memory["Private_Dirty"]}), flush=True)
+"""
+
+
+def measure_workers(mode: str, num_workers: int, download_directory: str) -> dict:
+    """
+    Starts `num_workers` workers loading the dataset the given way, and reads their memory.
+
+    Returns
+    -------
+    result, a dict with the mean "seconds" a worker took to become ready, and its mean
+    "rss_bytes", "pss_bytes" and "uss_bytes".
+    """
+
+    #Workers import this same copy of the package, from whatever folder they run in
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(number_generator.__file__)))
+    python_path = os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")]))
+
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, mode, download_directory],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            env=dict(os.environ, PYTHONPATH=python_path)
+        )
+        for _ in range(num_workers)
+    ]
+
+    try:
+        for worker in workers:
+            if worker.stdout.readline().strip() != "ready":
+                raise RuntimeError(f"A {mode} worker failed to start")
+
+        for worker in workers:
+            worker.stdin.write("\n")
+            worker.stdin.flush()
+
+        reports = [json.loads(worker.stdout.readline()) for worker in workers]
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+            worker.wait()
+
+    return {metric: sum(report[metric] for report in reports) / num_workers for metric in reports[0]}
+
+
+def bench_workers(download_directory: str, num_workers: int = 4) -> dict:
+    """
+    Measures the memory per worker of each mode, with one worker and with `num_workers`.
+
+    Returns
+    -------
+    results, a dict mapping "workers.<mode>.<count>" to its `measure_workers` result,
+    or an empty dict where /proc/self/smaps_rollup is not available.
+    """
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        return {}
+
+    from number_generator.script.shared import SHARED_DATASET_ENV, SharedDataset
+
+    download_directory = os.path.abspath(download_directory)
+    results = {}
+
+    for mode in MODES:
+        shared = None
+
+        if mode == "shared":
+            shared = SharedDataset.create(get_loader(download_directory))
+            invalidate_loader(download_directory)
+            os.environ[SHARED_DATASET_ENV] = shared.descriptor
+
+        try:
+            for count in sorted({1, num_workers}):
+                results[f"workers.{mode}.{count}"] = measure_workers(mode, count, download_directory)
+        finally:
+            if shared is not None:
+                del os.environ[SHARED_DATASET_ENV]
+                shared.close()
+                shared.unlink()
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="The number of workers to run at once")
+    parser.add_argument("--num-images", type=int, default=60000, help="The number of images in the synthetic dataset")
+    parser.add_argument("--json", default=None, help="An optional path to also write the results to, as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        download_directory = os.path.join(work_directory, "mnist")
+        write_synthetic_mnist(download_directory, args.num_images)
+
+        results = bench_workers(download_directory, args.workers)
+
+    print(f"{'stage':<22}{'ready ms':>10}{'RSS MiB':>10}{'PSS MiB':>10}{'USS MiB':>10}")
+    for stage, result in results.items():
+        print(
+            f"{stage:<22}{1e3 * result['seconds']:>10.1f}"
+            + "".join(f"{result[metric] / (1 << 20):>10.1f}" for metric in ("rss_bytes", "pss_bytes", "uss_bytes"))
+        )
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Writes a synthetic MNIST-like IDX dataset, so benchmarks and tests run offline and on any size.
+"""
+
+from number_generator.script.idxreader import write_idx
+
+import numpy as np
+import os
+
+
+def write_synthetic_mnist(download_directory: str, num_images: int = 60000, random_seed: int = 0) -> None:
+    """
+    Writes `train-images-idx3-ubyte` and `train-labels-idx1-ubyte` files holding random
+    28x28 glyphs of varying width and uniform random labels, in the layout MNIST_Loader expects.
+
+    Parameters
+    ----------
+    download_directory:
+        The folder to write the files into. Created if missing.
+    num_images:
+        The number of images to write. Default is 60000, the size of the MNIST training set.
+    random_seed:
+        The seed of the random glyphs and labels. Default is 0.
+
+    Returns
+    -------
+    None
+    """
+
+    os.makedirs(download_directory, exist_ok=True)
+
+    rng = np.random.default_rng(random_seed)
+
+    left = rng.integers(2, 10, size=num_images)
+    right = rng.integers(17, 26, size=num_images)
+
+    columns = np.arange(28)
+    rows = np.arange(28)
+
+    inked = (columns[None, :] >= left[:, None]) & (columns[None, :] <= right[:, None])
+    inked = inked[:, None, :] & ((rows >= 4) & (rows < 24))[None, :, None]
+
+    images = np.zeros((num_images, 28, 28), dtype=np.uint8)
+    images[inked] = rng.integers(1, 256, size=int(inked.sum()), dtype=np.uint8)
+
+    labels = rng.integers(0, 10, size=num_images).astype(np.uint8)
+
+    write_idx(os.path.join(download_directory, "train-images-idx3-ubyte"), images)
+    write_idx(os.path.join(download_directory, "train-labels-idx1-ubyte"), labels)
@@ -0,0 +1,465 @@
+"""
+Benchmarks loading, sampling, compositing, encoding, the CLI and the API, offline,
+against a synthetic MNIST-like dataset, and optionally checks the results against a
+baseline for regressions.
+
+Every stage reports its median time over --repeat runs and its peak traced memory.
+The startup stages report import and process times, see `benchmarks/bench_import.py`.
+The CLI stages also report images/sec, and the API stages requests/sec and the p50 /
+p99 latency of requests sent through an in-process client. The worker stages report
+the memory of each API worker process, see `benchmarks/bench_workers.py`.
+
+Usage:
+    python -m benchmarks.run [--num-images 60000] [--num-sequences 1000] [--num-requests 500]
+                             [--output results.json] [--baseline baseline.json]
+                             [--threshold 0.25] [--memory-threshold 0.10]
+
+Exits with status 1 if any metric regressed past its threshold against the baseline.
+"""
+
+from number_generator.script.augment import AUGMENTATIONS
+from number_generator.script.dataload import MNIST_Loader, get_loader, invalidate_loader
+from number_generator.script.encoding import encode_image
+from number_generator.script.generate import generate_numbers_sequence, generate_numbers_sequence_batch
+from number_generator.script.imageprocessor import space_images, pad_image_bounds
+
+from .bench_import import bench_startup
+from .bench_workers import bench_workers
+from .fixtures import write_synthetic_mnist
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+#Each compared metric, as name: (whether higher is better, which threshold applies)
+METRICS = {
+    "seconds": (False, "time"),
+    "wall_seconds": (False, "time"),
+    "images_per_sec": (True, "time"),
+    "requests_per_sec": (True, "time"),
+    "p50_ms": (False, "time"),
+    "p99_ms": (False, "time"),
+    "peak_bytes": (False, "memory"),
+    "rss_bytes": (False, "memory"),
+    "pss_bytes": (False, "memory"),
+    "uss_bytes": (False, "memory"),
+}
+
+#Changes smaller than these are noise, whatever their relative size
+NOISE_FLOORS = {
+    "seconds": 0.005,
+    "wall_seconds": 0.005,
+    "p50_ms": 1.0,
+    "p99_ms": 1.0,
+    "peak_bytes": 1 << 20,
+    "rss_bytes": 1 << 20,
+    "pss_bytes": 1 << 20,
+    "uss_bytes": 1 << 20,
+}
+
+ENCODINGS = ("png", "npy", "pgm", "raw")
+
+
+def measure(fn, repeat: int = 3, traced: bool = True) -> dict:
+    """
+    Times `fn` over `repeat` runs, and measures its peak memory over one extra traced
+    run, so the tracing overhead does not skew the timings.
+
+    Returns
+    -------
+    result, a dict with the median "seconds" and, if traced, the "peak_bytes".
+    """
+
+    result = {}
+
+    if traced:
+        tracemalloc.start()
+        try:
+            fn()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    result["seconds"] = float(np.median(timings))
+
+    return result
+
+
+def measure_requests(client, requests: list, warmup: int = 5) -> dict:
+    """
+    Sends each (path, json) request in turn, and reports the request rate and latency.
+
+    Returns
+    -------
+    result, a dict with "requests_per_sec", "p50_ms" and "p99_ms".
+    """
+
+    for path, body in requests[:warmup]:
+        client.post(path, json=body)
+
+    latencies = []
+
+    start = time.perf_counter()
+    for path, body in requests:
+        request_start = time.perf_counter()
+        response = client.post(path, json=body)
+        latencies.append(time.perf_counter() - request_start)
+
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} answered {response.status_code}: {response.text}")
+
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests_per_sec": len(requests) / elapsed,
+        "p50_ms": 1e3 * float(np.percentile(latencies, 50)),
+        "p99_ms": 1e3 * float(np.percentile(latencies, 99)),
+    }
+
+
+def bench_load(download_directory: str, repeat: int) -> dict:
+    """
+    Benchmarks opening the dataset: cold (computing the trim bounds sidecar), warm
+    (reading the sidecar), and eagerly read into memory instead of memory-mapped.
+    """
+
+    bounds_path = MNIST_Loader(download_directory).bounds_path
+
+    def load_cold():
+        if os.path.exists(bounds_path):
+            os.remove(bounds_path)
+
+        MNIST_Loader(download_directory).load_MNIST()
+
+    def load(memory_map):
+        return lambda: MNIST_Loader(download_directory, memory_map=memory_map).load_MNIST()
+
+    return {
+        "load.cold": measure(load_cold, repeat),
+        "load.warm": measure(load(True), repeat),
+        "load.eager": measure(load(False), repeat),
+    }
+
+
+def bench_generation(loader: MNIST_Loader, num_sequences: int, image_width: int, repeat: int) -> dict:
+    """
+    Benchmarks drawing digit images, and compositing them into sequence images: through
+    the legacy per-digit pipeline, one image at a time, and as one batch, then
+    augmenting the batch.
+    """
+
+    rng = np.random.default_rng(0)
+    digits = rng.integers(0, 10, size=(num_sequences, 10))
+    flat_digits = digits.ravel()
+
+    def fetch_each():
+        sample_rng = np.random.default_rng(0)
+        for digit in flat_digits:
+            loader.fetch_digit(digit, sample_rng)
+
+    def sample_all():
+        loader.sample_indices(flat_digits, np.random.default_rng(0))
+
+    def compose_legacy():
+        sample_rng = np.random.default_rng(0)
+        for i, sequence in enumerate(digits):
+            images = [loader.fetch_digit(digit, sample_rng) for digit in sequence]
+            pad_image_bounds(space_images(images, (0, 10), random_seed=i), image_width, random_seed=i)
+
+    def compose_each():
+        for i, sequence in enumerate(digits):
+            generate_numbers_sequence(sequence, (0, 10), image_width, random_seed=i, verbose=False, loader=loader, dtype=np.uint8)
+
+    def compose_batch():
+        generate_numbers_sequence_batch(digits, (0, 10), image_width, random_seed=0, loader=loader)
+
+    def augment_batch(names):
+        generate_numbers_sequence_batch(digits, (0, 10), image_width, random_seed=0, loader=loader, augment=names)
+
+    return {
+        "sample.fetch_digit": measure(fetch_each, repeat),
+        "sample.sample_indices": measure(sample_all, repeat),
+        "composite.legacy": measure(compose_legacy, repeat),
+        "composite.single": measure(compose_each, repeat),
+        "composite.batch": measure(compose_batch, repeat),
+        "augment.geometric": measure(lambda: augment_batch(["scale", "jitter", "rotation", "shear"]), repeat),
+        "augment.elastic": measure(lambda: augment_batch(["elastic"]), repeat),
+        "augment.blur_noise": measure(lambda: augment_batch(["blur", "noise"]), repeat),
+        "augment.all": measure(lambda: augment_batch(AUGMENTATIONS), repeat),
+    }
+
+
+def bench_encoding(loader: MNIST_Loader, num_sequences: int, image_width: int, repeat: int) -> dict:
+    """
+    Benchmarks encoding generated images with each supported encoding.
+    See `benchmarks/bench_encoding.py` for a comparison of PNG compression levels.
+    """
+
+    digits = np.random.default_rng(0).integers(0, 10, size=(num_sequences, 10))
+    images = generate_numbers_sequence_batch(digits, (0, 10), image_width, random_seed=0, loader=loader)
+
+    results = {}
+
+    for encoding in ENCODINGS:
+        results[f"encode.{encoding}"] = measure(lambda: [encode_image(image, encoding) for image in images], repeat)
+
+    return results
+
+
+def bench_cli(output_directory: str, num_images: int, image_width: int, repeat: int) -> dict:
+    """
+    Benchmarks the `generate-phone-numbers` command, writing image files and npy arrays.
+    """
+
+    from typer.testing import CliRunner
+    from number_generator.cli.cli import app
+
+    runner = CliRunner()
+
+    def invoke(output_format):
+        runs = []
+
+        def run():
+            #Every run writes a fresh folder, as sharded runs refuse to overwrite each other
+            run_directory = os.path.join(output_directory, f"{output_format}-{len(runs)}")
+            os.makedirs(run_directory)
+            runs.append(run_directory)
+
+            result = runner.invoke(app, [
+                "generate-phone-numbers",
+                "--min-spacing", "0", "--max-spacing", "10",
+                "--image-width", str(image_width),
+                "--num-images", str(num_images),
+                "--output-path", run_directory,
+                "--random-seed", "0",
+                "--output-format", output_format,
+                "--no-verbose"
+            ])
+
+            if result.exit_code != 0:
+                raise RuntimeError(f"generate-phone-numbers failed:\n{result.output}")
+
+        return run
+
+    results = {}
+
+    for output_format in ("files", "npy"):
+        result = measure(invoke(output_format), repeat, traced=False)
+        result["images_per_sec"] = num_images / result["seconds"]
+
+        results[f"cli.{output_format}"] = result
+
+    return results
+
+
+def bench_api(num_requests: int, image_width: int, repeat: int) -> dict:
+    """
+    Benchmarks the single image endpoints: seeded requests that miss the response
+    cache, seeded requests that hit it, and unseeded requests, all sent one at a time.
+    Then renders unseeded phone numbers for all requests at once, on their own and
+    coalesced into batches, as a loaded server does.
+    """
+
+    from fastapi.testclient import TestClient
+    from number_generator.api.api import app, render_phone_number
+    from number_generator.api.coalescer import Coalescer
+    from number_generator.api.executor import BoundedExecutor
+
+    def sequence(seed):
+        return {"sequence": [1, 2, 3, 4, 5, 6, 7, 8, 9], "min_spacing": 1, "max_spacing": 10, "image_width": image_width, "random_seed": seed}
+
+    phone_number = {"min_spacing": 1, "max_spacing": 10, "image_width": image_width}
+
+    with TestClient(app) as client:
+        results = {
+            "api.sequence_uncached": measure_requests(client, [("/generate-numbers-sequence", sequence(seed)) for seed in range(num_requests)]),
+            "api.sequence_cached": measure_requests(client, [("/generate-numbers-sequence", sequence(0))] * num_requests),
+            "api.phone_number": measure_requests(client, [("/generate-phone-number", phone_number)] * num_requests),
+        }
+
+    def concurrent(coalesce):
+        async def render_all():
+            executor = BoundedExecutor(max_pending=num_requests)
+
+            try:
+                if coalesce:
+                    coalescer = Coalescer(executor.run)
+                    renders = [coalescer.render(None, (1, 10), image_width, None, [], "png") for _ in range(num_requests)]
+                else:
+                    renders = [executor.run(render_phone_number, (1, 10), image_width, None, [], "png") for _ in range(num_requests)]
+
+                await asyncio.gather(*renders)
+            finally:
+                executor.shutdown()
+
+        result = measure(lambda: asyncio.run(render_all()), repeat, traced=False)
+        result["requests_per_sec"] = num_requests / result["seconds"]
+
+        return result
+
+    results["api.concurrent"] = concurrent(False)
+    results["api.concurrent_coalesced"] = concurrent(True)
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, memory_threshold: float) -> list:
+    """
+    Compares results against a baseline, metric by metric. Changes within a metric's
+    noise floor, see `NOISE_FLOORS`, are never reported.
+
+    Parameters
+    ----------
+    results:
+        The "results" of a benchmark run.
+    baseline:
+        The "results" of an earlier benchmark run.
+    threshold:
+        The largest allowed relative slowdown of any time, rate or latency metric.
+    memory_threshold:
+        The largest allowed relative growth of any peak memory metric.
+
+    Returns
+    -------
+    regressions, a list of messages, one per metric that regressed past its threshold.
+    """
+
+    thresholds = {"time": threshold, "memory": memory_threshold}
+    regressions = []
+
+    for stage, baseline_metrics in baseline.items():
+        for metric, old in baseline_metrics.items():
+            if stage not in results or metric not in results[stage] or metric not in METRICS or not old:
+                continue
+
+            new = results[stage][metric]
+            higher_is_better, kind = METRICS[metric]
+
+            change = (old - new) / old if higher_is_better else (new - old) / old
+
+            if abs(new - old) < NOISE_FLOORS.get(metric, 0):
+                continue
+
+            if change > thresholds[kind]:
+                regressions.append(f"{stage} {metric}: {old:.4g} -> {new:.4g} ({100 * change:+.1f}% worse, limit {100 * thresholds[kind]:.0f}%)")
+
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    print(f"{'stage':<26}{'seconds':>10}{'peak MiB':>10}{'images/s':>10}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'USS MiB':>9}")
+
+    for stage, metrics in results.items():
+        columns = [
+            ("seconds", 10, ".4f", 1),
+            ("peak_bytes", 10, ".1f", 1 / (1 << 20)),
+            ("images_per_sec", 10, ".0f", 1),
+            ("requests_per_sec", 10, ".0f", 1),
+            ("p50_ms", 9, ".2f", 1),
+            ("p99_ms", 9, ".2f", 1),
+            ("uss_bytes", 9, ".1f", 1 / (1 << 20)),
+        ]
+
+        line = f"{stage:<26}"
+        for metric, width, spec, scale in columns:
+            line += f"{metrics[metric] * scale:>{width}{spec}}" if metric in metrics else f"{'-':>{width}}"
+
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-images", type=int, default=60000, help="The number of images in the synthetic dataset")
+    parser.add_argument("--num-sequences", type=int, default=1000, help="The number of sequence images per generation, encoding and CLI stage")
+    parser.add_argument("--num-requests", type=int, default=500, help="The number of requests per API stage")
+    parser.add_argument("--num-workers", type=int, default=4, help="The number of API worker processes to measure the memory of at once")
+    parser.add_argument("--image-width", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3, help="The number of timed runs per stage")
+    parser.add_argument("--output", default=None, help="An optional path to write the results to, as JSON")
+    parser.add_argument("--baseline", default=None, help="An optional results file to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="The allowed relative slowdown per metric. Default is 0.25")
+    parser.add_argument("--memory-threshold", type=float, default=0.10, help="The allowed relative peak memory growth per metric. Default is 0.10")
+    args = parser.parse_args()
+
+    results = {}
+    cwd = os.getcwd()
+
+    for stage, result in bench_startup(args.repeat).items():
+        results[stage] = {"seconds": result["seconds"], "wall_seconds": result["wall_seconds"]}
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        #The CLI and API read the default 'mnist/' folder, so run from beside the fixture
+        os.chdir(work_directory)
+
+        try:
+            write_synthetic_mnist("mnist/", args.num_images)
+
+            results.update(bench_load("mnist/", args.repeat))
+
+            invalidate_loader()
+            loader = get_loader("mnist/")
+
+            results.update(bench_generation(loader, args.num_sequences, args.image_width, args.repeat))
+            results.update(bench_encoding(loader, args.num_sequences, args.image_width, args.repeat))
+            results.update(bench_cli(os.path.join(work_directory, "cli"), args.num_sequences, args.image_width, args.repeat))
+            results.update(bench_api(args.num_requests, args.image_width, args.repeat))
+            results.update(bench_workers("mnist/", args.num_workers))
+        finally:
+            invalidate_loader()
+            os.chdir(cwd)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "num_images": args.num_images,
+            "num_sequences": args.num_sequences,
+            "num_requests": args.num_requests,
+            "num_workers": args.num_workers,
+            "image_width": args.image_width,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline["results"], args.threshold, args.memory_threshold)
+
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+
+            sys.exit(1)
+
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
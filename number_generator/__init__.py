@@ -1,2 +1,34 @@
-from .script.generate import generate_numbers_sequence
-from .script.generate import generate_phone_number
+import importlib
+
+#Maps each public name to the module defining it. The modules are only imported on
+#first access, so importing the package, e.g. for the CLI, does not load numpy and OpenCV.
+#Relies on the module __getattr__ of PEP 562, hence Python 3.7 or later.
+_exports = {
+    "generate_numbers_sequence": ".script.generate",
+    "generate_phone_number": ".script.generate",
+    "generate_numbers_sequence_batch": ".script.generate",
+    "generate_phone_number_batch": ".script.generate",
+    "get_loader": ".script.dataload",
+    "preload_MNIST": ".script.dataload",
+    "invalidate_loader": ".script.dataload",
+    "SequenceStream": ".script.stream",
+    "sample_seed": ".script.seeding",
+    "sample_seeds": ".script.seeding",
+    "Augmentation": ".script.augment",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,21 +1,285 @@
 from ..script.generate import generate_numbers_sequence as gen_seq
 from ..script.generate import generate_phone_number as gen_phone
+from ..script.dataload import preload_MNIST
+from ..script.encoding import MEDIA_TYPES as IMAGE_MEDIA_TYPES, FILE_EXTENSIONS, encode_image
+from ..script.profiling import enable_profiling, disable_profiling
 from .api_models import GenerateSequenceRequest, GeneratePhoneNumberRequest
+from .api_models import GenerateSequenceBatchRequest, GeneratePhoneNumberBatchRequest, GenerateJobRequest
+from .batch import MEDIA_TYPES, sequence_chunks, phone_number_chunks, stream_archive
+from .executor import BoundedExecutor, ExecutorBusy
+from .coalescer import Coalescer
+from .pool import WarmPool
+from .jobs import JobQueue, file_chunks
+from .cache import ResponseCache, request_key, etag_matches
+from .settings import Settings
 
 from typing import List, Tuple, Optional
 
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 
-import cv2
+import asyncio
 import io
+import os
+import numpy as np
 
 app = FastAPI()
 
-@app.post("/generate-numbers-sequence", response_class=StreamingResponse, responses={200: {"content": {"image/png":{}}}})
-async def generate_numbers_sequence(gen_request: GenerateSequenceRequest) -> StreamingResponse:
+@app.on_event("startup")
+def startup() -> None:
     """
-    Generates a PNG image of a digit sequence, given a set of guiding parameters.
+    Loads the dataset once for the whole server, and starts the generation workers.
+    """
+
+    app.state.settings = Settings()
+
+    #Enabled first, so the dataset load is timed too
+    app.state.profile = enable_profiling() if app.state.settings.profile else None
+
+    mnist = preload_MNIST()
+
+    #OpenCV is imported lazily, so import it now rather than in the first PNG request
+    import cv2
+
+    #Seeded responses only stay valid for the dataset they were generated from
+    app.state.cache_salt = mnist.dataset_id
+    app.state.cache = ResponseCache(app.state.settings.cache_bytes)
+
+    app.state.executor = BoundedExecutor(
+        max_workers=app.state.settings.workers,
+        max_pending=app.state.settings.max_pending,
+        kind=app.state.settings.executor_kind
+    )
+
+    #Looks the executor up on every batch, so it can be swapped while running
+    if app.state.settings.batch_window_ms > 0 and app.state.settings.batch_max > 1:
+        app.state.coalescer = Coalescer(
+            lambda fn, *args: app.state.executor.run(fn, *args),
+            max_batch=app.state.settings.batch_max,
+            window=app.state.settings.batch_window_ms / 1000
+        )
+    else:
+        app.state.coalescer = None
+
+    if app.state.settings.pool_size > 0:
+        app.state.pool = WarmPool(
+            lambda: app.state.executor,
+            size=app.state.settings.pool_size,
+            max_configurations=app.state.settings.pool_configurations
+        )
+    else:
+        app.state.pool = None
+
+    if app.state.settings.job_workers > 0:
+        loop = asyncio.get_event_loop()
+
+        #Job shards are generated on the worker pool too, one call per job worker at a
+        #time, so jobs take a bounded share of it and wait while requests fill it
+        app.state.jobs = JobQueue(
+            app.state.settings.jobs_path,
+            workers=app.state.settings.job_workers,
+            run=lambda fn, *args: asyncio.run_coroutine_threadsafe(app.state.executor.run(fn, *args), loop).result()
+        )
+        app.state.jobs.start()
+    else:
+        app.state.jobs = None
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    if app.state.pool is not None:
+        app.state.pool.close()
+
+    #Off the event loop, which the job workers need to finish their current shard
+    if app.state.jobs is not None:
+        await asyncio.get_event_loop().run_in_executor(None, app.state.jobs.stop)
+
+    app.state.executor.shutdown()
+
+    if app.state.profile is not None:
+        disable_profiling()
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Runs a blocking generation call on the worker pool, keeping the event loop free.
+    Answers 503 with a Retry-After header if too many requests are already waiting.
+    """
+
+    try:
+        return await app.state.executor.run(fn, *args, **kwargs)
+    except ExecutorBusy:
+        raise busy_error()
+
+
+def busy_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Too many generation requests are in progress, retry later.",
+        headers={"Retry-After": str(app.state.settings.retry_after)}
+    )
+
+
+async def render_image(
+    sequence: Optional[List[int]],
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    random_seed: Optional[int],
+    augment: List[str],
+    encoding: str = "png",
+    png_level: Optional[int] = None
+) -> bytes:
+    """
+    Generates and encodes the image of a single image request, of `sequence` or of a
+    random phone number if it is None, on the worker pool. Unless disabled, concurrent
+    requests are coalesced and generated together, which gives the same images.
+    """
+
+    if app.state.coalescer is not None:
+        try:
+            return await app.state.coalescer.render(sequence, spacing_range, image_width, random_seed, augment, encoding, png_level)
+        except ExecutorBusy:
+            raise busy_error()
+
+    if sequence is None:
+        return await run_blocking(render_phone_number, spacing_range, image_width, random_seed, augment, encoding, png_level)
+
+    return await run_blocking(render_sequence, sequence, spacing_range, image_width, random_seed, augment, encoding, png_level)
+
+
+def negotiate_encoding(gen_request: BaseModel, request: Request) -> str:
+    """
+    Picks the image encoding of a response: the request's `encoding` field if set,
+    otherwise the first supported media type of the Accept header, otherwise png.
+    """
+
+    if gen_request.encoding is not None:
+        return gen_request.encoding.value
+
+    for accepted in request.headers.get("accept", "").split(","):
+        media_type = accepted.split(";")[0].strip()
+
+        for encoding, encoding_media_type in IMAGE_MEDIA_TYPES.items():
+            if media_type == encoding_media_type:
+                return encoding
+
+    return "png"
+
+
+async def respond_image(
+    request: Request,
+    endpoint: str,
+    gen_request: BaseModel,
+    sequence: Optional[List[int]],
+    inline_filename: Optional[str] = None
+) -> Response:
+    """
+    Renders the encoded image response for a generation request, of `sequence` or of
+    a random phone number if it is None.
+
+    Seeded requests always produce the same image, so they get an ETag derived from
+    the request and encoding, are answered 304 when the client already holds that
+    ETag, and are served from the response cache when possible. Unseeded requests
+    bypass all of this, and are served from the warm pool when it is enabled.
+    """
+
+    encoding = negotiate_encoding(gen_request, request)
+    args = (
+        sequence,
+        (gen_request.min_spacing, gen_request.max_spacing),
+        gen_request.image_width,
+        gen_request.random_seed,
+        [name.value for name in gen_request.augment],
+        encoding,
+        gen_request.png_level
+    )
+
+    headers = {"Vary": "Accept", "X-Image-Shape": f"28,{gen_request.image_width}"}
+    if inline_filename is not None:
+        headers["Content-Disposition"] = f'inline; filename="{inline_filename}.{FILE_EXTENSIONS[encoding]}"'
+
+    media_type = IMAGE_MEDIA_TYPES[encoding]
+
+    if gen_request.random_seed is None:
+        image_bytes = None
+
+        if app.state.pool is not None:
+            sequence, spacing_range, image_width, _, augment, encoding, png_level = args
+            image_bytes = app.state.pool.pop(sequence, spacing_range, image_width, augment, encoding, png_level)
+
+        if image_bytes is None:
+            image_bytes = await render_image(*args)
+
+        return StreamingResponse(io.BytesIO(image_bytes), media_type=media_type, headers=headers)
+
+    key = request_key(f"{endpoint}.{encoding}", gen_request, app.state.cache_salt)
+    headers["ETag"] = f'"{key}"'
+
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    image_bytes = app.state.cache.get(key)
+
+    if image_bytes is None:
+        image_bytes = await render_image(*args)
+        app.state.cache.put(key, image_bytes)
+
+    return StreamingResponse(io.BytesIO(image_bytes), media_type=media_type, headers=headers)
+
+
+def render_sequence(
+    sequence: List[int],
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    random_seed: Optional[int],
+    augment: List[str],
+    encoding: str = "png",
+    png_level: Optional[int] = None
+) -> bytes:
+    """
+    Generates a digit sequence image and encodes it, see `encode_image`.
+    """
+
+    image = gen_seq(
+        digits=sequence,
+        spacing_range=spacing_range,
+        image_width=image_width,
+        random_seed=random_seed,
+        dtype=np.uint8,
+        augment=augment
+    )
+
+    return encode_image(image, encoding, png_level)
+
+
+def render_phone_number(
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    random_seed: Optional[int],
+    augment: List[str],
+    encoding: str = "png",
+    png_level: Optional[int] = None
+) -> bytes:
+    """
+    Generates a phone number image and encodes it, see `encode_image`.
+    """
+
+    image = gen_phone(
+        spacing_range=spacing_range,
+        image_width=image_width,
+        random_seed=random_seed,
+        dtype=np.uint8,
+        augment=augment
+    )
+
+    return encode_image(image, encoding, png_level)
+
+
+@app.post("/generate-numbers-sequence", response_class=StreamingResponse, responses={200: {"content": {media_type: {} for media_type in IMAGE_MEDIA_TYPES.values()}}, 304: {"description": "Not Modified"}})
+async def generate_numbers_sequence(gen_request: GenerateSequenceRequest, request: Request) -> Response:
+    """
+    Generates an image of a digit sequence, given a set of guiding parameters.
 
     See `GenerateSequenceRequest` object model for guidelines on parameters.
 
@@ -24,26 +288,26 @@ async def generate_numbers_sequence(gen_request: GenerateSequenceRequest) -> Str
             A `GenerateSequenceRequest` object
 
     Output:
-        The PNG image, streamed as an "image/png" media type byte string.
+        The image, streamed as a byte string. PNG ("image/png") by default, or the
+        npy, pgm or raw encoding chosen by the `encoding` field or the Accept header.
+        Seeded requests carry an ETag, and are answered 304 Not Modified when sent
+        with a matching If-None-Match header.
     """
 
 
-    image = gen_seq(
-        digits=gen_request.sequence,
-        spacing_range=(gen_request.min_spacing, gen_request.max_spacing),
-        image_width=gen_request.image_width,
-        random_seed=gen_request.random_seed
+    return await respond_image(
+        request,
+        "generate-numbers-sequence",
+        gen_request,
+        gen_request.sequence,
+        inline_filename="image"
     )
 
-    image_bytes = cv2.imencode('.png', image)[1].tobytes()
-
-    return StreamingResponse(io.BytesIO(image_bytes), media_type="image/png", headers={'Content-Disposition':'inline; filename="image.png"'})
 
-
-@app.post("/generate-phone-number", response_class=StreamingResponse, responses={200: {"content": {"image/png":{}}}})
-async def generate_phone_number(gen_request: GeneratePhoneNumberRequest) -> StreamingResponse:
+@app.post("/generate-phone-number", response_class=StreamingResponse, responses={200: {"content": {media_type: {} for media_type in IMAGE_MEDIA_TYPES.values()}}, 304: {"description": "Not Modified"}})
+async def generate_phone_number(gen_request: GeneratePhoneNumberRequest, request: Request) -> Response:
     """
-    Generates a PNG image of a generated phone number, given a set of guiding parameters.
+    Generates an image of a generated phone number, given a set of guiding parameters.
 
     See `GeneratePhoneNumberRequest` object model for guidelines on parameters.
 
@@ -52,15 +316,216 @@ async def generate_phone_number(gen_request: GeneratePhoneNumberRequest) -> Stre
             A `GeneratePhoneNumberRequest` object
 
     Output:
-        The PNG image, streamed as an "image/png" media type byte string.
+        The image, streamed as a byte string. PNG ("image/png") by default, or the
+        npy, pgm or raw encoding chosen by the `encoding` field or the Accept header.
+        Seeded requests carry an ETag, and are answered 304 Not Modified when sent
+        with a matching If-None-Match header.
     """
 
-    image = gen_phone(
-        spacing_range=(gen_request.min_spacing, gen_request.max_spacing),
-        image_width=gen_request.image_width,
-        random_seed=gen_request.random_seed
+    return await respond_image(
+        request,
+        "generate-phone-number",
+        gen_request,
+        None
     )
 
-    image_bytes = cv2.imencode('.png', image)[1].tobytes()
 
-    return StreamingResponse(io.BytesIO(image_bytes), media_type="image/png")
+@app.post("/generate-numbers-sequence-batch", response_class=StreamingResponse, responses={200: {"content": MEDIA_TYPES}})
+async def generate_numbers_sequence_batch(gen_request: GenerateSequenceBatchRequest) -> StreamingResponse:
+    """
+    Generates an image for each of many digit sequences, streamed back as one archive.
+
+    See `GenerateSequenceBatchRequest` object model for guidelines on parameters.
+
+    Input:
+        gen_request:
+            A `GenerateSequenceBatchRequest` object
+
+    Output:
+        A zip, tar or npz archive of the images and their digit labels, streamed as it
+        is generated, a chunk of images at a time. 422 if the images are too narrow
+        for the digits, and 503 if too many generation requests are in progress.
+    """
+
+    chunks = sequence_chunks(
+        gen_request.sequences,
+        (gen_request.min_spacing, gen_request.max_spacing),
+        gen_request.image_width,
+        random_seed=gen_request.random_seed,
+        augment=[name.value for name in gen_request.augment]
+    )
+
+    return await batch_response(gen_request.format.value, chunks, len(gen_request.sequences), gen_request.image_width)
+
+
+@app.post("/generate-phone-number-batch", response_class=StreamingResponse, responses={200: {"content": MEDIA_TYPES}})
+async def generate_phone_number_batch(gen_request: GeneratePhoneNumberBatchRequest) -> StreamingResponse:
+    """
+    Generates many phone number images, streamed back as one archive.
+
+    See `GeneratePhoneNumberBatchRequest` object model for guidelines on parameters.
+
+    Input:
+        gen_request:
+            A `GeneratePhoneNumberBatchRequest` object
+
+    Output:
+        A zip, tar or npz archive of the images and their digit labels, streamed as it
+        is generated, a chunk of images at a time. 422 if the images are too narrow
+        for the digits, and 503 if too many generation requests are in progress.
+    """
+
+    chunks = phone_number_chunks(
+        gen_request.count,
+        (gen_request.min_spacing, gen_request.max_spacing),
+        gen_request.image_width,
+        random_seed=gen_request.random_seed,
+        augment=[name.value for name in gen_request.augment]
+    )
+
+    return await batch_response(gen_request.format.value, chunks, gen_request.count, gen_request.image_width)
+
+
+@app.post("/jobs", status_code=202)
+def submit_job(gen_request: GenerateJobRequest) -> dict:
+    """
+    Submits a bulk generation job, run in the background by the job workers.
+
+    See `GenerateJobRequest` object model for guidelines on parameters.
+
+    Input:
+        gen_request:
+            A `GenerateJobRequest` object
+
+    Output:
+        The status of the queued job, see `GET /jobs/{job_id}`. Poll that endpoint for
+        progress, and download the shards from `GET /jobs/{job_id}/shards/{shard}` as
+        they complete. Jobs survive server restarts, resuming from their last shard.
+        422 if the images are too narrow for the digits.
+    """
+
+    try:
+        return job_queue().submit(gen_request)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str) -> dict:
+    """
+    Reports the status and progress of a job.
+
+    Output:
+        The job's "status" (queued, running, completed, failed or cancelled), its
+        "request", the number of images "completed" out of "count", the number of
+        "shards" and the "completed_shards" ready to download, and the "error" of a
+        failed job. 404 if there is no such job.
+    """
+
+    return found(job_queue().status(job_id))
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str) -> dict:
+    """
+    Cancels a queued or running job. A running job stops before its next shard, and
+    its completed shards stay available for download.
+
+    Output:
+        The status of the job, see `GET /jobs/{job_id}`. 404 if there is no such job.
+    """
+
+    return found(job_queue().cancel(job_id))
+
+
+@app.get("/jobs/{job_id}/shards/{shard}", response_class=StreamingResponse, responses={200: {"content": MEDIA_TYPES}})
+def download_shard(job_id: str, shard: int) -> StreamingResponse:
+    """
+    Downloads a completed shard of a job.
+
+    Output:
+        The tar or npz shard file, streamed. 404 if the shard is not completed yet.
+    """
+
+    path = found(job_queue().shard_path(job_id, shard))
+    shard_format = os.path.splitext(path)[1][1:]
+
+    return StreamingResponse(
+        file_chunks(path),
+        media_type=MEDIA_TYPES[shard_format],
+        headers={"Content-Disposition": f'attachment; filename="{os.path.basename(path)}"'}
+    )
+
+
+def job_queue() -> JobQueue:
+    if app.state.jobs is None:
+        raise HTTPException(status_code=404, detail="Jobs are disabled.")
+
+    return app.state.jobs
+
+
+def found(value):
+    if value is None:
+        raise HTTPException(status_code=404, detail="Not found.")
+
+    return value
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """
+    Serves the time spent in each stage of image generation, as Prometheus histograms,
+    and the hits and misses of the warm pool.
+
+    Output:
+        The `number_generator_stage_seconds` histogram, labelled by stage, and the
+        `number_generator_pool_*` metrics, in the Prometheus text exposition format.
+        Each is left out when disabled by the NUMBER_GENERATOR_PROFILE or
+        NUMBER_GENERATOR_POOL_SIZE setting, and 404 is answered if both are.
+    """
+
+    if app.state.profile is None and app.state.pool is None:
+        raise HTTPException(status_code=404, detail="Profiling and the warm pool are disabled.")
+
+    text = ""
+
+    if app.state.profile is not None:
+        text += app.state.profile.to_prometheus()
+
+    if app.state.pool is not None:
+        text += app.state.pool.to_prometheus()
+
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+async def batch_response(batch_format: str, chunks, num_images: int, image_width: int) -> StreamingResponse:
+    """
+    Streams generated chunks back as an archive. The archive is produced lazily on the
+    worker pool, as the response body is sent, so the server holds only one chunk of
+    images at a time, and the whole stream counts as one pending request.
+
+    The first chunk is generated before responding, so that a request the pool is too
+    busy for, or whose images are too narrow, is answered 503 or 422 rather than with
+    an empty archive.
+    """
+
+    archive = app.state.executor.iterate(stream_archive(batch_format, chunks, num_images, image_width))
+
+    try:
+        first = await archive.__anext__()
+    except ExecutorBusy:
+        raise busy_error()
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    async def body():
+        yield first
+
+        async for data in archive:
+            yield data
+
+    return StreamingResponse(
+        body(),
+        media_type=MEDIA_TYPES[batch_format],
+        headers={'Content-Disposition': f'attachment; filename="batch.{batch_format}"'}
+    )
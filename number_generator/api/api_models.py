@@ -1,5 +1,29 @@
 from typing import List, Optional
-from pydantic import BaseModel, Field
+from enum import Enum
+from pydantic import BaseModel, Field, validator
+
+#The largest number of images a single batch request may ask for
+MAX_BATCH_IMAGES = 100000
+
+#The largest number of images a single job may ask for
+MAX_JOB_IMAGES = 100000000
+
+class ImageEncoding(str, Enum):
+    png = "png"
+    npy = "npy"
+    pgm = "pgm"
+    raw = "raw"
+
+class Augment(str, Enum):
+    scale = "scale"
+    jitter = "jitter"
+    rotation = "rotation"
+    shear = "shear"
+    elastic = "elastic"
+    blur = "blur"
+    noise = "noise"
+
+_AUGMENT_DESCRIPTION = "The augmentations to apply to the images, if any: scale, jitter, rotation, shear, elastic, blur or noise. They draw from the random seed too."
 
 class GenerateSequenceRequest(BaseModel):
     """
@@ -7,10 +31,20 @@ class GenerateSequenceRequest(BaseModel):
     """
 
     sequence: List[int] = Field(..., gt=0, description="An iterable of the int values to generate")
-    min_spacing: int = Field(..., gte=0, description="The int minimum amount of pixels between each digit")
-    max_spacing: int = Field(..., gte=0, description="The int minimum amount of pixels between each digit")
+    min_spacing: int = Field(..., ge=0, description="The int minimum amount of pixels between each digit")
+    max_spacing: int = Field(..., ge=0, description="The int minimum amount of pixels between each digit")
     image_width: int = Field(..., gt=0, description="The width of the image in pixels")
     random_seed: Optional[int] = Field(None, description="An optional int to use as random seed.")
+    augment: List[Augment] = Field([], description=_AUGMENT_DESCRIPTION)
+    encoding: Optional[ImageEncoding] = Field(None, description="An optional image encoding (png, npy, pgm or raw). If not given, it is negotiated from the Accept header, defaulting to png.")
+    png_level: Optional[int] = Field(None, ge=0, le=9, description="An optional PNG compression level, from 0 (fastest) to 9 (smallest).")
+
+    @validator("max_spacing")
+    def check_spacing(cls, max_spacing, values):
+        if "min_spacing" in values and max_spacing < values["min_spacing"]:
+            raise ValueError("max_spacing must be at least min_spacing")
+
+        return max_spacing
 
     class Config:
         schema_extra = {
@@ -28,16 +62,25 @@ class GeneratePhoneNumberRequest(BaseModel):
     """
     A helper model class for accessing the phone number generator through an API
 
-    __NOTE:__ This API request will only return a single image in response! This is
-    different from other interfaces to the library. In the interest of performance, the
-    user should instead call this API endpoint as many times as they need images, in a
-    parallel manner, to avoid long API runtimes.
+    __NOTE:__ This API request will only return a single image in response! To generate
+    many images, use the `/generate-phone-number-batch` endpoint instead, which streams
+    them back in a single archive.
     """
 
     min_spacing: int = Field(..., gt=0, description="The int minimum amount of pixels between each digit")
     max_spacing: int = Field(..., gt=0, description="The int minimum amount of pixels between each digit")
     image_width: int = Field(..., gt=0, description="The width of the image in pixels")
     random_seed: Optional[int] = Field(None, description="An optional int to use as random seed.")
+    augment: List[Augment] = Field([], description=_AUGMENT_DESCRIPTION)
+    encoding: Optional[ImageEncoding] = Field(None, description="An optional image encoding (png, npy, pgm or raw). If not given, it is negotiated from the Accept header, defaulting to png.")
+    png_level: Optional[int] = Field(None, ge=0, le=9, description="An optional PNG compression level, from 0 (fastest) to 9 (smallest).")
+
+    @validator("max_spacing")
+    def check_spacing(cls, max_spacing, values):
+        if "min_spacing" in values and max_spacing < values["min_spacing"]:
+            raise ValueError("max_spacing must be at least min_spacing")
+
+        return max_spacing
 
     class Config:
         schema_extra = {
@@ -48,3 +91,136 @@ class GeneratePhoneNumberRequest(BaseModel):
                 "random_seed": 0
             }
         }
+
+
+class BatchFormat(str, Enum):
+    zip = "zip"
+    tar = "tar"
+    npz = "npz"
+
+
+class GenerateSequenceBatchRequest(BaseModel):
+    """
+    A helper model class for generating many digit sequence images in one API call
+
+    The images are streamed back as a single archive, generated a chunk at a time.
+    """
+
+    sequences: List[List[int]] = Field(..., description="A list of sequences of int values (0-9), one image per sequence")
+    min_spacing: int = Field(..., ge=0, description="The int minimum amount of pixels between each digit")
+    max_spacing: int = Field(..., ge=0, description="The int maximum amount of pixels between each digit")
+    image_width: int = Field(..., gt=0, description="The width of the images in pixels")
+    random_seed: Optional[int] = Field(None, description="An optional int to use as random seed.")
+    augment: List[Augment] = Field([], description=_AUGMENT_DESCRIPTION)
+    format: BatchFormat = Field(BatchFormat.zip, description="The archive to stream: zip or tar of PNG and JSON label files, or an npz of image and label arrays")
+
+    @validator("sequences")
+    def check_sequences(cls, sequences):
+        if not 0 < len(sequences) <= MAX_BATCH_IMAGES:
+            raise ValueError(f"between 1 and {MAX_BATCH_IMAGES} sequences are required")
+
+        for sequence in sequences:
+            if len(sequence) == 0 or any(not 0 <= d <= 9 for d in sequence):
+                raise ValueError("each sequence must hold at least one digit, all in the range 0-9")
+
+        return sequences
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "sequences": [[1, 2, 3], [4, 5, 6, 7]],
+                "min_spacing": 0,
+                "max_spacing": 10,
+                "image_width": 256,
+                "random_seed": 0,
+                "format": "zip"
+            }
+        }
+
+
+class GeneratePhoneNumberBatchRequest(BaseModel):
+    """
+    A helper model class for generating many phone number images in one API call
+
+    The images are streamed back as a single archive, generated a chunk at a time.
+    """
+
+    count: int = Field(..., gt=0, le=MAX_BATCH_IMAGES, description="The number of images to generate")
+    min_spacing: int = Field(..., ge=0, description="The int minimum amount of pixels between each digit")
+    max_spacing: int = Field(..., ge=0, description="The int maximum amount of pixels between each digit")
+    image_width: int = Field(..., gt=0, description="The width of the images in pixels")
+    random_seed: Optional[int] = Field(None, description="An optional int to use as random seed.")
+    augment: List[Augment] = Field([], description=_AUGMENT_DESCRIPTION)
+    format: BatchFormat = Field(BatchFormat.zip, description="The archive to stream: zip or tar of PNG and JSON label files, or an npz of image and label arrays")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "count": 100,
+                "min_spacing": 0,
+                "max_spacing": 10,
+                "image_width": 512,
+                "random_seed": 0,
+                "format": "zip"
+            }
+        }
+
+
+class JobFormat(str, Enum):
+    tar = "tar"
+    npz = "npz"
+
+
+class GenerateJobRequest(BaseModel):
+    """
+    A helper model class for submitting a bulk generation job
+
+    The job runs in the background, writing the images as shards, which can be
+    downloaded as they complete. Its progress survives server restarts.
+    """
+
+    count: int = Field(..., gt=0, le=MAX_JOB_IMAGES, description="The number of images to generate")
+    sequences: Optional[List[List[int]]] = Field(None, description="Optional sequences of int values (0-9), all of the same length, drawn in turn, image i showing sequence i modulo their number. If not given, random phone numbers are generated.")
+    min_spacing: int = Field(..., ge=0, description="The int minimum amount of pixels between each digit")
+    max_spacing: int = Field(..., ge=0, description="The int maximum amount of pixels between each digit")
+    image_width: int = Field(..., gt=0, description="The width of the images in pixels")
+    random_seed: Optional[int] = Field(None, description="An optional int to use as random seed. If not given, one is drawn when the job is submitted, so a resumed job stays consistent.")
+    augment: List[Augment] = Field([], description=_AUGMENT_DESCRIPTION)
+    format: JobFormat = Field(JobFormat.tar, description="The shard format: tar of image and JSON label files, or npz of image and label arrays")
+    shard_size: int = Field(1000, gt=0, le=MAX_BATCH_IMAGES, description="The number of images per shard")
+    encoding: ImageEncoding = Field(ImageEncoding.png, description="The encoding of the images of tar shards (png, npy, pgm or raw)")
+    png_level: Optional[int] = Field(None, ge=0, le=9, description="An optional PNG compression level, from 0 (fastest) to 9 (smallest).")
+
+    @validator("sequences")
+    def check_sequences(cls, sequences):
+        if sequences is None:
+            return sequences
+
+        if not 0 < len(sequences) <= MAX_BATCH_IMAGES:
+            raise ValueError(f"between 1 and {MAX_BATCH_IMAGES} sequences are required")
+
+        for sequence in sequences:
+            if len(sequence) != len(sequences[0]) or len(sequence) == 0 or any(not 0 <= d <= 9 for d in sequence):
+                raise ValueError("the sequences must all hold the same, non-zero number of digits, all in the range 0-9")
+
+        return sequences
+
+    @validator("max_spacing")
+    def check_spacing(cls, max_spacing, values):
+        if "min_spacing" in values and max_spacing < values["min_spacing"]:
+            raise ValueError("max_spacing must be at least min_spacing")
+
+        return max_spacing
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "count": 100000,
+                "min_spacing": 0,
+                "max_spacing": 10,
+                "image_width": 512,
+                "random_seed": 0,
+                "format": "tar",
+                "shard_size": 1000
+            }
+        }
@@ -0,0 +1,231 @@
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from ..script.generate import generate_numbers_sequence_batch as gen_seq_batch
+from ..script.generate import generate_phone_number_batch as gen_phone_batch
+from ..script.dataload import MNIST_Loader, get_loader
+from ..script.shards import add_tar_member, label_json
+from ..script.encoding import encode_image
+
+import numpy as np
+import tarfile
+import zipfile
+
+#The number of images generated, encoded and sent at a time
+CHUNK_SIZE = 256
+
+#The number of digits of a generated phone number
+PHONE_NUMBER_LENGTH = 10
+
+MEDIA_TYPES = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+    "npz": "application/octet-stream",
+}
+
+
+class _ChunkWriter:
+    """
+    A write-only file object that collects written bytes until they are taken out.
+    It reports its position but cannot seek, so archive writers stream into it.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+
+        return data
+
+
+def check_image_width(
+    sequences: Optional[Sequence[Sequence[int]]],
+    min_spacing: int,
+    image_width: int,
+    loader: Optional[MNIST_Loader] = None
+) -> None:
+    """
+    Checks that every digit sequence, or a phone number if `sequences` is None, can
+    fit in `image_width`, drawn with the narrowest glyph of each of its digits and the
+    minimum spacing. A sequence that fits may still draw wider glyphs that do not.
+
+    Raises ValueError for the first sequence that can never fit.
+    """
+
+    if loader is None:
+        loader = get_loader()
+
+    narrowest = loader.narrowest_glyphs()
+
+    if sequences is None:
+        needed = PHONE_NUMBER_LENGTH * int(narrowest.min()) + (PHONE_NUMBER_LENGTH - 1) * min_spacing
+
+        if needed > image_width:
+            raise ValueError(f"Phone numbers need at least {needed} pixels, which is wider than image_width={image_width}")
+
+        return
+
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    digits = np.fromiter((d for sequence in sequences for d in sequence), dtype=np.intp, count=int(lengths.sum()))
+
+    needed = np.add.reduceat(narrowest[digits], np.cumsum(lengths) - lengths) + (lengths - 1) * min_spacing
+    row = int(np.argmax(needed))
+
+    if needed[row] > image_width:
+        raise ValueError(f"Sequence {row} needs at least {needed[row]} pixels, which is wider than image_width={image_width}")
+
+
+def sequence_chunks(
+    sequences: Sequence[Sequence[int]],
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    random_seed: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    augment: Sequence[str] = ()
+) -> Iterator[Tuple[np.ndarray, List[List[int]]]]:
+    """
+    Generates images of the given digit sequences, a chunk at a time. Every sequence
+    is checked to fit in `image_width` before the first chunk, see `check_image_width`.
+
+    Returns
+    -------
+    An iterator of (images, labels) pairs, with images a (chunk, 28, image_width)
+    uint8 array and labels the digit sequences they show.
+    """
+
+    check_image_width(sequences, spacing_range[0], image_width)
+
+    rng = np.random.default_rng(random_seed)
+
+    for start in range(0, len(sequences), chunk_size):
+        labels = [list(sequence) for sequence in sequences[start:start + chunk_size]]
+
+        yield gen_seq_batch(labels, spacing_range, image_width, random_seed=rng, augment=augment), labels
+
+
+def phone_number_chunks(
+    count: int,
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    random_seed: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    augment: Sequence[str] = ()
+) -> Iterator[Tuple[np.ndarray, List[List[int]]]]:
+    """
+    Generates `count` phone number images, a chunk at a time. Phone numbers are
+    checked to fit in `image_width` before the first chunk, see `check_image_width`.
+
+    Returns
+    -------
+    An iterator of (images, labels) pairs, see `sequence_chunks`.
+    """
+
+    check_image_width(None, spacing_range[0], image_width)
+
+    rng = np.random.default_rng(random_seed)
+
+    for start in range(0, count, chunk_size):
+        images, digits = gen_phone_batch(
+            min(chunk_size, count - start),
+            spacing_range,
+            image_width,
+            random_seed=rng,
+            return_digits=True,
+            augment=augment
+        )
+
+        yield images, digits.tolist()
+
+
+def stream_archive(
+    batch_format: str,
+    chunks: Iterator[Tuple[np.ndarray, List[List[int]]]],
+    num_images: int,
+    image_width: int
+) -> Iterator[bytes]:
+    """
+    Packs generated chunks into an archive, yielding the archive bytes as each chunk
+    is added, so that only one chunk of images is ever held in memory.
+
+    Parameters
+    ----------
+    batch_format:
+        "zip" or "tar" for an archive with a `{index}.png` image and a `{index}.json`
+        label member per image, or "npz" for an uncompressed npz holding an `images`
+        (num_images, 28, image_width) uint8 array and a `labels` int8 array, padded
+        with -1 where sequences are shorter than the longest one.
+    chunks:
+        An iterator of (images, labels) pairs, as from `sequence_chunks`.
+    num_images:
+        The total number of images the chunks hold.
+    image_width:
+        The width of the images in pixels.
+
+    Returns
+    -------
+    An iterator of byte strings, which concatenate into the archive.
+    """
+
+    writer = _ChunkWriter()
+    index = 0
+
+    if batch_format == "tar":
+        with tarfile.open(fileobj=writer, mode="w|") as tar:
+            for images, labels in chunks:
+                for image, digits in zip(images, labels):
+                    add_tar_member(tar, f"{index:08d}.png", encode_image(image))
+                    add_tar_member(tar, f"{index:08d}.json", label_json(index, digits))
+                    index += 1
+
+                yield writer.take()
+
+    elif batch_format == "zip":
+        with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            for images, labels in chunks:
+                for image, digits in zip(images, labels):
+                    archive.writestr(f"{index:08d}.png", encode_image(image))
+                    archive.writestr(f"{index:08d}.json", label_json(index, digits))
+                    index += 1
+
+                yield writer.take()
+
+    elif batch_format == "npz":
+        all_labels = []
+
+        with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            with archive.open("images.npy", mode="w", force_zip64=True) as member:
+                header = {"descr": "|u1", "fortran_order": False, "shape": (num_images, 28, image_width)}
+                np.lib.format.write_array_header_1_0(member, header)
+
+                for images, labels in chunks:
+                    member.write(np.ascontiguousarray(images, dtype=np.uint8).tobytes())
+                    all_labels.extend(labels)
+
+                    yield writer.take()
+
+            max_length = max((len(digits) for digits in all_labels), default=0)
+            label_array = np.full((len(all_labels), max_length), -1, dtype=np.int8)
+            for row, digits in enumerate(all_labels):
+                label_array[row, :len(digits)] = digits
+
+            with archive.open("labels.npy", mode="w") as member:
+                np.lib.format.write_array(member, label_array)
+
+    else:
+        raise ValueError(f"Unknown batch format {batch_format}")
+
+    yield writer.take()
@@ -0,0 +1,124 @@
+from typing import Optional
+from collections import OrderedDict
+from pydantic import BaseModel
+
+import hashlib
+import json
+import threading
+
+
+def request_key(endpoint: str, gen_request: BaseModel, salt: str = "") -> str:
+    """
+    Computes a canonical hash of a generation request, usable as a cache key and ETag.
+
+    Parameters
+    ----------
+    endpoint:
+        The name of the endpoint the request was sent to.
+    gen_request:
+        The request model. Its fields are serialized with sorted keys, so equal
+        requests always hash the same.
+    salt:
+        An optional string mixed into the hash, e.g. identifying the dataset, so keys
+        change whenever the same request would produce a different image. Default is "".
+
+    Returns
+    -------
+    key, a hex digest string.
+    """
+
+    canonical = json.dumps(
+        {"endpoint": endpoint, "salt": salt, "request": gen_request.dict()},
+        sort_keys=True,
+        separators=(",", ":")
+    )
+
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    A thread-safe, least recently used cache of encoded responses, bounded by the
+    total size in bytes of the cached values.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Parameters
+        ----------
+        max_bytes:
+            The total size of the cached values to stay under. 0 disables the cache.
+        """
+
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Returns the cached value for `key`, or None, marking it as recently used.
+        """
+
+        with self._lock:
+            value = self._entries.get(key)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        """
+        Caches `value` under `key`, evicting the least recently used values as needed.
+        Values larger than the whole budget are not cached.
+        """
+
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+
+            self._entries[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Checks whether an If-None-Match header value matches an ETag, using the weak
+    comparison HTTP specifies for If-None-Match.
+    """
+
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+
+        if candidate == "*":
+            return True
+
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+
+        if candidate == etag:
+            return True
+
+    return False
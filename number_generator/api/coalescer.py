@@ -0,0 +1,204 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from ..script.generate import generate_numbers_sequence as gen_seq
+from ..script.generate import generate_numbers_sequence_batch as gen_seq_batch
+from ..script.generate import generate_japanese_number
+from ..script.seeding import stage_streams
+from ..script.encoding import encode_image
+
+import asyncio
+import numpy as np
+
+#One request of a batch: (sequence or None for a phone number, random_seed, encoding, png_level)
+Item = Tuple[Optional[List[int]], Optional[int], str, Optional[int]]
+
+
+class Coalescer:
+    """
+    Collects concurrent single image requests for a short window, and generates them
+    together in one vectorized pass, each caller then getting its own encoded image.
+    A request arriving while no other one is waiting or being generated is started
+    at once, so the window only delays requests under contention.
+
+    Every image is drawn from its own seed, exactly as the single image functions
+    would draw it, so a request gets the same image whether it is coalesced or not,
+    and whatever it is coalesced with. Only requests sharing the spacing range, the
+    image width and the augmentations are generated together.
+
+    General order of use:
+        - Initialize Coalescer with the function to run blocking calls with
+        - Await `render` once per request
+    """
+
+    def __init__(
+        self,
+        run: Callable[..., Awaitable],
+        max_batch: int = 32,
+        window: float = 0.002
+    ):
+        """
+        Parameters
+        ----------
+        run:
+            An async function running a blocking call off the event loop, such as
+            `BoundedExecutor.run`. It runs one call per batch.
+        max_batch:
+            The largest number of requests to generate together. A batch is started as
+            soon as it is full. Default is 32.
+        window:
+            The longest time, in seconds, the first request of a batch waits for others
+            to join it, when other requests are already waiting or being generated.
+            Default is 0.002.
+
+        Returns
+        -------
+        self, a Coalescer.
+        """
+
+        self.run = run
+        self.max_batch = max_batch
+        self.window = window
+
+        self._pending: Dict[tuple, List[Tuple[Item, asyncio.Future]]] = {}
+        self._timers: Dict[tuple, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        #The number of requests of the batches started and not finished yet
+        self._running = 0
+
+    async def render(
+        self,
+        sequence: Optional[List[int]],
+        spacing_range: Tuple[int, int],
+        image_width: int,
+        random_seed: Optional[int],
+        augment: Sequence[str],
+        encoding: str = "png",
+        png_level: Optional[int] = None
+    ) -> bytes:
+        """
+        Generates an image and encodes it, see `render_batch`, as part of the next batch.
+        Exceptions of the generation, such as `ExecutorBusy`, are raised to every caller
+        of the batch.
+        """
+
+        loop = asyncio.get_event_loop()
+        key = (tuple(spacing_range), image_width, tuple(augment))
+        future = loop.create_future()
+
+        batch = self._pending.setdefault(key, [])
+        batch.append(((sequence, random_seed, encoding, png_level), future))
+
+        #A lone request has nothing to wait for
+        alone = len(batch) == 1 and len(self._pending) == 1 and not self._running
+
+        if alone or len(batch) >= self.max_batch:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: tuple) -> None:
+        batch = self._pending.pop(key, None)
+        timer = self._timers.pop(key, None)
+
+        if timer is not None:
+            timer.cancel()
+
+        if batch:
+            self._running += len(batch)
+            task = asyncio.ensure_future(self._run_batch(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, key: tuple, batch: List[Tuple[Item, asyncio.Future]]) -> None:
+        spacing_range, image_width, augment = key
+
+        try:
+            results = await self.run(render_batch, [item for item, _ in batch], spacing_range, image_width, list(augment))
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            self._running -= len(batch)
+
+        for (_, future), result in zip(batch, results):
+            #Callers that went away, e.g. on a client disconnect, cancel their future
+            if future.done():
+                continue
+
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def render_batch(
+    items: Sequence[Item],
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    augment: Sequence[str]
+) -> List[Union[bytes, Exception]]:
+    """
+    Generates the images of many requests in one vectorized pass, and encodes each.
+
+    Parameters
+    ----------
+    items:
+        The (sequence, random_seed, encoding, png_level) of each request, with a None
+        sequence for a random phone number.
+    spacing_range:
+        The (minimum, maximum) spacing between digits, in pixels, of all the images.
+    image_width:
+        The width of all the images, in pixels.
+    augment:
+        The names of the augmentations to apply to all the images.
+
+    Returns
+    -------
+    The encoded bytes of each image. If the batch fails, each image is generated on
+    its own instead, with `generate_numbers_sequence`, and the ones that still fail
+    get their exception.
+    """
+
+    sequences = [
+        sequence if sequence is not None else generate_japanese_number(stage_streams(random_seed, ("digits",))["digits"])
+        for sequence, random_seed, _, _ in items
+    ]
+
+    try:
+        images = gen_seq_batch(
+            sequences,
+            spacing_range,
+            image_width,
+            sample_seeds=[random_seed for _, random_seed, _, _ in items],
+            augment=augment
+        )
+    except Exception:
+        #A single bad request, e.g. too wide for the image, must not fail the others
+        return [
+            _render_single(sequence, item, spacing_range, image_width, augment)
+            for sequence, item in zip(sequences, items)
+        ]
+
+    return [encode_image(image, encoding, png_level) for image, (_, _, encoding, png_level) in zip(images, items)]
+
+
+def _render_single(
+    sequence: List[int],
+    item: Item,
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    augment: Sequence[str]
+) -> Union[bytes, Exception]:
+    """
+    Generates and encodes the image of one request of a failed batch, or gives its exception.
+    """
+
+    _, random_seed, encoding, png_level = item
+
+    try:
+        image = gen_seq(sequence, spacing_range, image_width, random_seed=random_seed, dtype=np.uint8, augment=augment)
+    except Exception as e:
+        return e
+
+    return encode_image(image, encoding, png_level)
@@ -0,0 +1,133 @@
+from typing import AsyncIterator, Callable, Iterator, Optional
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+from ..script.dataload import preload_MNIST
+from ..script.profiling import get_profile, run_profiled
+
+import asyncio
+import os
+
+#Marks the end of an iterator stepped on the pool
+_DONE = object()
+
+
+class ExecutorBusy(Exception):
+    """
+    Raised when a BoundedExecutor already holds its maximum number of pending calls.
+    """
+
+
+class BoundedExecutor:
+    """
+    Runs blocking, CPU-bound calls off the event loop, on a pool of threads or
+    processes, and refuses new calls once too many are waiting.
+
+    Refusing early keeps latency bounded under overload: callers get an immediate
+    error they can retry, instead of joining an ever growing queue.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None, kind: str = "thread"):
+        """
+        Starts the worker pool.
+
+        Parameters
+        ----------
+        max_workers:
+            The number of worker threads or processes. Default is None, which uses
+            the number of CPUs.
+        max_pending:
+            The maximum number of calls running or waiting at once. Default is None,
+            which allows four per worker.
+        kind:
+            "thread" to run calls on a thread pool, or "process" to run them on a
+            process pool whose workers each load the dataset once. Default is "thread".
+
+        Returns
+        -------
+        self, a BoundedExecutor ready to run calls.
+        """
+
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        if max_pending is None:
+            max_pending = 4 * max_workers
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+
+        if kind == "thread":
+            self.executor: Executor = ThreadPoolExecutor(max_workers=max_workers)
+        elif kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=preload_MNIST)
+        else:
+            raise ValueError(f"Unknown executor kind {kind}, expected 'thread' or 'process'")
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` on the pool, and waits for its result.
+
+        Raises ExecutorBusy, without running anything, if `max_pending` calls are
+        already running or waiting. While profiling, the stage times a process worker
+        records are merged into the active profile.
+        """
+
+        #Only ever touched from the event loop thread, so a plain counter is enough
+        if self.pending >= self.max_pending:
+            raise ExecutorBusy()
+
+        self.pending += 1
+
+        try:
+            loop = asyncio.get_event_loop()
+            profile = get_profile()
+
+            if self.kind == "process" and profile is not None:
+                result, snapshot = await loop.run_in_executor(self.executor, partial(run_profiled, fn, *args, **kwargs))
+                profile.merge(snapshot)
+
+                return result
+
+            return await loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    async def iterate(self, iterator: Iterator) -> AsyncIterator:
+        """
+        Steps through a blocking iterator on the pool, one item per call, and yields
+        its items. The iteration holds one pending call until it is exhausted or closed.
+
+        Raises ExecutorBusy on the first step, without running anything, if
+        `max_pending` calls are already running or waiting. An iterator cannot be
+        sent to a process pool, so there its steps run on the event loop's default
+        threads instead, still counted as pending.
+        """
+
+        if self.pending >= self.max_pending:
+            raise ExecutorBusy()
+
+        self.pending += 1
+
+        try:
+            loop = asyncio.get_event_loop()
+            executor = self.executor if self.kind == "thread" else None
+
+            while True:
+                item = await loop.run_in_executor(executor, next, iterator, _DONE)
+
+                if item is _DONE:
+                    return
+
+                yield item
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        """
+        Stops the worker pool, waiting for running calls to finish.
+        """
+
+        self.executor.shutdown(wait=True)
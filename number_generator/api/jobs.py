@@ -0,0 +1,466 @@
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from ..script.generate import generate_numbers_sequence_batch as gen_seq_batch
+from ..script.generate import generate_phone_number_batch as gen_phone_batch
+from ..script.seeding import sample_seed
+from ..script.shards import MANIFEST_NAME, ShardedDatasetWriter
+from .api_models import GenerateJobRequest
+from .batch import check_image_width
+from .executor import ExecutorBusy
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import numpy as np
+
+DATABASE_NAME = "jobs.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner INTEGER,
+    owner_host TEXT,
+    completed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class JobQueue:
+    """
+    A queue of bulk generation jobs, kept in a SQLite database and run by a pool of
+    worker threads, so no external broker is needed.
+
+    Each job writes its images as shards into its own folder, with a
+    ShardedDatasetWriter. Image i of a job is drawn from `sample_seed(seed, i)`, so a
+    job interrupted by a restart resumes from its completed shards, and generates the
+    same images it would have. Several server processes can share one queue: a job is
+    claimed by one of them at a time, and the jobs of a process that died are picked
+    up again by the next one to start on the same host, see `host_id`.
+
+    Nothing is written to disk until the first job is submitted.
+
+    General order of use:
+        - Initialize JobQueue with the folder to keep jobs in
+        - Call .start() to resume interrupted jobs and start the workers
+        - Call .submit() to add jobs, .status() to follow them, and .cancel() to stop them
+        - Download the completed shards at .shard_path()
+        - Call .stop() on shutdown
+    """
+
+    def __init__(
+        self,
+        path: str = "jobs/",
+        workers: int = 1,
+        poll_interval: float = 1.0,
+        run: Optional[Callable] = None
+    ):
+        """
+        Parameters
+        ----------
+        path:
+            A string path to the folder holding the database and the output of every job.
+            Default is 'jobs/'.
+        workers:
+            The number of jobs to run at a time, each on its own thread. Default is 1.
+        poll_interval:
+            The seconds between checks for jobs submitted by other processes, and between
+            attempts to run a shard while `run` is busy. Default is 1.0.
+        run:
+            A blocking function running a generation call `run(fn, *args)` elsewhere and
+            returning its result, such as one submitting it to the API's BoundedExecutor.
+            Each worker runs one call at a time, so jobs hold at most `workers` of its
+            pending calls, and while it raises ExecutorBusy the shard waits and tries
+            again. Default is None, which generates on the worker threads themselves.
+
+        Returns
+        -------
+        self, a JobQueue. Call .start() to run jobs.
+        """
+
+        self.path = path
+        self.database_path = os.path.join(path, DATABASE_NAME)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.run = run
+
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """
+        Requeues the jobs left running by processes of this host that are gone, or by
+        an earlier queue of this process, and starts the workers. Jobs left running on
+        another host, or before this host rebooted, cannot be probed: the first are
+        left to that host, and the second are requeued, as their process is gone.
+        """
+
+        if os.path.exists(self.database_path):
+            host = host_id()
+
+            for job_id, owner, owner_host in self._execute("SELECT id, owner, owner_host FROM jobs WHERE status = 'running'"):
+                if not _same_host(owner_host, host):
+                    continue
+
+                if owner_host != host or owner == os.getpid() or not _process_alive(owner):
+                    self._execute(
+                        "UPDATE jobs SET status = 'queued', owner = NULL, owner_host = NULL, updated = ? WHERE id = ? AND status = 'running'",
+                        (time.time(), job_id)
+                    )
+
+        self._stopping.clear()
+
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """
+        Stops the workers once their current shard is written. Their jobs stay running,
+        and resume when the queue is started again.
+        """
+
+        self._stopping.set()
+
+        with self._wake:
+            self._wake.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads.clear()
+
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def submit(self, gen_request: GenerateJobRequest) -> Dict:
+        """
+        Queues a job. An unseeded job gets a random seed now, so that it generates the
+        same images if it is resumed.
+
+        Raises ValueError, without queuing anything, if its sequences or phone numbers
+        can never fit in its image width, see `check_image_width`.
+
+        Returns
+        -------
+        status, the `status` of the new job.
+        """
+
+        check_image_width(gen_request.sequences, gen_request.min_spacing, gen_request.image_width)
+
+        if gen_request.random_seed is None:
+            gen_request = gen_request.copy(update={"random_seed": int(np.random.SeedSequence().entropy)})
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        self._execute(
+            "INSERT INTO jobs (id, request, status, created, updated) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, gen_request.json(), now, now),
+            create=True
+        )
+
+        with self._wake:
+            self._wake.notify()
+
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """
+        Describes a job: its parameters, status, progress and completed shards.
+
+        Returns
+        -------
+        status, a dict with the job "id", its "status" (queued, running, completed,
+        failed or cancelled), its "request", the number of images "completed" of
+        "count", the total number of "shards", the "completed_shards" ready to
+        download, the "error" of a failed job, and the "created" and "updated" UNIX
+        times. None if there is no such job.
+        """
+
+        rows = self._execute("SELECT request, status, completed, error, created, updated FROM jobs WHERE id = ?", (job_id,))
+
+        if not rows:
+            return None
+
+        request, status, completed, error, created, updated = rows[0]
+        request = json.loads(request)
+
+        return {
+            "id": job_id,
+            "status": status,
+            "request": request,
+            "count": request["count"],
+            "completed": completed,
+            "shards": -(-request["count"] // request["shard_size"]),
+            "completed_shards": sorted(int(shard) for shard in self._manifest(job_id).get("shards", {})),
+            "error": error,
+            "created": created,
+            "updated": updated,
+        }
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """
+        Cancels a queued or running job. A running job stops before its next shard, and
+        its completed shards stay available.
+
+        Returns
+        -------
+        status, the `status` of the job, or None if there is no such job.
+        """
+
+        self._execute(
+            "UPDATE jobs SET status = 'cancelled', updated = ? WHERE id = ? AND status IN ('queued', 'running')",
+            (time.time(), job_id)
+        )
+
+        return self.status(job_id)
+
+    def shard_path(self, job_id: str, shard: int) -> Optional[str]:
+        """
+        Gives the path of a completed shard of a job, or None if it is not completed.
+        """
+
+        entry = self._manifest(job_id).get("shards", {}).get(str(shard))
+
+        if entry is None:
+            return None
+
+        return os.path.join(self.path, job_id, entry["file"])
+
+    def _manifest(self, job_id: str) -> Dict:
+        #Job ids are only ever hex uuids, which also keeps paths inside the folder
+        if not all(c in "0123456789abcdef" for c in job_id):
+            return {}
+
+        try:
+            with open(os.path.join(self.path, job_id, MANIFEST_NAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            job = self._claim()
+
+            if job is None:
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+
+                continue
+
+            self._run(*job)
+
+    def _claim(self) -> Optional[Tuple[str, str]]:
+        """
+        Marks the oldest queued job as running in this process, and returns its
+        (id, request), or None if no job is queued.
+        """
+
+        if not os.path.exists(self.database_path):
+            return None
+
+        with self._lock:
+            connection = self._connect()
+
+            #Takes the write lock first, so no other process can claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                row = connection.execute("SELECT id, request FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET status = 'running', owner = ?, owner_host = ?, updated = ? WHERE id = ?",
+                        (os.getpid(), host_id(), time.time(), row[0])
+                    )
+            finally:
+                connection.execute("COMMIT")
+
+        return row
+
+    def _run(self, job_id: str, request: str) -> None:
+        gen_request = GenerateJobRequest.parse_raw(request)
+
+        try:
+            writer = ShardedDatasetWriter(
+                os.path.join(self.path, job_id),
+                gen_request.format.value,
+                gen_request.shard_size,
+                gen_request.count,
+                (28, gen_request.image_width),
+                10 if gen_request.sequences is None else len(gen_request.sequences[0]),
+                parameters={"job": job_id, "seeding": "per-sample"},
+                resume=True,
+                image_encoding=gen_request.encoding.value,
+                png_level=gen_request.png_level
+            )
+
+            for shard in writer.pending_shards():
+                #Left running on shutdown, to resume on the next start
+                if self._stopping.is_set():
+                    return
+
+                if self._execute("SELECT status FROM jobs WHERE id = ?", (job_id,))[0][0] != "running":
+                    return
+
+                generated = self._generate(generate_job_images, writer.shard_range(shard), gen_request)
+
+                #Stopped while waiting for a busy pool
+                if generated is None:
+                    return
+
+                writer.write_shard(shard, *generated)
+
+                completed = sum(entry["count"] for entry in writer.manifest["shards"].values())
+                self._execute("UPDATE jobs SET completed = ?, updated = ? WHERE id = ?", (completed, time.time(), job_id))
+
+            self._finish(job_id, "completed")
+        except Exception as e:
+            self._finish(job_id, "failed", f"{type(e).__name__}: {e}")
+
+    def _generate(self, fn: Callable, *args):
+        """
+        Runs a generation call with `run`, waiting and trying again while it is busy.
+        Returns None, without running it, if the queue stops meanwhile.
+        """
+
+        if self.run is None:
+            return fn(*args)
+
+        while True:
+            try:
+                return self.run(fn, *args)
+            except ExecutorBusy:
+                #Requests go first: a job only takes the pool once it has room
+                if self._stopping.wait(self.poll_interval):
+                    return None
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        #Only a job still running finishes, so a cancellation is never overwritten
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ? AND status = 'running'",
+            (status, error, time.time(), job_id)
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.path, exist_ok=True)
+
+            self._connection = sqlite3.connect(self.database_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._connection.execute(_SCHEMA)
+
+        return self._connection
+
+    def _execute(self, sql: str, parameters: tuple = (), create: bool = False) -> List[tuple]:
+        """
+        Runs one statement, returning its rows. Without `create`, a missing database
+        is treated as empty rather than created.
+        """
+
+        with self._lock:
+            if self._connection is None and not create and not os.path.exists(self.database_path):
+                return []
+
+            return self._connect().execute(sql, parameters).fetchall()
+
+
+def generate_job_images(indices: Sequence[int], gen_request: GenerateJobRequest) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generates the images of a job at the given indices with the batch engine, each
+    image from its own seed.
+
+    Returns
+    -------
+    (images, labels), the images and the digits of each, as `ShardedDatasetWriter.write_shard` takes them.
+    """
+
+    spacing_range = (gen_request.min_spacing, gen_request.max_spacing)
+    seeds = [sample_seed(gen_request.random_seed, i) for i in indices]
+    augment = [name.value for name in gen_request.augment]
+
+    if gen_request.sequences is None:
+        return gen_phone_batch(
+            len(indices),
+            spacing_range,
+            gen_request.image_width,
+            return_digits=True,
+            sample_seeds=seeds,
+            augment=augment
+        )
+
+    labels = np.array([gen_request.sequences[i % len(gen_request.sequences)] for i in indices], dtype=np.int64)
+
+    return gen_seq_batch(labels, spacing_range, gen_request.image_width, sample_seeds=seeds, augment=augment), labels
+
+
+def file_chunks(path: str, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+    """
+    Reads a file a chunk at a time, to stream it back without holding it in memory.
+    """
+
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+
+            if not chunk:
+                return
+
+            yield chunk
+
+
+def host_id() -> str:
+    """
+    Identifies this boot of this host, as "hostname/boot id", so the owner of a job
+    is never confused with a process of the same pid elsewhere, or before a reboot.
+    The boot id is only known on Linux, and left empty elsewhere.
+    """
+
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            boot_id = f.read().strip()
+    except OSError:
+        boot_id = ""
+
+    return f"{socket.gethostname()}/{boot_id}"
+
+
+def _same_host(owner_host: Optional[str], host: str) -> bool:
+    """
+    Whether `owner_host`, a `host_id`, names this host, in this boot or an earlier one.
+    """
+
+    return owner_host is not None and owner_host.rsplit("/", 1)[0] == host.rsplit("/", 1)[0]
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    """
+    Whether the local process `pid` is still running. Only checked on POSIX, where
+    signal 0 probes a process without touching it.
+    """
+
+    if pid is None or os.name != "posix":
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
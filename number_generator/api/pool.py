@@ -0,0 +1,192 @@
+from typing import Callable, Deque, Dict, Optional, Sequence, Tuple
+from collections import OrderedDict, deque
+
+from .coalescer import render_batch
+from .executor import BoundedExecutor, ExecutorBusy
+
+import asyncio
+
+
+class WarmPool:
+    """
+    Keeps ring buffers of pre-generated, pre-encoded random images, one per request
+    configuration, topped up in the background while generation workers are idle.
+
+    An unseeded request may get any fresh random image, so it can be answered with a
+    pop from the buffer of its configuration. A configuration gets a buffer the first
+    time it is requested; that request, and any that find the buffer empty, are
+    misses and are generated inline as usual. Only the most recently requested
+    configurations keep a buffer.
+
+    General order of use:
+        - Initialize WarmPool with the executor to generate on
+        - For each unseeded request, `pop` an image, generating it inline if None
+        - Read `hits`, `misses` or `hit_rate` to tune the size, or `to_prometheus`
+        - `close` it on shutdown
+    """
+
+    def __init__(
+        self,
+        executor: Callable[[], BoundedExecutor],
+        size: int = 64,
+        max_configurations: int = 8,
+        refill_batch: int = 16,
+        idle_wait: float = 0.005
+    ):
+        """
+        Parameters
+        ----------
+        executor:
+            A function giving the BoundedExecutor to generate on, looked up on every
+            refill so that the executor can be swapped while running.
+        size:
+            The number of images buffered per configuration. Default is 64.
+        max_configurations:
+            The number of configurations to keep a buffer for. Default is 8.
+        refill_batch:
+            The number of images generated per refill call. Smaller batches hand the
+            workers back to requests sooner. Default is 16.
+        idle_wait:
+            The seconds to wait before checking again for an idle worker. Default is 0.005.
+
+        Returns
+        -------
+        self, a WarmPool.
+        """
+
+        self.executor = executor
+        self.size = size
+        self.max_configurations = max_configurations
+        self.refill_batch = refill_batch
+        self.idle_wait = idle_wait
+
+        self.hits = 0
+        self.misses = 0
+
+        self._buffers: "OrderedDict[tuple, Deque[bytes]]" = OrderedDict()
+        self._refills: Dict[tuple, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of pops answered from a buffer, or 0 before the first pop.
+        """
+
+        total = self.hits + self.misses
+
+        return self.hits / total if total else 0.0
+
+    def pop(
+        self,
+        sequence: Optional[Sequence[int]],
+        spacing_range: Tuple[int, int],
+        image_width: int,
+        augment: Sequence[str],
+        encoding: str = "png",
+        png_level: Optional[int] = None
+    ) -> Optional[bytes]:
+        """
+        Takes a buffered image of `sequence`, or of a random phone number if it is None,
+        with the given parameters, and starts topping the buffer up again.
+
+        Returns
+        -------
+        The encoded image, or None if the buffer is empty.
+        """
+
+        key = (
+            None if sequence is None else tuple(sequence),
+            tuple(spacing_range),
+            image_width,
+            tuple(augment),
+            encoding,
+            png_level
+        )
+
+        buffer = self._buffers.get(key)
+
+        if buffer is None:
+            buffer = self._buffers[key] = deque(maxlen=self.size)
+
+            while len(self._buffers) > self.max_configurations:
+                evicted, _ = self._buffers.popitem(last=False)
+                refill = self._refills.pop(evicted, None)
+
+                if refill is not None:
+                    refill.cancel()
+        else:
+            self._buffers.move_to_end(key)
+
+        image = buffer.popleft() if buffer else None
+
+        if image is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        if key not in self._refills:
+            self._refills[key] = asyncio.ensure_future(self._refill(key, buffer))
+
+        return image
+
+    async def _refill(self, key: tuple, buffer: Deque[bytes]) -> None:
+        sequence, spacing_range, image_width, augment, encoding, png_level = key
+
+        try:
+            while len(buffer) < self.size:
+                executor = self.executor()
+
+                #Leaves the workers to requests, and only fills in while some are idle
+                if executor.pending >= executor.max_workers:
+                    await asyncio.sleep(self.idle_wait)
+                    continue
+
+                count = min(self.refill_batch, self.size - len(buffer))
+                items = [(None if sequence is None else list(sequence), None, encoding, png_level)] * count
+
+                try:
+                    images = await executor.run(render_batch, items, spacing_range, image_width, list(augment))
+                except ExecutorBusy:
+                    await asyncio.sleep(self.idle_wait)
+                    continue
+
+                images = [image for image in images if isinstance(image, bytes)]
+
+                #A configuration that cannot be generated is left to fail inline
+                if not images:
+                    break
+
+                buffer.extend(images)
+        finally:
+            if self._refills.get(key) is asyncio.current_task():
+                del self._refills[key]
+
+    def close(self) -> None:
+        """
+        Stops all refills and drops the buffered images.
+        """
+
+        for refill in self._refills.values():
+            refill.cancel()
+
+        self._refills.clear()
+        self._buffers.clear()
+
+    def to_prometheus(self, metric: str = "number_generator_pool") -> str:
+        """
+        Renders the pool's hits, misses and buffered images in the Prometheus text
+        exposition format.
+        """
+
+        return "\n".join([
+            f"# HELP {metric}_requests_total Unseeded requests answered from the warm pool (hit) or generated inline (miss).",
+            f"# TYPE {metric}_requests_total counter",
+            f'{metric}_requests_total{{result="hit"}} {self.hits}',
+            f'{metric}_requests_total{{result="miss"}} {self.misses}',
+            f"# HELP {metric}_images Pre-generated images held by the warm pool.",
+            f"# TYPE {metric}_images gauge",
+            f"{metric}_images {len(self)}",
+        ]) + "\n"
@@ -0,0 +1,52 @@
+"""
+Runs the API on several uvicorn worker processes that share one copy of the dataset.
+
+The dataset is loaded once, in this process, and copied into shared memory. Each
+worker attaches to it read-only as it starts up, see `SharedDataset`, so a worker adds
+almost no memory and becomes ready without reading the dataset files.
+
+Usage:
+    python -m number_generator.api.server [--host 0.0.0.0] [--port 80] [--workers 4]
+
+The number of workers defaults to the WEB_CONCURRENCY environment variable, as with
+uvicorn, and to 1 otherwise.
+"""
+
+from typing import List, Optional
+
+import argparse
+import os
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="The interface to bind to. Default is 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="The port to bind to. Default is 8000")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1)), help="The number of worker processes")
+    args = parser.parse_args(argv)
+
+    from ..script.dataload import get_loader, invalidate_loader
+    from ..script.shared import SHARED_DATASET_ENV, SharedDataset
+
+    import uvicorn
+
+    #The API reads the default 'mnist/' folder
+    shared = SharedDataset.create(get_loader())
+
+    #Only the shared copy is needed from here on
+    invalidate_loader()
+
+    #Workers inherit the environment, and attach in `preload_MNIST`
+    os.environ[SHARED_DATASET_ENV] = shared.descriptor
+
+    try:
+        uvicorn.run("number_generator.api.api:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        del os.environ[SHARED_DATASET_ENV]
+
+        shared.close()
+        shared.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from typing import Mapping, Optional
+import os
+
+
+def _env_int(environ: Mapping[str, str], name: str, default: Optional[int]) -> Optional[int]:
+    value = environ.get(name)
+
+    if value is None or value == "":
+        return default
+
+    return int(value)
+
+
+class Settings:
+    """
+    The runtime configuration of the API, read from `NUMBER_GENERATOR_*` environment variables.
+
+    Environment variables:
+        - NUMBER_GENERATOR_EXECUTOR: "thread" or "process", the kind of pool generation
+          runs on. Default is "thread".
+        - NUMBER_GENERATOR_WORKERS: the number of generation workers. Default is the CPU count.
+        - NUMBER_GENERATOR_MAX_PENDING: the number of requests allowed to run or wait for a
+          worker before new ones get a 503. Default is four per worker.
+        - NUMBER_GENERATOR_RETRY_AFTER: the seconds to send in the Retry-After header of a
+          503. Default is 1.
+        - NUMBER_GENERATOR_CACHE_BYTES: the size budget, in bytes, of the cache of seeded
+          responses. 0 disables the cache. Default is 64 MiB.
+        - NUMBER_GENERATOR_PROFILE: 1 to time each generation stage and serve the timings
+          at /metrics, or 0 to disable both. Default is 1.
+        - NUMBER_GENERATOR_BATCH_WINDOW_MS: the milliseconds a single image request waits
+          for concurrent ones to be generated together with, when others are already
+          waiting or being generated. A lone request never waits. 0 disables coalescing.
+          Default is 2.
+        - NUMBER_GENERATOR_BATCH_MAX: the largest number of single image requests
+          generated together. 1 disables coalescing. Default is 32.
+        - NUMBER_GENERATOR_POOL_SIZE: the number of random images to pre-generate, while
+          workers are idle, for each configuration of unseeded requests. 0 disables the
+          warm pool. Default is 0.
+        - NUMBER_GENERATOR_POOL_CONFIGURATIONS: the number of most recently requested
+          configurations to keep pre-generated images for. Default is 8.
+        - NUMBER_GENERATOR_JOBS_PATH: the folder holding the job database and the shards
+          of every job. Default is 'jobs/'.
+        - NUMBER_GENERATOR_JOB_WORKERS: the number of jobs run at a time. 0 disables the
+          job endpoints. Default is 1.
+    """
+
+    def __init__(self, environ: Optional[Mapping[str, str]] = None):
+        if environ is None:
+            environ = os.environ
+
+        self.executor_kind = environ.get("NUMBER_GENERATOR_EXECUTOR", "thread")
+        self.workers = _env_int(environ, "NUMBER_GENERATOR_WORKERS", None)
+        self.max_pending = _env_int(environ, "NUMBER_GENERATOR_MAX_PENDING", None)
+        self.retry_after = _env_int(environ, "NUMBER_GENERATOR_RETRY_AFTER", 1)
+        self.cache_bytes = _env_int(environ, "NUMBER_GENERATOR_CACHE_BYTES", 64 * 1024 * 1024)
+        self.profile = bool(_env_int(environ, "NUMBER_GENERATOR_PROFILE", 1))
+        self.batch_window_ms = _env_int(environ, "NUMBER_GENERATOR_BATCH_WINDOW_MS", 2)
+        self.batch_max = _env_int(environ, "NUMBER_GENERATOR_BATCH_MAX", 32)
+        self.pool_size = _env_int(environ, "NUMBER_GENERATOR_POOL_SIZE", 0)
+        self.pool_configurations = _env_int(environ, "NUMBER_GENERATOR_POOL_CONFIGURATIONS", 8)
+        self.jobs_path = environ.get("NUMBER_GENERATOR_JOBS_PATH", "jobs/")
+        self.job_workers = _env_int(environ, "NUMBER_GENERATOR_JOB_WORKERS", 1)
@@ -1,14 +1,45 @@
-from ..script.generate import generate_numbers_sequence as gen_seq
-from ..script.generate import generate_phone_number as gen_phone
+from ..script.profiling import enable_profiling, disable_profiling, get_profile, run_profiled, format_summary, stage
 
-from typing import List, Tuple, Optional
+from typing import TYPE_CHECKING, List, Sequence, Tuple, Optional
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+from enum import Enum
 
+import contextlib
 import typer
 import os
-import cv2
+
+#Generation needs numpy and OpenCV, which are slow to import, so each command imports
+#it only once it runs. `--help` and argument errors then answer without loading them.
+if TYPE_CHECKING:
+    from ..script.shards import ShardedDatasetWriter
+    import numpy as np
 
 app = typer.Typer()
 
+class OutputFormat(str, Enum):
+    files = "files"
+    tar = "tar"
+    npz = "npz"
+    npy = "npy"
+
+class ImageFormat(str, Enum):
+    png = "png"
+    npy = "npy"
+    pgm = "pgm"
+    raw = "raw"
+
+class Augment(str, Enum):
+    scale = "scale"
+    jitter = "jitter"
+    rotation = "rotation"
+    shear = "shear"
+    elastic = "elastic"
+    blur = "blur"
+    noise = "noise"
+
+#Shared by both generation commands
+_AUGMENT_HELP = "An augmentation to apply to the images, seeded with the run: scale, jitter, rotation, shear, elastic, blur or noise. Repeat to apply several. Default is none"
+
 @app.command("generate-numbers-sequence")
 def generate_numbers_sequence(
     sequence: List[int] = typer.Argument(..., help="An iterable of the int values to generate"),
@@ -17,7 +48,14 @@ def generate_numbers_sequence(
     image_width: int = typer.Option(..., help="The width of the image in pixels"),
     output_path: str = typer.Option(..., help="The filepath to save the generated image to"),
     random_seed: Optional[int] = typer.Option(None, help="An optional int to use as random seed. Default is None"),
-    verbose: bool = typer.Option(True, help="An optional flag of whether to print progress. Default is True")
+    format: Optional[ImageFormat] = typer.Option(
+        None,
+        help="An optional image encoding: png, npy, pgm or raw bytes. Default is None, which picks the format from the output_path extension"
+    ),
+    png_level: Optional[int] = typer.Option(None, min=0, max=9, help="An optional PNG compression level, from 0 (fastest) to 9 (smallest). Default is None"),
+    augment: List[Augment] = typer.Option([], help=_AUGMENT_HELP),
+    verbose: bool = typer.Option(True, help="An optional flag of whether to print progress. Default is True"),
+    profile: bool = typer.Option(False, help="Whether to print the time spent in each generation stage at the end. Default is False")
 ):
     """
     A CLI for utilizing the basic digit sequence generation function. Runs the routine
@@ -34,11 +72,32 @@ def generate_numbers_sequence(
         typer.echo(f"output_path received: {output_path}")
         typer.echo(f"random_seed received: {random_seed}")
 
-    #Generate image
-    image = gen_seq(sequence, (min_spacing, max_spacing), image_width, random_seed=random_seed, verbose=verbose)
+    from ..script.generate import generate_numbers_sequence as gen_seq
+    from ..script.encoding import encode_image
+    import cv2
+    import numpy as np
+
+    with _profiling(profile):
+        #Generate image
+        image = gen_seq(
+            sequence,
+            (min_spacing, max_spacing),
+            image_width,
+            random_seed=random_seed,
+            verbose=verbose,
+            dtype=np.uint8,
+            augment=[name.value for name in augment]
+        )
 
-    #Save image
-    cv2.imwrite(output_path, image)
+        #Save image
+        if format is None:
+            params = [] if png_level is None else [cv2.IMWRITE_PNG_COMPRESSION, png_level]
+
+            with stage("encode"):
+                cv2.imwrite(output_path, image, params)
+        else:
+            with open(output_path, "wb") as f:
+                f.write(encode_image(image, format.value, png_level))
 
 @app.command("generate-phone-numbers")
 def generate_phone_numbers(
@@ -48,7 +107,18 @@ def generate_phone_numbers(
     num_images: int = typer.Option(..., help="The number of images to generate"),
     output_path: str = typer.Option(..., help="The folderpath to save the generated images to"),
     random_seed: Optional[int] = typer.Option(None, help="An optional int to use as random seed. Default is None"),
-    verbose: bool = typer.Option(True, help="An optional flag of whether to print progress. Default is True")
+    workers: int = typer.Option(1, min=1, help="The number of processes to generate images with. Default is 1"),
+    output_format: OutputFormat = typer.Option(
+        OutputFormat.files,
+        help="Save one file per image, or pack images and digit labels into tar, npz or npy shards. Default is files"
+    ),
+    format: ImageFormat = typer.Option(ImageFormat.png, help="The encoding of image files and tar shard members: png, npy, pgm or raw bytes. Default is png"),
+    png_level: Optional[int] = typer.Option(None, min=0, max=9, help="An optional PNG compression level, from 0 (fastest) to 9 (smallest). Default is None"),
+    shard_size: int = typer.Option(10000, min=1, help="The number of images per shard, for shard formats. Default is 10000"),
+    resume: bool = typer.Option(False, help="Whether to resume an interrupted sharded run in output_path. Default is False"),
+    augment: List[Augment] = typer.Option([], help=_AUGMENT_HELP),
+    verbose: bool = typer.Option(True, help="An optional flag of whether to print progress. Default is True"),
+    profile: bool = typer.Option(False, help="Whether to print the time spent in each generation stage at the end. Default is False")
 ):
     """
     A CLI for generating digit sequences that match the pattern of Japanese phone numbers.
@@ -64,19 +134,345 @@ def generate_phone_numbers(
         typer.echo(f"num_images received: {num_images}")
         typer.echo(f"output_path received: {output_path}")
         typer.echo(f"random_seed received: {random_seed}")
+        typer.echo(f"workers received: {workers}")
+        typer.echo(f"output_format received: {output_format.value}")
+        typer.echo(f"format received: {format.value}")
+        typer.echo(f"augment received: {[name.value for name in augment]}")
+
+    with _profiling(profile):
+        if output_format != OutputFormat.files:
+            _generate_phone_shards(
+                (min_spacing, max_spacing),
+                image_width,
+                num_images,
+                output_path,
+                random_seed,
+                workers,
+                output_format.value,
+                shard_size,
+                resume,
+                format.value,
+                png_level,
+                [name.value for name in augment]
+            )
+        else:
+            _generate_phone_files(
+                (min_spacing, max_spacing),
+                image_width,
+                num_images,
+                output_path,
+                random_seed,
+                workers,
+                format.value,
+                png_level,
+                [name.value for name in augment]
+            )
+
+
+
+@app.command("build-pack")
+def build_pack(
+    download_directory: str = typer.Option("mnist/", help="The folder holding the MNIST data, downloaded if missing. Default is mnist/"),
+    output_path: Optional[str] = typer.Option(None, help="An optional path to write the pack to. Default is None, which writes it into download_directory, where it is loaded from"),
+    verbose: bool = typer.Option(True, help="An optional flag of whether to print progress. Default is True")
+):
+    """
+    Preprocesses the MNIST data into a glyph pack: every digit pre-trimmed, grouped by
+    digit, and stored in one file that loads in milliseconds. Only needs running once.
+    """
+
+    from ..script.dataload import MNIST_Loader
+    from ..script.glyphpack import GlyphPack, build_glyph_pack
+
+    loader = MNIST_Loader(download_directory=download_directory)
+
+    if not loader.downloaded_data:
+        loader.download_MNIST()
+
+    if output_path is None:
+        output_path = loader.pack_path
+
+    build_glyph_pack(loader.image_path, loader.label_path, output_path)
+
+    if verbose:
+        pack = GlyphPack(output_path)
+
+        typer.echo(f"Wrote {len(pack)} glyphs ({pack.columns.shape[0]} columns) to {output_path}")
+        typer.echo(f"Source images SHA-256: {pack.header['source']['image_sha256']}")
+        typer.echo(f"Pack size: {os.path.getsize(output_path)} bytes")
+
+@contextlib.contextmanager
+def _profiling(enabled: bool):
+    """
+    Times the generation stages of a command while enabled, printing a summary table
+    once the command succeeds.
+    """
+
+    if not enabled:
+        yield
+        return
+
+    profile = enable_profiling()
+
+    try:
+        yield
+    finally:
+        disable_profiling()
+
+    typer.echo(format_summary(profile))
+
+
+def _submit(executor: Executor, fn, *args) -> Future:
+    """
+    Submits `fn(*args)` to a worker process, bringing its stage times back while profiling.
+    """
+
+    if get_profile() is None:
+        return executor.submit(fn, *args)
+
+    return executor.submit(run_profiled, fn, *args)
+
+
+def _result(future: Future):
+    """
+    Gives the result of a `_submit` future, merging its stage times into the active profile.
+    """
+
+    profile = get_profile()
+
+    if profile is None:
+        return future.result()
+
+    result, snapshot = future.result()
+    profile.merge(snapshot)
+
+    return result
+
+
+def _generate_phone_files(
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    num_images: int,
+    output_path: str,
+    random_seed: Optional[int],
+    workers: int,
+    encoding: str = "png",
+    png_level: Optional[int] = None,
+    augment: Sequence[str] = ()
+) -> None:
+    """
+    Generates phone number images, saving one file per image into `output_path`.
+    """
+
+    from ..script.dataload import preload_MNIST
 
     #Generate each image and save them
-    with typer.progressbar(range(num_images), label="Generating") as progress:
-        for i in progress:
-            #Ensure that each image isn't exactly the same when giving a random seed
-            if random_seed is None:
-                seed = None
-            else:
-                seed = random_seed + i
-
-            #Generate image
-            image = gen_phone((min_spacing, max_spacing), image_width, random_seed=seed, verbose=verbose)
-
-            #Save image
-            output_full = os.path.join(output_path, f"phone_number_{i}.png")
-            cv2.imwrite(output_full, image)
+    if workers == 1:
+        with typer.progressbar(range(num_images), label="Generating") as progress:
+            for i in progress:
+                _save_phone_number(i, spacing_range, image_width, output_path, random_seed, encoding, png_level, augment)
+
+        return
+
+    #Split the work into a few chunks per worker, so the progress bar keeps moving
+    chunk_size = max(1, min(256, num_images // (workers * 8)))
+    chunks = [range(start, min(start + chunk_size, num_images)) for start in range(0, num_images, chunk_size)]
+
+    #Load (and if needed download) the data once up front, rather than racing in every worker
+    preload_MNIST()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=preload_MNIST) as executor:
+        futures = [
+            _submit(
+                executor,
+                _save_phone_numbers,
+                chunk,
+                spacing_range,
+                image_width,
+                output_path,
+                random_seed,
+                encoding,
+                png_level,
+                augment
+            )
+            for chunk in chunks
+        ]
+
+        with typer.progressbar(length=num_images, label="Generating") as progress:
+            for future in as_completed(futures):
+                progress.update(_result(future))
+
+
+def _image_seed(random_seed: Optional[int], i: int) -> Optional["np.random.SeedSequence"]:
+    """
+    Gives the seed of the i-th image of a run, see `sample_seed`. It only depends on the
+    run seed and i, so the files and shard outputs of a run hold the same images, however
+    they are split between workers and shards.
+    """
+
+    from ..script.seeding import sample_seed
+
+    if random_seed is None:
+        return None
+
+    return sample_seed(random_seed, i)
+
+
+def _save_phone_number(
+    i: int,
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    output_path: str,
+    random_seed: Optional[int],
+    encoding: str = "png",
+    png_level: Optional[int] = None,
+    augment: Sequence[str] = ()
+) -> None:
+    """
+    Generates the i-th phone number image of a run, and saves it into `output_path`.
+    """
+
+    from ..script.generate import generate_phone_number as gen_phone
+    from ..script.encoding import FILE_EXTENSIONS, encode_image
+    import numpy as np
+
+    image = gen_phone(
+        spacing_range,
+        image_width,
+        random_seed=_image_seed(random_seed, i),
+        verbose=False,
+        dtype=np.uint8,
+        augment=augment
+    )
+
+    output_full = os.path.join(output_path, f"phone_number_{i}.{FILE_EXTENSIONS[encoding]}")
+    with open(output_full, "wb") as f:
+        f.write(encode_image(image, encoding, png_level))
+
+
+def _save_phone_numbers(
+    indices: range,
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    output_path: str,
+    random_seed: Optional[int],
+    encoding: str = "png",
+    png_level: Optional[int] = None,
+    augment: Sequence[str] = ()
+) -> int:
+    """
+    Generates and saves a chunk of phone number images, returning how many were saved.
+    Runs inside the worker processes of `generate-phone-numbers --workers`.
+    """
+
+    for i in indices:
+        _save_phone_number(i, spacing_range, image_width, output_path, random_seed, encoding, png_level, augment)
+
+    return len(indices)
+
+
+def _generate_phone_shards(
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    num_images: int,
+    output_path: str,
+    random_seed: Optional[int],
+    workers: int,
+    shard_format: str,
+    shard_size: int,
+    resume: bool,
+    image_encoding: str = "png",
+    png_level: Optional[int] = None,
+    augment: Sequence[str] = ()
+) -> None:
+    """
+    Generates phone number images into tar, npz or npy shards, skipping the shards
+    an interrupted run already completed when resuming.
+    """
+
+    from ..script.dataload import preload_MNIST
+    from ..script.shards import ShardedDatasetWriter
+
+    parameters = {
+        "command": "generate-phone-numbers",
+        "spacing_range": list(spacing_range),
+        "random_seed": random_seed,
+        "seeding": "per-sample",
+        "augment": list(augment)
+    }
+
+    try:
+        writer = ShardedDatasetWriter(
+            output_path,
+            shard_format,
+            shard_size,
+            num_images,
+            (28, image_width),
+            10,
+            parameters=parameters,
+            resume=resume,
+            image_encoding=image_encoding,
+            png_level=png_level
+        )
+    except RuntimeError as e:
+        typer.echo(str(e), err=True)
+        raise typer.Exit(code=1)
+
+    pending = writer.pending_shards()
+
+    with typer.progressbar(length=num_images, label="Generating") as progress:
+        progress.update(num_images - sum(len(writer.shard_range(shard)) for shard in pending))
+
+        if workers == 1:
+            for shard in pending:
+                progress.update(_save_phone_shard(writer, shard, spacing_range, image_width, random_seed, augment))
+                writer.mark_complete(shard)
+
+            return
+
+        preload_MNIST()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=preload_MNIST) as executor:
+            futures = {
+                _submit(executor, _save_phone_shard, writer, shard, spacing_range, image_width, random_seed, augment): shard
+                for shard in pending
+            }
+
+            for future in as_completed(futures):
+                count = _result(future)
+                writer.mark_complete(futures[future])
+                progress.update(count)
+
+
+def _save_phone_shard(
+    writer: "ShardedDatasetWriter",
+    shard: int,
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    random_seed: Optional[int],
+    augment: Sequence[str] = ()
+) -> int:
+    """
+    Generates one shard of phone number images with the batch engine, and writes its
+    file, returning how many images it holds. The manifest is left to the caller.
+    """
+
+    from ..script.generate import generate_phone_number_batch as gen_phone_batch
+
+    indices = writer.shard_range(shard)
+
+    #Unseeded runs are not reproducible anyway, so they keep the faster shared stream
+    seeds = None if random_seed is None else [_image_seed(random_seed, i) for i in indices]
+
+    images, digits = gen_phone_batch(
+        len(indices),
+        spacing_range,
+        image_width,
+        return_digits=True,
+        sample_seeds=seeds,
+        augment=augment
+    )
+
+    writer.write_shard_file(shard, images, digits)
+
+    return len(indices)
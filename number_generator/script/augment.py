@@ -0,0 +1,365 @@
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple, Union
+import functools
+import numpy as np
+
+#The augmentations, in the order they draw their random numbers and are applied
+AUGMENTATIONS = ("scale", "jitter", "rotation", "shear", "elastic", "blur", "noise")
+
+#The strength of each augmentation, unless given otherwise:
+#    scale: the largest relative change in size of a glyph, e.g. 0.1 for 90% to 110%
+#    jitter: the largest vertical shift of a glyph, in pixels
+#    rotation: the largest rotation of a glyph, in degrees
+#    shear: the largest horizontal shear factor of a glyph
+#    elastic: the largest displacement of the elastic distortion, in pixels
+#    blur: the sigma of the Gaussian blur, in pixels
+#    noise: the standard deviation of the additive uniform noise, as a fraction of full scale
+DEFAULT_STRENGTHS = {
+    "scale": 0.1,
+    "jitter": 2.0,
+    "rotation": 8.0,
+    "shear": 0.2,
+    "elastic": 1.5,
+    "blur": 0.6,
+    "noise": 0.05,
+}
+
+#The spacing, in pixels, of the control points of the elastic distortion. Each one is
+#displaced at random, and the displacements are interpolated in between.
+ELASTIC_GRID = 7
+
+#The augmentations that move pixels, all done by one resampling of each image
+_WARPS = ("scale", "jitter", "rotation", "shear", "elastic")
+
+#The number of images augmented at a time. Small chunks keep the temporary arrays in
+#the CPU cache, which matters more than the per-chunk overhead.
+CHUNK_SIZE = 16
+
+
+class Augmentation:
+    """
+    Which augmentations to apply to generated images, and how strongly.
+
+    Augmentations are applied to the composed images, after spacing and padding. The
+    geometric ones, per-glyph scale, vertical jitter, rotation and shear, and the
+    elastic distortion, are folded into one sampling grid per image, which is then
+    resampled once, bilinearly. Blur and additive noise follow.
+
+    General order of use:
+        - Initialize Augmentation with the names of the augmentations to apply
+        - Pass it as the `augment` parameter of a generation function
+    """
+
+    def __init__(self, enabled: Iterable[str] = AUGMENTATIONS, strengths: Optional[Dict[str, float]] = None):
+        """
+        Parameters
+        ----------
+        enabled:
+            The names of the augmentations to apply, see `AUGMENTATIONS`. Default is all of them.
+        strengths:
+            An optional dict overriding the strength of some augmentations, see
+            `DEFAULT_STRENGTHS`. Default is None.
+
+        Returns
+        -------
+        self, an Augmentation.
+        """
+
+        enabled = set(enabled)
+        strengths = dict(DEFAULT_STRENGTHS, **(strengths or {}))
+
+        unknown = (enabled | set(strengths)) - set(AUGMENTATIONS)
+        if unknown:
+            raise ValueError(f"Unknown augmentations {sorted(unknown)}, expected some of {list(AUGMENTATIONS)}")
+
+        self.strengths = {name: float(strengths[name]) for name in AUGMENTATIONS if name in enabled}
+
+    def __bool__(self) -> bool:
+        return bool(self.strengths)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.strengths
+
+    def __repr__(self) -> str:
+        return f"Augmentation({self.strengths})"
+
+    @property
+    def warps(self) -> bool:
+        """
+        Whether any enabled augmentation moves pixels.
+        """
+
+        return any(name in self.strengths for name in _WARPS)
+
+
+def as_augmentation(augment: Union[None, Augmentation, Iterable[str]]) -> Optional[Augmentation]:
+    """
+    Gives the Augmentation of an `augment` parameter: an Augmentation, or an iterable
+    of augmentation names at their default strengths. None when nothing is enabled.
+    """
+
+    if augment is None:
+        return None
+
+    if not isinstance(augment, Augmentation):
+        augment = Augmentation([getattr(name, "value", name) for name in augment])
+
+    return augment if augment else None
+
+
+def augment_images(
+    images: np.ndarray,
+    rows: np.ndarray,
+    offsets: np.ndarray,
+    widths: np.ndarray,
+    augmentation: Augmentation,
+    rng: Union[np.random.Generator, Sequence[np.random.Generator]]
+) -> np.ndarray:
+    """
+    Augments a batch of composed images in place.
+
+    Each image is augmented with its own random numbers only, so with one generator
+    per image, an image comes out the same whatever batch it is augmented in.
+
+    Parameters
+    ----------
+    images:
+        A (num_images, height, width) batch of composed images, black digits on a white
+        background, as uint8 or float64 from 0 to 255, or float32 from 0 to 1.
+    rows:
+        An int array giving, for each glyph, the image it belongs to, in increasing order.
+    offsets:
+        An int array giving, for each glyph, the column of the image its left bound is on.
+    widths:
+        An int array giving, for each glyph, its width in pixels.
+    augmentation:
+        The augmentations to apply.
+    rng:
+        The numpy Generator to draw all random numbers from, or a sequence of one
+        Generator per image.
+
+    Returns
+    -------
+    images, the augmented input array.
+    """
+
+    import cv2
+
+    num_images, height, width = images.shape
+    full_scale = 1.0 if images.dtype == np.float32 else 255.0
+
+    rows = np.asarray(rows, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    widths = np.asarray(widths, dtype=np.int64)
+
+    for start in range(0, num_images, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, num_images)
+        first, last = np.searchsorted(rows, [start, end])
+
+        chunk_rng = rng if isinstance(rng, np.random.Generator) else rng[start:end]
+        glyph_counts = np.bincount(rows[first:last] - start, minlength=end - start)
+
+        #Augmented as ink on a black background, so pixels warped in from outside are empty
+        ink = np.subtract(np.float32(full_scale), images[start:end], dtype=np.float32)
+
+        if augmentation.warps:
+            map_x, map_y = _sampling_grids(
+                rows[first:last] - start,
+                offsets[first:last],
+                widths[first:last],
+                glyph_counts,
+                height,
+                width,
+                augmentation,
+                chunk_rng
+            )
+
+            warped = np.empty_like(ink)
+            for i in range(end - start):
+                cv2.remap(ink[i], map_x[i], map_y[i], cv2.INTER_LINEAR, dst=warped[i], borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+            ink = warped
+
+        if "blur" in augmentation:
+            blurred = np.empty_like(ink)
+            for i in range(end - start):
+                cv2.GaussianBlur(ink[i], (0, 0), augmentation.strengths["blur"], dst=blurred[i], borderType=cv2.BORDER_REFLECT_101)
+
+            ink = blurred
+
+        if "noise" in augmentation:
+            #Uniform noise is several times faster to draw than Gaussian noise
+            amplitude = np.float32(np.sqrt(12) * augmentation.strengths["noise"] * full_scale)
+
+            ink += amplitude * (_draw(
+                chunk_rng,
+                np.ones(end - start, dtype=np.int64),
+                lambda r, size: r.random(size + (height, width), dtype=np.float32)
+            ) - np.float32(0.5))
+
+        np.subtract(np.float32(full_scale), ink, out=ink)
+        np.clip(ink, 0, full_scale, out=ink)
+
+        if np.issubdtype(images.dtype, np.integer):
+            np.rint(ink, out=ink)
+
+        images[start:end] = ink
+
+    return images
+
+
+def _draw(
+    rng: Union[np.random.Generator, Sequence[np.random.Generator]],
+    counts: np.ndarray,
+    draw: Callable
+) -> np.ndarray:
+    """
+    Draws `counts[i]` values for each image i, with `draw(generator, (count,))`, either
+    at once from a shared generator, or from the generator of each image.
+    """
+
+    if isinstance(rng, np.random.Generator):
+        return draw(rng, (int(counts.sum()),))
+
+    return np.concatenate([draw(image_rng, (int(count),)) for image_rng, count in zip(rng, counts)])
+
+
+def _sampling_grids(
+    rows: np.ndarray,
+    offsets: np.ndarray,
+    widths: np.ndarray,
+    glyph_counts: np.ndarray,
+    height: int,
+    width: int,
+    augmentation: Augmentation,
+    rng: Union[np.random.Generator, Sequence[np.random.Generator]]
+):
+    """
+    Builds the (map_x, map_y) grids, each (num_images, height, width) float32, giving
+    for every output pixel the source pixel it is sampled from.
+
+    Every column belongs to the glyph whose center is nearest. Its pixels are mapped
+    through the inverse of the glyph's scale, shear and rotation about its center,
+    shifted by its jitter, then displaced by the elastic field. Pixels that land
+    outside their own glyph's columns are left empty.
+    """
+
+    num_images = glyph_counts.shape[0]
+    num_glyphs = rows.shape[0]
+    strengths = augmentation.strengths
+
+    def uniform(name):
+        if name not in strengths:
+            return np.zeros(num_glyphs)
+
+        return _draw(rng, glyph_counts, lambda r, size: r.uniform(-strengths[name], strengths[name], size=size))
+
+    scale = 1 + uniform("scale")
+    jitter = uniform("jitter")
+    angle = np.radians(uniform("rotation"))
+    shear = uniform("shear")
+
+    #The inverse of rotation @ shear @ scale, as [[a, b], [c, d]] per glyph
+    cos, sin = np.cos(angle), np.sin(angle)
+    a = (cos + shear * sin) / scale
+    b = (sin - shear * cos) / scale
+    c = -sin / scale
+    d = cos / scale
+
+    center_x = offsets + (widths - 1) / 2
+    center_y = (height - 1) / 2
+
+    #Columns change owner halfway between the centers of consecutive glyphs of an image
+    same_image = rows[1:] == rows[:-1]
+    changes = rows[:-1][same_image] * width + np.ceil((center_x[:-1] + center_x[1:])[same_image] / 2).astype(np.int64)
+    first_glyph = np.cumsum(glyph_counts) - glyph_counts
+
+    owner = np.bincount(changes, minlength=num_images * width).reshape(num_images, width).cumsum(axis=1)
+    owner += first_glyph[:, None]
+
+    #Per glyph, map_x = p + a * x + b * y and map_y = q + c * x + d * y, then the bounds of its columns
+    shift_y = center_y + jitter
+    glyph_params = np.stack([
+        a,
+        b,
+        c,
+        d,
+        center_x - a * center_x - b * shift_y,
+        center_y - c * center_x - d * shift_y,
+        offsets - 0.5,
+        offsets + widths - 0.5
+    ], axis=-1).astype(np.float32)
+
+    #Gathered per column, as (num_images, 1, width) arrays broadcasting over rows
+    a, b, c, d, p, q, left, right = np.moveaxis(glyph_params[owner], -1, 0)[:, :, None, :]
+
+    x = np.arange(width, dtype=np.float32)
+    y = np.arange(height, dtype=np.float32)[:, None]
+
+    map_x = b * y
+    map_x += p + a * x
+    map_y = d * y
+    map_y += q + c * x
+
+    if "elastic" in strengths:
+        fields = _draw(rng, np.full(num_images, 2), lambda r, size: r.uniform(-1, 1, size=size + _grid_shape(height, width)))
+        fields = fields.astype(np.float32) * np.float32(strengths["elastic"])
+
+        #Interpolates the control point displacements to every pixel, one axis at a time
+        lower, upper, lower_weight, upper_weight = _interpolation(width)
+        fields = fields[..., lower] * lower_weight + fields[..., upper] * upper_weight
+
+        lower, upper, lower_weight, upper_weight = _interpolation(height)
+        fields = fields[:, lower] * lower_weight[:, None] + fields[:, upper] * upper_weight[:, None]
+        fields = fields.reshape(num_images, 2, height, width)
+
+        map_x += fields[:, 0]
+        map_y += fields[:, 1]
+
+    #Empties the pixels sampled from outside their own glyph, e.g. from its neighbours
+    outside = map_x < left
+    outside |= map_x > right
+    np.putmask(map_x, outside, -2)
+
+    return map_x, map_y
+
+
+def _grid_points(size: int) -> int:
+    """
+    Gives the number of elastic control points covering `size` pixels: one every
+    ELASTIC_GRID pixels, and at least two, so each pixel lies between two of them.
+    """
+
+    return max(-(-(size - 1) // ELASTIC_GRID) + 1, 2)
+
+
+def _grid_shape(height: int, width: int) -> Tuple[int, int]:
+    """
+    Gives the (rows, columns) of elastic control points covering an image.
+    """
+
+    return (_grid_points(height), _grid_points(width))
+
+
+@functools.lru_cache(maxsize=64)
+def _interpolation(size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gives, for each of `size` pixels, the control points every ELASTIC_GRID pixels
+    on either side of it, and their float32 weights, to interpolate linearly between
+    values at the control points.
+
+    Returns
+    -------
+    (lower, upper, lower_weight, upper_weight), four read-only arrays of shape (size,).
+    """
+
+    points = _grid_points(size)
+    position = np.arange(size) / ELASTIC_GRID
+    lower = np.minimum(np.floor(position).astype(np.int64), points - 2)
+    fraction = position - lower
+
+    arrays = (lower, lower + 1, (1 - fraction).astype(np.float32), fraction.astype(np.float32))
+
+    for array in arrays:
+        array.flags.writeable = False
+
+    return arrays
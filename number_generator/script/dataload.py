@@ -1,11 +1,12 @@
-from typing import Optional
+from typing import Dict, Optional
 import numpy as np
-import idx2numpy
 import os
-import io
-import wget
-import zipfile
-import gzip
+import threading
+from .idxreader import read_idx
+from .labelindex import LabelIndex
+from .glyphpack import PACK_NAME, SOURCE_NAME, GlyphPack, PackedImages, dataset_id, source_checksums
+from .imageprocessor import compute_trim_bounds, compose_images, compose_batch, glyph_offsets
+from .profiling import stage
 
 class MNIST_Loader:
     """
@@ -15,9 +16,19 @@ class MNIST_Loader:
         - Initialze MNIST_Loader as a new object
         - Call the .load_MNIST() function to download/load the data
         - Call the .fetch_digit() function as many times as needed to fetch digits.
+
+    If the download directory holds a glyph pack built by `number-generator build-pack`,
+    the data is memory-mapped from the pack instead, see `GlyphPack`.
     """
 
-    def __init__(self, download_directory: str = "mnist/", random_seed: Optional[int] = None):
+    def __init__(
+        self,
+        download_directory: str = "mnist/",
+        random_seed: Optional[int] = None,
+        memory_map: bool = True,
+        source: Optional[str] = None,
+        checksums: Optional[Dict[str, str]] = None
+    ):
         """
         Initializes the MNIST Digit Loader.
         Sets needed path information for use in reading the dataset.
@@ -30,6 +41,20 @@ class MNIST_Loader:
         random_seed:
             An integer seed to feed to the random number generator when fetching a random digit.
             Default is None.
+        memory_map:
+            Whether to memory-map the IDX files instead of copying them into memory.
+            A memory-mapped dataset is shared through the OS page cache by every process
+            that loads it, and costs almost nothing to open. Set to False to eagerly read
+            the files into private memory. A glyph pack is always memory-mapped.
+            Default is True.
+        source:
+            Where to fetch the data from if it is not downloaded yet: a URL, a local zip
+            file or a local mirror folder, see `fetch_MNIST`. Default is None, which
+            uses the NUMBER_GENERATOR_MNIST_SOURCE environment variable if set, and
+            the public MNIST mirror otherwise.
+        checksums:
+            The expected MD5 checksums of the fetched files, see `fetch_MNIST`.
+            Default is None, which uses those of the original MNIST files.
 
         Returns
         -------
@@ -41,6 +66,9 @@ class MNIST_Loader:
 
         self.image_path = os.path.join(download_directory, "train-images-idx3-ubyte")
         self.label_path = os.path.join(download_directory, "train-labels-idx1-ubyte")
+        self.bounds_path = os.path.join(download_directory, "train-images-trim-bounds.npz")
+        self.pack_path = os.path.join(download_directory, PACK_NAME)
+        self.source_path = os.path.join(download_directory, SOURCE_NAME)
 
         if (not os.path.exists(self.image_path)) or (not os.path.exists(self.label_path)):
             self.downloaded_data = False
@@ -49,7 +77,21 @@ class MNIST_Loader:
 
         self.rng = np.random.default_rng(random_seed)
 
-        self.digit_mapping = None
+        self.memory_map = memory_map
+
+        self.source = source
+        self.checksums = checksums
+
+        self.label_index = None
+        self.trim_bounds = None
+        self.glyph_pack = None
+        self.shared_dataset = None
+
+        #Identifies the loaded data from the checksums of its IDX files, see `dataset_id`,
+        #e.g. to tell apart results generated from other data
+        self.dataset_id = None
+
+        self._narrowest_glyphs = None
 
 
     def load_MNIST(self) -> None:
@@ -69,21 +111,34 @@ class MNIST_Loader:
         None
         """
 
+        if self.load_pack():
+            return
+
         if not self.downloaded_data:
             self.download_MNIST()
 
-        self.image_array = idx2numpy.convert_from_file(self.image_path)
-        label_array = idx2numpy.convert_from_file(self.label_path)
+        with stage("load"):
+            if self.memory_map:
+                self.image_array = read_idx(self.image_path, mmap=True)
+                label_array = read_idx(self.label_path, mmap=True)
+            else:
+                import idx2numpy
 
-        self.digit_mapping = {}
+                self.image_array = idx2numpy.convert_from_file(self.image_path)
+                label_array = idx2numpy.convert_from_file(self.label_path)
 
-        for e, label in enumerate(label_array):
-            self.digit_mapping[label] = [e] + self.digit_mapping.get(label, [])
+            self.label_index = LabelIndex(label_array)
 
-    def download_MNIST(self) -> None:
+            #A one-off cost of the load, unlike the "trim" stage of each image
+            self.trim_bounds = self.load_trim_bounds()
+
+            self.dataset_id = dataset_id(*source_checksums(self.image_path, self.label_path, self.source_path))
+
+    def load_pack(self) -> bool:
         """
-        Downloads the MNIST dataset for use in selecting digits.
-        Will also extract the data.
+        Memory-maps the glyph pack of the download directory, if it has one. A pack
+        built from other IDX files than those in the directory is ignored, see
+        `GlyphPack.source_matches`.
 
         Parameters
         ----------
@@ -91,42 +146,93 @@ class MNIST_Loader:
 
         Returns
         -------
+        loaded, whether the data was loaded from a pack.
+        """
+
+        if not os.path.exists(self.pack_path):
+            return False
+
+        with stage("load"):
+            pack = GlyphPack(self.pack_path)
+
+            if self.downloaded_data and not pack.source_matches(self.image_path, self.label_path, self.source_path):
+                return False
+
+            self.glyph_pack = pack
+            self.image_array = PackedImages(pack)
+            self.label_index = pack.label_index()
+            self.trim_bounds = pack.trim_bounds()
+            self.dataset_id = pack.source_id
+
+        return True
+
+    def load_trim_bounds(self) -> np.ndarray:
+        """
+        Loads the precomputed (left, right) trim bounds of every image, computing
+        them if needed.
+
+        The bounds are cached in a small sidecar file next to the image file, which
+        is recomputed whenever the image file's size or modification time changes.
+        If the sidecar cannot be written, the bounds are still returned.
+
+        Parameters
+        ----------
         None
+
+        Returns
+        -------
+        bounds, an int16 array of shape (num_images, 2), see `compute_trim_bounds`.
         """
 
-        if not os.path.exists(self.download_directory):
-            os.makedirs(self.download_directory)
+        stat = os.stat(self.image_path)
 
-        zip_path = os.path.join(self.download_directory, "mnist.zip")
+        try:
+            with np.load(self.bounds_path) as cached:
+                if int(cached["size"]) == stat.st_size and int(cached["mtime_ns"]) == stat.st_mtime_ns:
+                    return cached["bounds"]
+        except (OSError, KeyError, ValueError):
+            pass
 
-        print("Downloading MNIST...")
-        wget.download("https://data.deepai.org/mnist.zip", zip_path)
+        bounds = compute_trim_bounds(self.image_array)
 
-        print("Download Completed!")
+        #Write to a temporary file first, so concurrent readers never see a partial sidecar
+        tmp_path = f"{self.bounds_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, bounds=bounds, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            os.replace(tmp_path, self.bounds_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
+        return bounds
 
-        print("Processing Extraction...")
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(self.download_directory)
+    def download_MNIST(self) -> None:
+        """
+        Downloads the MNIST dataset for use in selecting digits.
+        Will also extract the data.
 
-        image_path_gz = f"{self.image_path}.gz"
-        with gzip.open(image_path_gz, "r") as ip:
-            content = ip.read()
+        The files are streamed from the loader's source and decompressed on the fly,
+        see `fetch_MNIST`, so memory use stays constant during the download.
 
-        with open(self.image_path, "wb") as f:
-            f.write(content)
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
 
-        label_path_gz = f"{self.label_path}.gz"
-        with gzip.open(label_path_gz, "rb") as ip:
-            content = ip.read()
+        #Only needed on first use, so the download machinery is imported here
+        from .download import fetch_MNIST
 
-        with open(self.label_path, "wb") as f:
-            f.write(content)
+        fetch_MNIST(self.download_directory, source=self.source, checksums=self.checksums)
 
-        print("Extraction Completed!")
+        self.downloaded_data = True
 
 
-    def fetch_digit(self, digit: int) -> np.ndarray:
+    def fetch_digit(self, digit: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
         """
         Fetch a random digit from the loaded MNIST dataset.
 
@@ -134,17 +240,235 @@ class MNIST_Loader:
         ----------
         digit:
             An integer in the range [0,9] to select from the dataset.
+        rng:
+            An optional numpy Generator to draw with instead of the loader's own.
+            This lets a single shared loader serve many independently seeded callers.
+            Default is None.
 
         Returns
         -------
         array, a numpy ndarray with the pixel data of the requested digit.
         """
 
-        if self.digit_mapping is None:
-            raise RuntimeError("MNIST_Loader must be loaded prior to use!")
-
-        ind = self.rng.choice(self.digit_mapping[digit])
+        ind = self.sample_indices(digit, rng=rng)
 
         array = self.image_array[ind]
 
         return array
+
+    def sample_indices(self, digits, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """
+        Draw a random dataset row for every requested digit, in one vectorized draw.
+
+        Parameters
+        ----------
+        digits:
+            An int, a sequence of ints in the range [0,9], or a (num_sequences, num_digits)
+            matrix of them.
+        rng:
+            An optional numpy Generator to draw with instead of the loader's own.
+            Default is None.
+
+        Returns
+        -------
+        indices, an int array of the same shape as `digits` with the drawn row numbers.
+        """
+
+        if self.label_index is None:
+            raise RuntimeError("MNIST_Loader must be loaded prior to use!")
+
+        if rng is None:
+            rng = self.rng
+
+        return self.label_index.sample(digits, rng)
+
+    def fetch_digits(self, digits, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """
+        Fetch a random sample of every requested digit from the loaded MNIST dataset.
+
+        Draws the same digits, from the same random stream, as calling `fetch_digit`
+        once per digit, but with a single vectorized draw and gather.
+
+        Parameters
+        ----------
+        digits:
+            A sequence of ints in the range [0,9], or a (num_sequences, num_digits)
+            matrix of them.
+        rng:
+            An optional numpy Generator to draw with instead of the loader's own.
+            Default is None.
+
+        Returns
+        -------
+        array, a numpy ndarray of shape `digits.shape + (28, 28)` with the pixel data.
+        """
+
+        indices = self.sample_indices(digits, rng=rng)
+
+        return np.asarray(self.image_array[indices])
+
+    def narrowest_glyphs(self) -> np.ndarray:
+        """
+        Gives the width in pixels of the narrowest trimmed glyph of each label, or 0
+        for a label without any glyph. Computed on first use.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        widths, an int64 array of shape (num_labels,).
+        """
+
+        if self._narrowest_glyphs is None:
+            if self.label_index is None:
+                raise RuntimeError("MNIST_Loader must be loaded prior to use!")
+
+            widths = self.trim_bounds[:, 1].astype(np.int64) - self.trim_bounds[:, 0] + 1
+            grouped = widths[self.label_index.order]
+            offsets = self.label_index.offsets
+
+            self._narrowest_glyphs = np.array(
+                [grouped[start:end].min() if end > start else 0 for start, end in zip(offsets[:-1], offsets[1:])],
+                dtype=np.int64
+            )
+
+        return self._narrowest_glyphs
+
+    def compose_images(
+        self,
+        indices: np.ndarray,
+        bounds: np.ndarray,
+        spacings: np.ndarray,
+        left_width: int,
+        image_width: int,
+        dtype=np.uint8
+    ) -> np.ndarray:
+        """
+        Builds an inverted sequence image of the given dataset rows, see `compose_images`.
+        With a glyph pack, each digit is copied from one contiguous slice of the pack.
+        """
+
+        if self.glyph_pack is None:
+            return compose_images(self.image_array[indices], bounds, spacings, left_width, image_width, dtype=dtype)
+
+        offsets = glyph_offsets(bounds, spacings, left_width)
+        out = np.empty((1, self.image_array.shape[1], image_width), dtype=dtype)
+
+        return self.glyph_pack.compose_batch(np.zeros(len(indices), dtype=np.intp), indices, offsets, out)[0]
+
+    def compose_batch(
+        self,
+        rows: np.ndarray,
+        indices: np.ndarray,
+        bounds: np.ndarray,
+        offsets: np.ndarray,
+        out: np.ndarray
+    ) -> np.ndarray:
+        """
+        Builds a batch of inverted sequence images of the given dataset rows, see `compose_batch`.
+        """
+
+        if self.glyph_pack is None:
+            return compose_batch(self.image_array, rows, indices, bounds, offsets, out)
+
+        return self.glyph_pack.compose_batch(rows, indices, offsets, out)
+
+_loader_registry: Dict[str, MNIST_Loader] = {}
+_registry_lock = threading.Lock()
+
+
+def _registry_key(download_directory: str) -> str:
+    return os.path.abspath(download_directory)
+
+
+def get_loader(download_directory: str = "mnist/") -> MNIST_Loader:
+    """
+    Fetch the shared, already loaded MNIST_Loader for a download directory.
+
+    The first call for a directory downloads (if needed) and loads the data; every
+    later call returns the same object, so the dataset is only parsed once per process.
+    Safe to call from multiple threads.
+
+    Parameters
+    ----------
+    download_directory:
+        A string path to the folder holding the MNIST data. Default is 'mnist/'
+
+    Returns
+    -------
+    mnist, the loaded MNIST_Loader shared by every caller using this directory.
+    """
+
+    key = _registry_key(download_directory)
+
+    mnist = _loader_registry.get(key)
+    if mnist is not None:
+        return mnist
+
+    with _registry_lock:
+        mnist = _loader_registry.get(key)
+        if mnist is None:
+            mnist = MNIST_Loader(download_directory=download_directory)
+            mnist.load_MNIST()
+            _loader_registry[key] = mnist
+
+    return mnist
+
+
+def preload_MNIST(download_directory: str = "mnist/") -> MNIST_Loader:
+    """
+    Eagerly load the shared MNIST_Loader for a download directory, so that the
+    first generation call does not pay for reading the dataset.
+
+    If the NUMBER_GENERATOR_SHARED_DATASET environment variable describes a shared
+    memory copy of this directory's dataset, e.g. as set by the pre-fork API server,
+    the loader attaches to it instead of reading any file, see `SharedDataset`.
+
+    Parameters
+    ----------
+    download_directory:
+        A string path to the folder holding the MNIST data. Default is 'mnist/'
+
+    Returns
+    -------
+    mnist, the loaded MNIST_Loader now held in the registry.
+    """
+
+    key = _registry_key(download_directory)
+
+    if key not in _loader_registry and os.environ.get("NUMBER_GENERATOR_SHARED_DATASET"):
+        from .shared import attach_shared_loader
+
+        with _registry_lock:
+            if key not in _loader_registry:
+                mnist = attach_shared_loader(download_directory)
+
+                if mnist is not None:
+                    _loader_registry[key] = mnist
+
+    return get_loader(download_directory)
+
+
+def invalidate_loader(download_directory: Optional[str] = None) -> None:
+    """
+    Drop shared MNIST_Loader objects from the registry, forcing the next
+    `get_loader` call to re-read the data from disk.
+
+    Parameters
+    ----------
+    download_directory:
+        The download directory whose loader should be dropped. If None, every
+        cached loader is dropped. Default is None.
+
+    Returns
+    -------
+    None
+    """
+
+    with _registry_lock:
+        if download_directory is None:
+            _loader_registry.clear()
+        else:
+            _loader_registry.pop(_registry_key(download_directory), None)
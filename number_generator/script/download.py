@@ -0,0 +1,199 @@
+from typing import Callable, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import gzip
+import hashlib
+import os
+import shutil
+import zipfile
+
+MNIST_URL = "https://data.deepai.org/mnist.zip"
+
+#An environment variable naming the default source, e.g. a local mirror for offline containers
+SOURCE_ENV = "NUMBER_GENERATOR_MNIST_SOURCE"
+
+#The MD5 checksums of the gzipped MNIST training files, keyed by their decompressed name
+MNIST_MD5 = {
+    "train-images-idx3-ubyte": "f68b3c2dcbeaaa9fbdd348bbdeb94873",
+    "train-labels-idx1-ubyte": "d53e105ee54ea40749a09fcbcd1e9432",
+}
+
+#The number of bytes streamed at a time, which bounds the memory used while extracting
+CHUNK_SIZE = 1 << 20
+
+
+class _HashingReader:
+    """
+    A read-only file object that computes the MD5 checksum of everything read through it.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.md5 = hashlib.md5()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.md5.update(data)
+
+        return data
+
+
+def resolve_source(source: Optional[str] = None) -> str:
+    """
+    Gives the source to fetch MNIST from: `source` if given, otherwise the
+    NUMBER_GENERATOR_MNIST_SOURCE environment variable, otherwise `MNIST_URL`.
+    """
+
+    if source is not None:
+        return source
+
+    return os.environ.get(SOURCE_ENV) or MNIST_URL
+
+
+def fetch_MNIST(
+    download_directory: str,
+    source: Optional[str] = None,
+    checksums: Optional[Dict[str, str]] = None
+) -> None:
+    """
+    Fetches the MNIST training files into `download_directory`, decompressing them
+    as they stream in, so memory use stays constant whatever the file size.
+
+    The image and label files are extracted concurrently. Each one is written to a
+    temporary file, and only moved into place once its checksum is verified.
+
+    Parameters
+    ----------
+    download_directory:
+        The folder to write `train-images-idx3-ubyte` and `train-labels-idx1-ubyte` into.
+        Created if missing.
+    source:
+        Where to fetch the files from, one of:
+            - An http(s) URL of a zip of the gzipped files, downloaded with wget to
+              `mnist.zip` in `download_directory`, unless already there.
+            - A local path to such a zip file.
+            - A local mirror folder, holding either `train-images-idx3-ubyte.gz` and
+              `train-labels-idx1-ubyte.gz`, or `mnist.zip`.
+        Default is None, see `resolve_source`.
+    checksums:
+        The expected MD5 checksums of the gzipped files, keyed by decompressed file
+        name. Files without a checksum are not verified. Default is None, which uses
+        the checksums of the original MNIST files, `MNIST_MD5`.
+
+    Returns
+    -------
+    None
+    """
+
+    source = resolve_source(source)
+
+    if checksums is None:
+        checksums = MNIST_MD5
+
+    os.makedirs(download_directory, exist_ok=True)
+
+    if source.startswith(("http://", "https://")):
+        zip_path = os.path.join(download_directory, "mnist.zip")
+
+        if not os.path.exists(zip_path):
+            import wget
+
+            print("Downloading MNIST...")
+            wget.download(source, zip_path)
+            print("\nDownload Completed!")
+
+        source = zip_path
+
+    openers = _member_openers(source)
+
+    print("Processing Extraction...")
+    with ThreadPoolExecutor(max_workers=len(openers)) as executor:
+        futures = [
+            executor.submit(
+                _extract_member,
+                opener,
+                os.path.join(download_directory, name),
+                checksums.get(name)
+            )
+            for name, opener in openers.items()
+        ]
+
+        for future in futures:
+            future.result()
+
+    print("Extraction Completed!")
+
+
+def _member_openers(source: str) -> Dict[str, Callable]:
+    """
+    Gives, for each MNIST training file, a callable opening a stream of its gzipped
+    bytes in the local `source`, see `fetch_MNIST`.
+    """
+
+    if os.path.isdir(source):
+        gz_paths = {name: os.path.join(source, f"{name}.gz") for name in MNIST_MD5}
+
+        if all(os.path.isfile(path) for path in gz_paths.values()):
+            return {name: (lambda path=path: open(path, "rb")) for name, path in gz_paths.items()}
+
+        zip_path = os.path.join(source, "mnist.zip")
+
+        if not os.path.isfile(zip_path):
+            raise FileNotFoundError(f"MNIST mirror {source} holds neither the gzipped training files nor mnist.zip")
+
+        source = zip_path
+
+    if not (os.path.isfile(source) and zipfile.is_zipfile(source)):
+        raise FileNotFoundError(f"MNIST source {source} is neither a URL, a zip file nor a folder")
+
+    with zipfile.ZipFile(source) as archive:
+        members = {os.path.basename(member): member for member in archive.namelist()}
+
+    openers = {}
+    for name in MNIST_MD5:
+        if f"{name}.gz" not in members:
+            raise FileNotFoundError(f"MNIST zip {source} is missing {name}.gz")
+
+        openers[name] = lambda member=members[f"{name}.gz"]: _open_zip_member(source, member)
+
+    return openers
+
+
+@contextlib.contextmanager
+def _open_zip_member(zip_path: str, member: str):
+    """
+    Opens a stream of one member of a zip file. Each stream holds its own handle on
+    the zip, so several can be read from different threads.
+    """
+
+    with zipfile.ZipFile(zip_path) as archive:
+        with archive.open(member) as stream:
+            yield stream
+
+
+def _extract_member(open_member: Callable, output_path: str, md5: Optional[str] = None) -> None:
+    """
+    Decompresses a gzipped stream into `output_path` a chunk at a time, checking the
+    MD5 checksum of the compressed bytes if given.
+    """
+
+    tmp_path = f"{output_path}.{os.getpid()}.part"
+
+    try:
+        with open_member() as stream:
+            reader = _HashingReader(stream)
+
+            with gzip.GzipFile(fileobj=reader, mode="rb") as decompressed, open(tmp_path, "wb") as f:
+                shutil.copyfileobj(decompressed, f, CHUNK_SIZE)
+
+            #Hash any trailing bytes the decompressor did not need to read
+            while reader.read(CHUNK_SIZE):
+                pass
+
+        if md5 is not None and reader.md5.hexdigest() != md5:
+            raise ValueError(f"Checksum mismatch for {os.path.basename(output_path)}: expected MD5 {md5}, got {reader.md5.hexdigest()}")
+
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,70 @@
+from typing import Optional
+from .profiling import stage
+import numpy as np
+import io
+
+#Maps each supported encoding to its media type
+MEDIA_TYPES = {
+    "png": "image/png",
+    "npy": "application/x-npy",
+    "pgm": "image/x-portable-graymap",
+    "raw": "application/octet-stream",
+}
+
+FILE_EXTENSIONS = {
+    "png": "png",
+    "npy": "npy",
+    "pgm": "pgm",
+    "raw": "raw",
+}
+
+
+def encode_image(image: np.ndarray, encoding: str = "png", png_level: Optional[int] = None) -> bytes:
+    """
+    Encodes a grayscale image as bytes.
+
+    Parameters
+    ----------
+    image:
+        A (height, width) uint8 image in numpy matrix format.
+    encoding:
+        One of:
+            - "png": a PNG file, the most compact but the slowest to encode.
+            - "npy": a numpy .npy file, readable with `np.load`.
+            - "pgm": a binary (P5) portable graymap file.
+            - "raw": the bare row-major pixel bytes, without any header.
+        Default is "png".
+    png_level:
+        An optional zlib compression level 0-9 for PNG. 0 is fastest and largest, 9 is
+        slowest and smallest. Default is None, which uses the OpenCV default.
+
+    Returns
+    -------
+    data, the encoded image bytes.
+    """
+
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+
+    with stage("encode"):
+        if encoding == "png":
+            import cv2
+
+            params = [] if png_level is None else [cv2.IMWRITE_PNG_COMPRESSION, int(png_level)]
+
+            return cv2.imencode(".png", image, params)[1].tobytes()
+
+        if encoding == "npy":
+            buffer = io.BytesIO()
+            np.save(buffer, image, allow_pickle=False)
+
+            return buffer.getvalue()
+
+        if encoding == "pgm":
+            height, width = image.shape
+
+            return f"P5\n{width} {height}\n255\n".encode() + image.tobytes()
+
+        if encoding == "raw":
+            return image.tobytes()
+
+    raise ValueError(f"Unknown image encoding {encoding}, expected one of {tuple(MEDIA_TYPES)}")
@@ -1,14 +1,20 @@
-from typing import Iterable, Tuple, Optional
-from .dataload import MNIST_Loader
-from .imageprocessor import invert_image, space_images, pad_image_bounds
+from typing import Iterable, Sequence, Tuple, Optional, Union
+from .dataload import MNIST_Loader, get_loader
+from .imageprocessor import check_spacing_range, draw_spacings, draw_left_padding, sequence_width
+from .profiling import stage
+from .seeding import Seed, stage_streams
+from .augment import Augmentation, as_augmentation, augment_images
 import numpy as np
 
 def generate_numbers_sequence(
     digits: Iterable[int],
     spacing_range: Tuple[int, int],
     image_width: int,
-    random_seed: Optional[int] = None,
-    verbose: bool = True
+    random_seed: Seed = None,
+    verbose: bool = True,
+    loader: Optional[MNIST_Loader] = None,
+    dtype=np.float64,
+    augment: Union[None, Augmentation, Iterable[str]] = None
 ) -> np.ndarray:
     """
     Generate an image that contains the sequence of given numbers, spaced
@@ -25,35 +31,78 @@ def generate_numbers_sequence(
     image_width:
         specifies the width of the image in pixels.
     random_seed:
-        An optional parameter to initialize random number generation
+        An optional parameter to initialize random number generation. An int seeds
+        every stage alike, while a SeedSequence, e.g. from `sample_seed`, gives each
+        stage its own independent stream.
     verbose:
         An optional parameter of whether to print progress or not.
+    loader:
+        An optional, already loaded MNIST_Loader to draw digits from. If None,
+        the process-wide shared loader from `get_loader` is used.
+    dtype:
+        The numpy dtype of the returned image. np.float32 gives a scale ranging
+        from 0 (black) to 1 (white), while np.uint8 and np.float64 give a scale
+        ranging from 0 (black) to 255 (white). np.uint8 is the smallest and the
+        fastest to encode. Default is np.float64.
+    augment:
+        An optional Augmentation, or names of augmentations to apply at their default
+        strengths, e.g. ["scale", "noise"], see `AUGMENTATIONS`. Default is None.
 
     Returns
     -------
-    The image containing the sequence of numbers. Images should be represented
-    as floating point 32bits numpy arrays with a scale ranging from 0 (black) to
-    1 (white), the first dimension corresponding to the height and the second
+    The image containing the sequence of numbers, as a numpy array of the requested
+    `dtype`, the first dimension corresponding to the height and the second
     dimension to the width.
     """
 
-    mnist = MNIST_Loader(random_seed=random_seed)
+    if loader is None:
+        loader = get_loader()
+
+    augmentation = as_augmentation(augment)
+    streams = stage_streams(random_seed, ("sample", "spacing", "padding", "augment") if augmentation else ("sample", "spacing", "padding"))
+
+    with stage("sample"):
+        indices = loader.sample_indices(list(digits), rng=np.random.default_rng(streams["sample"]))
+
+    with stage("trim"):
+        bounds = loader.trim_bounds[indices]
+
+    with stage("spacing"):
+        spacings = draw_spacings(len(indices), spacing_range, random_seed=streams["spacing"])
 
-    mnist.load_MNIST()
+        content_width = sequence_width(bounds, spacings)
 
-    images = [mnist.fetch_digit(d) for d in digits]
+    with stage("padding"):
+        left_width = draw_left_padding(content_width, image_width, random_seed=streams["padding"])
 
-    image = space_images(images, spacing_range, random_seed=random_seed)
-    image = pad_image_bounds(image, image_width, random_seed=random_seed)
-    image = invert_image(image)
+    #Inverts the digits as they are composed onto the canvas
+    with stage("compose"):
+        image = loader.compose_images(indices, bounds, spacings, left_width, image_width, dtype=dtype)
+
+    if augmentation:
+        with stage("augment"):
+            widths = bounds[:, 1].astype(np.int64) - bounds[:, 0] + 1
+            offsets = left_width + np.concatenate([[0], np.cumsum(widths[:-1] + spacings)])
+
+            augment_images(
+                image[None],
+                np.zeros(len(indices), dtype=np.int64),
+                offsets,
+                widths,
+                augmentation,
+                [np.random.default_rng(streams["augment"])]
+            )
 
     return image
 
 def generate_phone_number(
     spacing_range: Tuple[int, int],
     image_width: int,
-    random_seed: Optional[int] = None,
-    verbose: bool = True
+    random_seed: Seed = None,
+    verbose: bool = True,
+    loader: Optional[MNIST_Loader] = None,
+    dtype=np.float64,
+    augment: Union[None, Augmentation, Iterable[str]] = None
 ) -> np.ndarray:
     """
     Generates an image that contains random digits, in the format of
@@ -67,26 +116,44 @@ def generate_phone_number(
     image_width:
         specifies the width of the image in pixels.
     random_seed:
-        An optional parameter to initialize random number generation
+        An optional parameter to initialize random number generation. An int seeds
+        every stage alike, while a SeedSequence, e.g. from `sample_seed`, gives each
+        stage its own independent stream.
     verbose:
         An optional parameter of whether to print progress or not.
+    loader:
+        An optional, already loaded MNIST_Loader to draw digits from. If None,
+        the process-wide shared loader from `get_loader` is used.
+    dtype:
+        The numpy dtype of the returned image, see `generate_numbers_sequence`.
+        Default is np.float64.
+    augment:
+        Optional augmentations to apply, see `generate_numbers_sequence`. Default is None.
 
     Returns
     -------
     An image containing the sequence of numbers generated.
 
-    The image is represented as floating point 32bit numpy arrays with a scale
-    ranging from 0 (black) to 1 (white), with the first dimension corresponding
-    to the height and the second dimension to the width.
+    The image is represented as a numpy array of the requested `dtype`, with the
+    first dimension corresponding to the height and the second dimension to the width.
     """
 
-    random_digits = generate_japanese_number(random_seed)
+    random_digits = generate_japanese_number(stage_streams(random_seed, ("digits",))["digits"])
 
-    image = generate_numbers_sequence(random_digits, spacing_range, image_width, random_seed=random_seed, verbose=verbose)
+    image = generate_numbers_sequence(
+        random_digits,
+        spacing_range,
+        image_width,
+        random_seed=random_seed,
+        verbose=verbose,
+        loader=loader,
+        dtype=dtype,
+        augment=augment
+    )
 
     return image
 
-def generate_japanese_number(random_seed: Optional[int] = None):
+def generate_japanese_number(random_seed: Seed = None):
     """
     Generates a random set of digits in the format of a japanese phone number.
 
@@ -105,3 +172,251 @@ def generate_japanese_number(random_seed: Optional[int] = None):
     random_digits = rng.integers(low=0, high=10, size=(10,))
 
     return random_digits
+
+
+def generate_numbers_sequence_batch(
+    digit_matrix: Sequence[Sequence[int]],
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    random_seed: Seed = None,
+    loader: Optional[MNIST_Loader] = None,
+    dtype=np.uint8,
+    chunk_size: int = 4096,
+    sample_seeds: Optional[Sequence[Seed]] = None,
+    augment: Union[None, Augmentation, Iterable[str]] = None
+) -> np.ndarray:
+    """
+    Generate a batch of images, one per row of `digit_matrix`, in a single vectorized pass.
+
+    All digits, spacings and paddings of the batch are drawn with one random number
+    generator, and the images are composed directly into one preallocated array.
+    For a given seed, the images therefore differ from those of calling
+    `generate_numbers_sequence` once per row, and depend on how rows are batched.
+
+    Giving `sample_seeds` instead draws each image from its own streams, exactly as
+    `generate_numbers_sequence(row, ..., random_seed=seed)` would, so an image only
+    depends on its seed, whatever batch it is generated in.
+
+    Parameters
+    ----------
+    digit_matrix:
+        A (num_images, num_digits) matrix of digit values, one sequence per row, or
+        a list of non-empty digit sequences of varying lengths.
+    spacing_range:
+        a (minimum, maximum) int pair (tuple), representing the min and max spacing
+        between digits. Unit should be pixel.
+    image_width:
+        specifies the width of the images in pixels.
+    random_seed:
+        An optional parameter to initialize random number generation
+    loader:
+        An optional, already loaded MNIST_Loader to draw digits from. If None,
+        the process-wide shared loader from `get_loader` is used.
+    dtype:
+        The numpy dtype of the returned images, see `generate_numbers_sequence`.
+        Default is np.uint8.
+    chunk_size:
+        The number of images to compose at a time, bounding temporary memory use.
+        Default is 4096.
+    sample_seeds:
+        An optional seed per image, used instead of `random_seed`: a SeedSequence,
+        e.g. from `sample_seeds`, an int, or None for fresh entropy. Default is None.
+    augment:
+        Optional augmentations to apply, see `generate_numbers_sequence`. They are
+        applied to whole chunks of the batch at once. Default is None.
+
+    Returns
+    -------
+    A (num_images, 28, image_width) numpy array holding the images.
+    """
+
+    if isinstance(digit_matrix, np.ndarray) and digit_matrix.ndim == 2:
+        lengths = np.full(digit_matrix.shape[0], digit_matrix.shape[1], dtype=np.int64)
+        digits = digit_matrix.ravel()
+    else:
+        sequences = [list(sequence) for sequence in digit_matrix]
+        lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+        digits = [d for sequence in sequences for d in sequence]
+
+    digits = np.asarray(digits, dtype=np.intp)
+
+    if np.any(lengths == 0):
+        raise ValueError("Every sequence of digit_matrix must hold at least one digit")
+
+    check_spacing_range(spacing_range)
+
+    if loader is None:
+        loader = get_loader()
+
+    num_images = lengths.shape[0]
+    rows = np.repeat(np.arange(num_images), lengths)
+    row_starts = np.cumsum(lengths) - lengths
+
+    augmentation = as_augmentation(augment)
+
+    if sample_seeds is None:
+        rng = np.random.default_rng(random_seed)
+    else:
+        if len(sample_seeds) != num_images:
+            raise ValueError(f"Got {len(sample_seeds)} sample_seeds for {num_images} images")
+
+        stages = ("sample", "spacing", "padding", "augment") if augmentation else ("sample", "spacing", "padding")
+        streams = [stage_streams(seed, stages) for seed in sample_seeds]
+
+    with stage("sample"):
+        if sample_seeds is None:
+            indices = loader.sample_indices(digits, rng=rng)
+        elif num_images:
+            indices = np.concatenate([
+                loader.sample_indices(digits[start:start + length], rng=np.random.default_rng(sample_streams["sample"]))
+                for start, length, sample_streams in zip(row_starts, lengths, streams)
+            ])
+        else:
+            indices = np.zeros(0, dtype=np.intp)
+
+    with stage("trim"):
+        bounds = loader.trim_bounds[indices].astype(np.int64)
+        widths = bounds[:, 1] - bounds[:, 0] + 1
+
+    with stage("spacing"):
+        #Every digit but the first of its sequence is preceded by a random gap
+        spacings = np.zeros(digits.shape[0], dtype=np.int64)
+        gaps = np.ones(digits.shape[0], dtype=bool)
+        gaps[row_starts] = False
+        if sample_seeds is None:
+            spacings[gaps] = rng.integers(low=spacing_range[0], high=spacing_range[1]+1, size=digits.shape[0] - num_images)
+        elif num_images:
+            spacings[gaps] = np.concatenate([
+                draw_spacings(length, spacing_range, random_seed=sample_streams["spacing"])
+                for length, sample_streams in zip(lengths, streams)
+            ])
+
+        advance = np.cumsum(widths + spacings)
+        row_base = advance[row_starts] - widths[row_starts]
+        content_width = np.add.reduceat(widths + spacings, row_starts) if num_images else np.zeros(0, dtype=np.int64)
+
+    with stage("padding"):
+        remaining_width = image_width - content_width
+
+        if np.any(remaining_width < 0):
+            raise ValueError(f"Some digit sequences are wider than image_width={image_width}")
+
+        #Matches draw_left_padding: uniform in [0, remaining_width), or 0 when there is no room
+        if sample_seeds is None:
+            left_width = rng.integers(low=0, high=np.maximum(remaining_width, 1))
+        else:
+            left_width = np.array([
+                draw_left_padding(int(width), image_width, random_seed=sample_streams["padding"])
+                for width, sample_streams in zip(content_width, streams)
+            ], dtype=np.int64)
+
+        offsets = advance - widths - row_base[rows] + left_width[rows]
+
+    #Inverts the digits as they are composed onto the canvas
+    with stage("compose"):
+        images = np.empty((num_images, loader.image_array.shape[1], image_width), dtype=dtype)
+
+        for start in range(0, num_images, chunk_size):
+            end = min(start + chunk_size, num_images)
+
+            first = row_starts[start]
+            last = row_starts[end] if end < num_images else digits.shape[0]
+
+            loader.compose_batch(
+                rows[first:last] - start,
+                indices[first:last],
+                bounds[first:last],
+                offsets[first:last],
+                images[start:end]
+            )
+
+    if augmentation:
+        with stage("augment"):
+            augment_images(
+                images,
+                rows,
+                offsets,
+                widths,
+                augmentation,
+                rng if sample_seeds is None else [np.random.default_rng(sample_streams["augment"]) for sample_streams in streams]
+            )
+
+    return images
+
+
+def generate_phone_number_batch(
+    num_images: int,
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    random_seed: Seed = None,
+    loader: Optional[MNIST_Loader] = None,
+    dtype=np.uint8,
+    return_digits: bool = False,
+    sample_seeds: Optional[Sequence[Seed]] = None,
+    augment: Union[None, Augmentation, Iterable[str]] = None
+):
+    """
+    Generates a batch of images of random digits, in the format of Japanese phone
+    numbers, in a single vectorized pass.
+
+    Parameters
+    ----------
+    num_images:
+        The number of images to generate.
+    spacing_range:
+	    a (minimum, maximum) int pair (tuple), representing the min and max spacing
+        between digits. Unit should be pixel.
+    image_width:
+        specifies the width of the images in pixels.
+    random_seed:
+        An optional parameter to initialize random number generation
+    loader:
+        An optional, already loaded MNIST_Loader to draw digits from. If None,
+        the process-wide shared loader from `get_loader` is used.
+    dtype:
+        The numpy dtype of the returned images, see `generate_numbers_sequence`.
+        Default is np.uint8.
+    return_digits:
+        Whether to also return the generated digits. Default is False.
+    sample_seeds:
+        An optional seed per image, used instead of `random_seed`, see
+        `generate_numbers_sequence_batch`. Each image is then the one `generate_phone_number` gives for
+        its seed, whatever batch it is generated in. Default is None.
+    augment:
+        Optional augmentations to apply, see `generate_numbers_sequence`. Default is None.
+
+    Returns
+    -------
+    A (num_images, 28, image_width) numpy array holding the images. If `return_digits`
+    is True, a tuple of the images and the (num_images, 10) matrix of their digits.
+    """
+
+    if sample_seeds is None:
+        rng = np.random.default_rng(random_seed)
+
+        random_digits = rng.integers(low=0, high=10, size=(num_images, 10))
+    else:
+        if len(sample_seeds) != num_images:
+            raise ValueError(f"Got {len(sample_seeds)} sample_seeds for {num_images} images")
+
+        rng = None
+        random_digits = np.array(
+            [generate_japanese_number(stage_streams(seed, ("digits",))["digits"]) for seed in sample_seeds],
+            dtype=np.int64
+        ).reshape(num_images, 10)
+
+    images = generate_numbers_sequence_batch(
+        random_digits,
+        spacing_range,
+        image_width,
+        random_seed=rng,
+        loader=loader,
+        dtype=dtype,
+        sample_seeds=sample_seeds,
+        augment=augment
+    )
+
+    if return_digits:
+        return images, random_digits
+
+    return images
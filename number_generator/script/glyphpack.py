@@ -0,0 +1,449 @@
+from typing import Optional, Tuple
+from .idxreader import read_idx
+from .labelindex import LabelIndex
+from .imageprocessor import compute_trim_bounds, compose_packed_batch
+import numpy as np
+import hashlib
+import json
+import os
+import struct
+
+PACK_MAGIC = b"NGGLYPH1"
+PACK_VERSION = 1
+
+#The name of the pack in a download directory, where MNIST_Loader looks for it
+PACK_NAME = "train-glyphs.pack"
+
+#The name of the sidecar recording the checksums of the IDX files of a download directory
+SOURCE_NAME = "train-source.json"
+
+#Every array of a pack starts on a multiple of this many bytes
+_ALIGNMENT = 64
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Gives the hex SHA-256 checksum of a file, read a chunk at a time.
+    """
+
+    sha256 = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def source_checksums(image_path: str, label_path: str, record_path: Optional[str] = None, full: bool = False) -> Tuple[str, str]:
+    """
+    Gives the SHA-256 checksums of an IDX image and label file pair.
+
+    The checksums are recorded in a small JSON sidecar, with the size and modification
+    time of each file, and reused while those are unchanged, so a file is only hashed
+    again once it changes. If the sidecar cannot be written, the checksums are still
+    returned.
+
+    Parameters
+    ----------
+    image_path:
+        The path of the IDX image file.
+    label_path:
+        The path of the IDX label file.
+    record_path:
+        The path of the sidecar. Default is None, which hashes both files every time.
+    full:
+        Whether to hash both files even if the sidecar has them. Default is False.
+
+    Returns
+    -------
+    (image_sha256, label_sha256), the hex checksums of the files.
+    """
+
+    record = {}
+
+    if record_path is not None:
+        try:
+            with open(record_path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    if not isinstance(record, dict):
+        record = {}
+
+    checksums = []
+    changed = False
+
+    for path, name in ((image_path, "image"), (label_path, "label")):
+        stat = os.stat(path)
+        recorded = record.get(name)
+
+        #Each file is recorded as [size, mtime_ns, sha256]
+        if full or not isinstance(recorded, list) or recorded[:2] != [stat.st_size, stat.st_mtime_ns]:
+            recorded = [stat.st_size, stat.st_mtime_ns, file_sha256(path)]
+            record[name] = recorded
+            changed = True
+
+        checksums.append(recorded[2])
+
+    if changed and record_path is not None:
+        #Write to a temporary file first, so concurrent readers never see a partial sidecar
+        tmp_path = f"{record_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, record_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return checksums[0], checksums[1]
+
+
+def dataset_id(image_sha256: str, label_sha256: str) -> str:
+    """
+    Gives the string identifying a dataset from the checksums of its IDX files, the
+    same whether the dataset is loaded from the files or from a pack built from them.
+    """
+
+    return f"{image_sha256}-{label_sha256}"
+
+
+def build_glyph_pack(image_path: str, label_path: str, pack_path: str, chunk_size: int = 4096) -> None:
+    """
+    Preprocesses an IDX image and label file pair into a glyph pack, see `GlyphPack`.
+
+    Parameters
+    ----------
+    image_path:
+        The path of the (num_images, height, width) IDX image file.
+    label_path:
+        The path of the matching IDX label file.
+    pack_path:
+        The path to write the pack to. It is written to a temporary file first, and
+        moved into place once complete.
+    chunk_size:
+        The number of glyphs to gather at a time, bounding temporary memory use.
+        Default is 4096.
+
+    Returns
+    -------
+    None
+    """
+
+    images = read_idx(image_path, mmap=True)
+    labels = read_idx(label_path, mmap=True)
+
+    label_index = LabelIndex(labels)
+    bounds = compute_trim_bounds(images).astype(np.int64)
+
+    #Glyphs are stored grouped by label, in the order the label index samples them
+    order = label_index.order
+    lefts = bounds[order, 0]
+    widths = bounds[order, 1] - lefts + 1
+
+    column_offsets = np.cumsum(widths) - widths
+    total_columns = int(widths.sum())
+
+    arrays = {
+        "label_offsets": label_index.offsets.astype(np.int64),
+        "source_index": order.astype(np.int32),
+        "lefts": lefts.astype(np.int16),
+        "widths": widths.astype(np.int16),
+        "column_offsets": column_offsets.astype(np.int64),
+    }
+    specs = {name: (array.dtype, array.shape) for name, array in arrays.items()}
+    specs["columns"] = (np.dtype(np.uint8), (total_columns, images.shape[1]))
+
+    header = {
+        "version": PACK_VERSION,
+        "image_shape": list(images.shape[1:]),
+        "num_glyphs": int(images.shape[0]),
+        "num_labels": int(label_index.num_labels),
+        "source": {
+            "image_sha256": file_sha256(image_path),
+            "image_size": os.path.getsize(image_path),
+            "image_mtime_ns": os.stat(image_path).st_mtime_ns,
+            "label_sha256": file_sha256(label_path),
+            "label_size": os.path.getsize(label_path),
+            "label_mtime_ns": os.stat(label_path).st_mtime_ns,
+        },
+        "arrays": {},
+    }
+
+    #The header's own size shifts the arrays, so lay them out until it stops growing
+    data_start = 0
+    while True:
+        position = data_start
+        for name, (dtype, shape) in specs.items():
+            header["arrays"][name] = {"dtype": dtype.str, "shape": list(shape), "offset": position}
+            position = _align(position + dtype.itemsize * int(np.prod(shape)))
+
+        encoded = json.dumps(header).encode()
+        needed = _align(len(PACK_MAGIC) + 4 + len(encoded))
+
+        if needed == data_start:
+            break
+
+        data_start = needed
+
+    tmp_path = f"{pack_path}.{os.getpid()}.tmp"
+
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(PACK_MAGIC + struct.pack("<I", len(encoded)) + encoded)
+
+            for name, array in arrays.items():
+                f.seek(header["arrays"][name]["offset"])
+                f.write(np.ascontiguousarray(array).tobytes())
+
+            f.truncate(position)
+
+        columns = np.memmap(tmp_path, dtype=np.uint8, mode="r+", offset=header["arrays"]["columns"]["offset"], shape=specs["columns"][1])
+
+        #Copy every column of every trimmed glyph to its row of the column-major blob
+        for start in range(0, images.shape[0], chunk_size):
+            end = min(start + chunk_size, images.shape[0])
+
+            chunk_widths = widths[start:end]
+            within = np.arange(chunk_widths.sum()) - np.repeat(np.cumsum(chunk_widths) - chunk_widths, chunk_widths)
+
+            first = column_offsets[start]
+            columns[first:first + within.shape[0]] = images[
+                np.repeat(order[start:end], chunk_widths),
+                :,
+                np.repeat(lefts[start:end], chunk_widths) + within
+            ]
+
+        columns.flush()
+        del columns
+
+        os.replace(tmp_path, pack_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _align(position: int) -> int:
+    return -(-position // _ALIGNMENT) * _ALIGNMENT
+
+
+class GlyphPack:
+    """
+    A memory-mapped, preprocessed copy of a digit dataset, which opens in milliseconds.
+
+    A pack is one binary file: an 8 byte magic, a little-endian uint32 header length,
+    a JSON header, then the arrays it lists, each 64 byte aligned. Every glyph is
+    pre-trimmed to its inked columns, and the glyphs are stored grouped by label,
+    in the order the label index samples them. Their pixels are stored column-major
+    and back to back, in a (total_columns, height) `columns` blob, so a glyph is
+    one contiguous slice of it. The header records the SHA-256 checksums, sizes and
+    modification times of the source IDX files.
+
+    General order of use:
+        - Build the pack once with `build_glyph_pack`, or the `build-pack` command
+        - Load the data through MNIST_Loader, which uses the pack when it finds one
+    """
+
+    def __init__(self, pack_path: str):
+        """
+        Memory-maps a pack.
+
+        Parameters
+        ----------
+        pack_path:
+            The path of the pack file.
+
+        Returns
+        -------
+        self, a GlyphPack over the file.
+        """
+
+        self.pack_path = pack_path
+
+        with open(pack_path, "rb") as f:
+            magic = f.read(len(PACK_MAGIC))
+
+            if magic != PACK_MAGIC:
+                raise ValueError(f"{pack_path} is not a glyph pack")
+
+            (header_length,) = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(header_length))
+
+        if self.header["version"] != PACK_VERSION:
+            raise ValueError(f"{pack_path} has unsupported glyph pack version {self.header['version']}")
+
+        #One read-only mapping of the whole file, viewed as each array in turn
+        data = np.memmap(pack_path, dtype=np.uint8, mode="r")
+
+        arrays = {}
+        for name, spec in self.header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            shape = tuple(spec["shape"])
+            end = spec["offset"] + dtype.itemsize * int(np.prod(shape))
+
+            arrays[name] = data[spec["offset"]:end].view(dtype).reshape(shape)
+
+        self.image_shape = tuple(self.header["image_shape"])
+        self.label_offsets = arrays["label_offsets"]
+        self.source_index = arrays["source_index"]
+        self.lefts = arrays["lefts"]
+        self.widths = arrays["widths"]
+        self.column_offsets = arrays["column_offsets"]
+        self.columns = arrays["columns"]
+
+        #Maps each dataset row to the position of its glyph in the pack
+        self.glyph_of_row = np.empty(self.source_index.shape[0], dtype=np.int64)
+        self.glyph_of_row[self.source_index] = np.arange(self.source_index.shape[0])
+
+    def __len__(self) -> int:
+        return int(self.source_index.shape[0])
+
+    def label_index(self) -> LabelIndex:
+        """
+        Gives the label index of the dataset, as built from its IDX labels.
+        """
+
+        return LabelIndex.from_order(self.source_index, np.diff(self.label_offsets))
+
+    def trim_bounds(self) -> np.ndarray:
+        """
+        Gives the (left, right) trim bounds of every dataset row, see `compute_trim_bounds`.
+        """
+
+        bounds = np.empty((len(self), 2), dtype=np.int16)
+        bounds[self.source_index, 0] = self.lefts
+        bounds[self.source_index, 1] = self.lefts + self.widths - 1
+
+        return bounds
+
+    def glyph(self, row: int) -> np.ndarray:
+        """
+        Gives the trimmed glyph of a dataset row, as a read-only (height, width) view.
+        """
+
+        glyph = self.glyph_of_row[row]
+        start = self.column_offsets[glyph]
+
+        return self.columns[start:start + self.widths[glyph]].T
+
+    def images(self, rows) -> np.ndarray:
+        """
+        Rebuilds the full, untrimmed images of the given dataset rows.
+
+        Parameters
+        ----------
+        rows:
+            An int or an array-like of ints of any shape.
+
+        Returns
+        -------
+        images, a uint8 array of shape `np.shape(rows) + image_shape`.
+        """
+
+        rows = np.asarray(rows, dtype=np.intp)
+        flat_rows = rows.ravel()
+
+        images = np.zeros((flat_rows.shape[0],) + self.image_shape, dtype=np.uint8)
+
+        glyphs = self.glyph_of_row[flat_rows]
+        widths = self.widths[glyphs].astype(np.int64)
+        within = np.arange(widths.sum()) - np.repeat(np.cumsum(widths) - widths, widths)
+
+        images[
+            np.repeat(np.arange(flat_rows.shape[0]), widths),
+            :,
+            np.repeat(self.lefts[glyphs], widths) + within
+        ] = self.columns[np.repeat(self.column_offsets[glyphs], widths) + within]
+
+        return images.reshape(rows.shape + self.image_shape)
+
+    def compose_batch(
+        self,
+        rows: np.ndarray,
+        indices: np.ndarray,
+        offsets: np.ndarray,
+        out: np.ndarray
+    ) -> np.ndarray:
+        """
+        Builds a batch of inverted sequence images, like `compose_batch`, reading each
+        glyph as a contiguous slice of the pack.
+
+        Parameters
+        ----------
+        rows:
+            An int array giving, for each glyph, the image of the batch it belongs to.
+        indices:
+            An int array giving, for each glyph, its dataset row.
+        offsets:
+            An int array giving, for each glyph, the output column its left bound lands on.
+        out:
+            The preallocated (batch_size, height, image_width) output array, see `compose_batch`.
+
+        Returns
+        -------
+        out, the output array, filled with black digits on a white background.
+        """
+
+        glyphs = self.glyph_of_row[indices]
+
+        return compose_packed_batch(self.columns, self.column_offsets[glyphs], self.widths[glyphs], rows, offsets, out)
+
+    @property
+    def source_id(self) -> str:
+        """
+        A string identifying the source IDX files, see `dataset_id`.
+        """
+
+        return dataset_id(self.header["source"]["image_sha256"], self.header["source"]["label_sha256"])
+
+    def source_matches(self, image_path: str, label_path: str, record_path: Optional[str] = None, full: bool = False) -> bool:
+        """
+        Checks whether the pack was built from the given IDX files. Files of the sizes
+        and modification times the pack recorded match instantly. Otherwise, or with
+        `full`, their checksums are compared too, see `source_checksums`, so that a
+        different dataset of the same size is never served from the pack. Recording
+        them in the `record_path` sidecar lets later checks of the same files, e.g.
+        after a copy changed their modification times, skip hashing them again.
+        """
+
+        source = self.header["source"]
+        image_stat = os.stat(image_path)
+        label_stat = os.stat(label_path)
+
+        if (image_stat.st_size, label_stat.st_size) != (source["image_size"], source["label_size"]):
+            return False
+
+        if not full and (image_stat.st_mtime_ns, label_stat.st_mtime_ns) == (source["image_mtime_ns"], source["label_mtime_ns"]):
+            return True
+
+        return source_checksums(image_path, label_path, record_path, full) == (source["image_sha256"], source["label_sha256"])
+
+
+class PackedImages:
+    """
+    A read-only, array-like view of the full images of a GlyphPack, rebuilt from
+    their glyphs on access. Stands in for the IDX image array of a loader.
+    """
+
+    def __init__(self, pack: GlyphPack):
+        self.pack = pack
+
+        self.shape = (len(pack),) + pack.image_shape
+        self.dtype = np.dtype(np.uint8)
+        self.ndim = len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        if isinstance(rows, slice):
+            rows = np.arange(self.shape[0])[rows]
+
+        return self.pack.images(rows)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        images = self.pack.images(np.arange(self.shape[0]))
+
+        return images if dtype is None else images.astype(dtype)
@@ -0,0 +1,115 @@
+from typing import Tuple
+import numpy as np
+import os
+import struct
+
+#Maps the IDX type code (third magic byte) to a big-endian numpy dtype
+IDX_DTYPES = {
+    0x08: np.dtype(">u1"),
+    0x09: np.dtype(">i1"),
+    0x0B: np.dtype(">i2"),
+    0x0C: np.dtype(">i4"),
+    0x0D: np.dtype(">f4"),
+    0x0E: np.dtype(">f8"),
+}
+
+IDX_CODES = {dtype.str[1:]: code for code, dtype in IDX_DTYPES.items()}
+
+
+def read_idx_header(path: str) -> Tuple[np.dtype, Tuple[int, ...], int]:
+    """
+    Parses the header of an IDX file, without reading the data that follows it.
+
+    Parameters
+    ----------
+    path:
+        A string path to an uncompressed IDX file.
+
+    Returns
+    -------
+    (dtype, shape, offset), the numpy dtype of the stored values, the shape of the
+    stored array, and the byte offset at which the array data begins.
+    """
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+        if len(magic) != 4 or magic[0] != 0 or magic[1] != 0:
+            raise ValueError(f"{path} is not an IDX file")
+
+        type_code, ndim = magic[2], magic[3]
+
+        if type_code not in IDX_DTYPES:
+            raise ValueError(f"{path} has unknown IDX type code {type_code:#04x}")
+
+        dims = f.read(4 * ndim)
+
+        if len(dims) != 4 * ndim:
+            raise ValueError(f"{path} has a truncated IDX header")
+
+    shape = struct.unpack(f">{ndim}I", dims)
+
+    return IDX_DTYPES[type_code], shape, 4 + 4 * ndim
+
+
+def read_idx(path: str, mmap: bool = True) -> np.ndarray:
+    """
+    Reads an IDX file into a numpy array.
+
+    Parameters
+    ----------
+    path:
+        A string path to an uncompressed IDX file.
+    mmap:
+        Whether to return a read-only memory-mapped view of the file instead of
+        reading it into memory. A memory-mapped array shares the OS page cache
+        between every process reading the same file. Default is True.
+
+    Returns
+    -------
+    array, a numpy ndarray (or np.memmap) holding the file contents.
+    """
+
+    dtype, shape, offset = read_idx_header(path)
+
+    count = int(np.prod(shape))
+
+    if os.path.getsize(path) < offset + count * dtype.itemsize:
+        raise ValueError(f"{path} is shorter than its IDX header declares")
+
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        array = np.fromfile(f, dtype=dtype, count=count)
+
+    return array.reshape(shape)
+
+
+def write_idx(path: str, array: np.ndarray) -> None:
+    """
+    Writes a numpy array out as an IDX file.
+
+    Parameters
+    ----------
+    path:
+        A string path to write the IDX file to.
+    array:
+        The numpy array to write. Its dtype must have an IDX equivalent.
+
+    Returns
+    -------
+    None
+    """
+
+    array = np.asarray(array)
+    type_code = IDX_CODES.get(array.dtype.str[1:])
+
+    if type_code is None:
+        raise ValueError(f"dtype {array.dtype} has no IDX equivalent")
+
+    with open(path, "wb") as f:
+        f.write(struct.pack(">BBBB", 0, 0, type_code, array.ndim))
+        f.write(struct.pack(f">{array.ndim}I", *array.shape))
+        f.write(array.astype(IDX_DTYPES[type_code], copy=False).tobytes())
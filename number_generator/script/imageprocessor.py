@@ -43,10 +43,48 @@ def trim_image(image: np.ndarray) -> np.ndarray:
     return new_image
 
 
+def compute_trim_bounds(images: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+    """
+    Finds, for every image in a stack, the first and last columns that are not
+    empty (0). This is the horizontal extent `trim_image` keeps, computed for the
+    whole stack at once.
+
+    Parameters
+    ----------
+    images:
+        A (num_images, height, width) stack of images in numpy matrix format.
+    chunk_size:
+        The number of images to process at a time, bounding the temporary memory
+        used on large (e.g. memory-mapped) stacks. Default is 4096.
+
+    Returns
+    -------
+    bounds, an int16 array of shape (num_images, 2) with the inclusive (left, right)
+    column of each image. Entirely empty images get (0, -1), i.e. zero width.
+    """
+
+    num_images, _, width = images.shape
+
+    bounds = np.empty((num_images, 2), dtype=np.int16)
+
+    for start in range(0, num_images, chunk_size):
+        inked = np.asarray(images[start:start+chunk_size]).any(axis=1)
+
+        has_ink = inked.any(axis=1)
+        left = np.argmax(inked, axis=1)
+        right = width - 1 - np.argmax(inked[:, ::-1], axis=1)
+
+        bounds[start:start+chunk_size, 0] = np.where(has_ink, left, 0)
+        bounds[start:start+chunk_size, 1] = np.where(has_ink, right, -1)
+
+    return bounds
+
+
 def space_images(
     images: List[np.ndarray],
     spacing_range: Tuple[int, int],
-    random_seed: Optional[int] = None
+    random_seed: Optional[int] = None,
+    bounds: Optional[np.ndarray] = None
 ) -> np.ndarray:
     """
     Takes a lsit of numpy image matrices and spaces them in a single image,
@@ -61,6 +99,10 @@ def space_images(
     random_seed:
         An optional int to feed to the random number generator for consistency:
         Default is None.
+    bounds:
+        An optional (len(images), 2) array of precomputed inclusive (left, right)
+        column bounds, as returned by `compute_trim_bounds`. When given, each image
+        is cut to its bounds instead of being trimmed on the fly. Default is None.
 
     Returns
     -------
@@ -70,7 +112,10 @@ def space_images(
 
     rng = np.random.default_rng(random_seed)
 
-    images = [trim_image(img) for img in images]
+    if bounds is None:
+        images = [trim_image(img) for img in images]
+    else:
+        images = [img[:, left:right+1] for img, (left, right) in zip(images, bounds)]
 
     grand_image_list = [images[0]]
 
@@ -120,3 +165,300 @@ def pad_image_bounds(
     image = np.concatenate(images, axis=1)
 
     return image
+
+
+def check_spacing_range(spacing_range: Tuple[int, int]) -> None:
+    """
+    Raises a ValueError unless `spacing_range` is a (min, max) pair with 0 <= min <= max,
+    as a negative spacing would overlap the digits.
+    """
+
+    if not 0 <= spacing_range[0] <= spacing_range[1]:
+        raise ValueError(f"spacing_range must be (min, max) with 0 <= min <= max, got {tuple(spacing_range)}")
+
+
+def draw_spacings(
+    num_images: int,
+    spacing_range: Tuple[int, int],
+    random_seed: Optional[int] = None
+) -> np.ndarray:
+    """
+    Draws the uniform random spacings between `num_images` consecutive images, the
+    same way `space_images` does.
+
+    Parameters
+    ----------
+    num_images:
+        The number of images that will be spaced.
+    spacing_range:
+        A tuple of integers (min, max) to uniform draw spacings from.
+    random_seed:
+        An optional int to feed to the random number generator for consistency:
+        Default is None.
+
+    Returns
+    -------
+    spacings, an int array of the `num_images - 1` gaps, in pixels.
+    """
+
+    check_spacing_range(spacing_range)
+
+    rng = np.random.default_rng(random_seed)
+
+    return rng.integers(low=spacing_range[0], high=spacing_range[1]+1, size=max(num_images - 1, 0))
+
+
+def draw_left_padding(
+    content_width: int,
+    image_width: int,
+    random_seed: Optional[int] = None
+) -> int:
+    """
+    Draws how much of the free space to put left of the content, the same way
+    `pad_image_bounds` does.
+
+    Parameters
+    ----------
+    content_width:
+        The width of the spaced digits, in pixels.
+    image_width:
+        An integer number of pixels the image should be in total
+    random_seed:
+        An optional int to feed to the random number generator for consistency:
+        Default is None.
+
+    Returns
+    -------
+    left_width, the int number of empty columns left of the content.
+    """
+
+    remaining_width = image_width - content_width
+
+    if remaining_width < 0:
+        raise ValueError(f"The digits need {content_width} pixels, which is wider than image_width={image_width}")
+
+    if remaining_width == 0:
+        return 0
+
+    rng = np.random.default_rng(random_seed)
+
+    return int(rng.integers(low=0, high=remaining_width, size=1)[0])
+
+
+def sequence_width(bounds: np.ndarray, spacings: np.ndarray) -> int:
+    """
+    Computes the width of trimmed images once spaced, without any padding.
+
+    Parameters
+    ----------
+    bounds:
+        A (num_images, 2) array of inclusive (left, right) column bounds.
+    spacings:
+        An array of the `num_images - 1` gaps between consecutive images.
+
+    Returns
+    -------
+    width, the int number of columns from the first to the last inked column.
+    """
+
+    widths = bounds[:, 1].astype(np.int64) - bounds[:, 0] + 1
+
+    return int(widths.sum() + np.sum(spacings))
+
+
+def glyph_offsets(bounds: np.ndarray, spacings: np.ndarray, left_width: int = 0) -> np.ndarray:
+    """
+    Computes the column at which each trimmed image starts, once spaced.
+
+    Parameters
+    ----------
+    bounds:
+        A (num_images, 2) array of inclusive (left, right) column bounds.
+    spacings:
+        An array of the `num_images - 1` gaps between consecutive images.
+    left_width:
+        The number of empty columns before the first image. Default is 0.
+
+    Returns
+    -------
+    offsets, an int array with the starting column of each image.
+    """
+
+    widths = bounds[:, 1].astype(np.int64) - bounds[:, 0] + 1
+
+    offsets = np.full(widths.shape[0], left_width, dtype=np.int64)
+    np.cumsum(widths[:-1] + spacings, out=offsets[1:])
+    offsets[1:] += left_width
+
+    return offsets
+
+
+def compose_images(
+    images: np.ndarray,
+    bounds: np.ndarray,
+    spacings: np.ndarray,
+    left_width: int,
+    image_width: int,
+    dtype=np.uint8
+) -> np.ndarray:
+    """
+    Builds the final inverted image in a single output allocation. Equivalent to
+    `space_images`, `pad_image_bounds` and `invert_image` applied in turn, but each
+    trimmed image is written straight into its place in the output.
+
+    Parameters
+    ----------
+    images:
+        A (num_images, height, width) stack of images, each cell a value 0-255.
+    bounds:
+        A (num_images, 2) array of inclusive (left, right) column bounds to trim each image to.
+    spacings:
+        An array of the `num_images - 1` gaps between consecutive images, in pixels.
+    left_width:
+        The number of empty columns before the first image.
+    image_width:
+        An integer number of pixels the image should be in total
+    dtype:
+        The output dtype. np.uint8 gives values 0-255, np.float32 gives values
+        0 (black) to 1 (white), and np.float64 gives floats 0-255, as the
+        separate processing functions do. Default is np.uint8.
+
+    Returns
+    -------
+    image, a (height, image_width) numpy matrix image with black digits on a white background.
+    """
+
+    dtype = np.dtype(dtype)
+
+    if dtype not in (np.uint8, np.float32, np.float64):
+        raise ValueError(f"Unsupported output dtype {dtype}")
+
+    offsets = glyph_offsets(bounds, spacings, left_width)
+    widths = bounds[:, 1].astype(np.int64) - bounds[:, 0] + 1
+
+    if len(offsets) and offsets[-1] + widths[-1] > image_width:
+        raise ValueError(f"The digits need {offsets[-1] + widths[-1]} pixels, which is wider than image_width={image_width}")
+
+    canvas = np.full((images.shape[1], image_width), 255, dtype=dtype)
+
+    for img, (left, right), offset, width in zip(images, bounds, offsets, widths):
+        np.subtract(255, img[:, left:right+1], out=canvas[:, offset:offset+width])
+
+    if dtype == np.float32:
+        canvas /= 255
+
+    return canvas
+
+
+def compose_batch(
+    image_array: np.ndarray,
+    rows: np.ndarray,
+    indices: np.ndarray,
+    bounds: np.ndarray,
+    offsets: np.ndarray,
+    out: np.ndarray
+) -> np.ndarray:
+    """
+    Builds a whole batch of inverted sequence images at once, writing every glyph
+    column of every image with a single vectorized gather and scatter.
+
+    Glyphs are given as flat arrays, one entry per glyph, so images in the batch
+    may hold different numbers of digits.
+
+    Parameters
+    ----------
+    image_array:
+        The (num_samples, height, width) stack of source images, each cell a value 0-255.
+    rows:
+        An int array giving, for each glyph, the image of the batch it belongs to.
+    indices:
+        An int array giving, for each glyph, its row in `image_array`.
+    bounds:
+        A (num_glyphs, 2) array of inclusive (left, right) column bounds to trim each glyph to.
+    offsets:
+        An int array giving, for each glyph, the output column its left bound lands on.
+    out:
+        The preallocated (batch_size, height, image_width) output array, of dtype
+        np.uint8, np.float32 or np.float64. Its contents are overwritten, with the
+        scale following `compose_images`.
+
+    Returns
+    -------
+    out, the output array, filled with black digits on a white background.
+    """
+
+    if out.dtype not in (np.uint8, np.float32, np.float64):
+        raise ValueError(f"Unsupported output dtype {out.dtype}")
+
+    widths = bounds[:, 1].astype(np.int64) - bounds[:, 0] + 1
+
+    if len(widths) and np.any(offsets + widths > out.shape[2]):
+        raise ValueError(f"The digits are wider than image_width={out.shape[2]}")
+
+    #Expand every glyph into one entry per column it covers
+    starts = np.cumsum(widths) - widths
+    within = np.arange(widths.sum()) - np.repeat(starts, widths)
+
+    column_rows = np.repeat(rows, widths)
+    column_dest = np.repeat(offsets, widths) + within
+    column_source = np.repeat(bounds[:, 0], widths) + within
+    column_images = np.repeat(indices, widths)
+
+    out[...] = 255
+    out[column_rows, :, column_dest] = 255 - image_array[column_images, :, column_source]
+
+    if out.dtype == np.float32:
+        out /= 255
+
+    return out
+
+
+def compose_packed_batch(
+    columns: np.ndarray,
+    column_offsets: np.ndarray,
+    widths: np.ndarray,
+    rows: np.ndarray,
+    offsets: np.ndarray,
+    out: np.ndarray
+) -> np.ndarray:
+    """
+    Builds a batch of inverted sequence images from column-major glyphs, with one
+    vectorized gather and scatter. Gives the same images as `compose_batch`.
+
+    Parameters
+    ----------
+    columns:
+        The (total_columns, height) blob of glyph columns, each cell a value 0-255.
+    column_offsets:
+        An int array giving, for each glyph, the row of `columns` its first column is on.
+    widths:
+        An int array giving, for each glyph, its number of columns.
+    rows:
+        An int array giving, for each glyph, the image of the batch it belongs to.
+    offsets:
+        An int array giving, for each glyph, the output column its first column lands on.
+    out:
+        The preallocated (batch_size, height, image_width) output array, see `compose_batch`.
+
+    Returns
+    -------
+    out, the output array, filled with black digits on a white background.
+    """
+
+    if out.dtype not in (np.uint8, np.float32, np.float64):
+        raise ValueError(f"Unsupported output dtype {out.dtype}")
+
+    widths = np.asarray(widths, dtype=np.int64)
+
+    if len(widths) and np.any(offsets + widths > out.shape[2]):
+        raise ValueError(f"The digits are wider than image_width={out.shape[2]}")
+
+    within = np.arange(widths.sum()) - np.repeat(np.cumsum(widths) - widths, widths)
+
+    out[...] = 255
+    out[np.repeat(rows, widths), :, np.repeat(offsets, widths) + within] = 255 - columns[np.repeat(column_offsets, widths) + within]
+
+    if out.dtype == np.float32:
+        out /= 255
+
+    return out
@@ -0,0 +1,134 @@
+from typing import Optional
+import numpy as np
+
+class LabelIndex:
+    """
+    A compact index from each label to the rows of the dataset carrying it.
+
+    All row numbers are held in a single int32 array, grouped by label, with
+    `offsets[label]:offsets[label+1]` delimiting the rows of each label. Built
+    in linear time with a stable argsort.
+
+    Within each label, rows are listed from last to first, so that a given random
+    seed keeps picking the same digits as earlier versions of this library.
+    """
+
+    def __init__(self, labels: np.ndarray, num_labels: int = 10):
+        """
+        Builds the index from an array of labels.
+
+        Parameters
+        ----------
+        labels:
+            A 1D numpy array of integer labels, one per dataset row.
+        num_labels:
+            The number of distinct labels. Labels must lie in [0, num_labels).
+            Default is 10.
+
+        Returns
+        -------
+        self, a LabelIndex over the given labels.
+        """
+
+        labels = np.asarray(labels)
+
+        if labels.ndim != 1:
+            raise ValueError("labels must be a 1D array")
+
+        if labels.size and (labels.min() < 0 or labels.max() >= num_labels):
+            raise ValueError(f"labels must lie in the range [0, {num_labels})")
+
+        n = labels.shape[0]
+
+        #Stable sort of the reversed labels, mapped back, keeps rows in descending order per label
+        order = np.argsort(labels[::-1], kind="stable")
+        self.order = (n - 1 - order).astype(np.int32)
+
+        self.counts = np.bincount(labels, minlength=num_labels).astype(np.int64)
+
+        self.offsets = np.zeros(num_labels + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=self.offsets[1:])
+
+        self.num_labels = num_labels
+
+    @classmethod
+    def from_order(cls, order: np.ndarray, counts: np.ndarray) -> "LabelIndex":
+        """
+        Rebuilds an index from its `order` and `counts` arrays, e.g. as saved in a glyph pack.
+
+        Parameters
+        ----------
+        order:
+            The dataset rows, grouped by label, as in the `order` of an index.
+        counts:
+            The number of rows of each label.
+
+        Returns
+        -------
+        index, a LabelIndex equal to the one the arrays were taken from.
+        """
+
+        index = cls.__new__(cls)
+
+        index.order = np.asarray(order, dtype=np.int32)
+        index.counts = np.asarray(counts, dtype=np.int64)
+
+        index.offsets = np.zeros(index.counts.shape[0] + 1, dtype=np.int64)
+        np.cumsum(index.counts, out=index.offsets[1:])
+
+        index.num_labels = index.counts.shape[0]
+
+        return index
+
+    def __len__(self) -> int:
+        return int(self.order.shape[0])
+
+    def count(self, label: int) -> int:
+        """
+        Returns the number of rows carrying `label`.
+        """
+
+        return int(self.counts[label])
+
+    def indices(self, label: int) -> np.ndarray:
+        """
+        Returns the dataset rows carrying `label`, as a read-only int32 view.
+        """
+
+        if not 0 <= label < self.num_labels:
+            raise KeyError(label)
+
+        view = self.order[self.offsets[label]:self.offsets[label + 1]]
+        view.flags.writeable = False
+
+        return view
+
+    def sample(self, labels, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """
+        Draws one random row for every entry of `labels`, in a single vectorized
+        call to the random number generator.
+
+        Parameters
+        ----------
+        labels:
+            An int or an array-like of ints of any shape, e.g. one sequence of digits
+            or a (num_sequences, num_digits) matrix of them.
+        rng:
+            An optional numpy Generator to draw with. Default is None, which uses fresh entropy.
+
+        Returns
+        -------
+        rows, an int array of the same shape as `labels`, holding the drawn dataset rows.
+        """
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        labels = np.asarray(labels, dtype=np.intp)
+
+        if labels.size and (labels.min() < 0 or labels.max() >= self.num_labels):
+            raise ValueError(f"labels must lie in the range [0, {self.num_labels})")
+
+        draws = rng.integers(0, self.counts[labels])
+
+        return self.order[self.offsets[labels] + draws]
@@ -0,0 +1,265 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import bisect
+import contextlib
+import threading
+import time
+
+#The stages of image generation, in pipeline order
+STAGES = ("load", "sample", "trim", "spacing", "padding", "compose", "augment", "encode")
+
+#Upper bounds, in seconds, of the histogram buckets of every stage
+BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+#Shared by every stage while profiling is disabled, so that timing costs nothing
+_NULL_STAGE = contextlib.nullcontext()
+
+_active_profile = None
+
+
+class _StageTimer:
+    """
+    Times one pass through a stage, recording it into a StageProfile on exit.
+    """
+
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile: "StageProfile", name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self.profile.observe(self.name, time.perf_counter() - self.start)
+
+
+class StageProfile:
+    """
+    Collects the time spent in each stage of image generation, as one histogram per stage.
+
+    General order of use:
+        - Enable profiling with `enable_profiling()`, which returns the active StageProfile
+        - Generate images; each stage records its time through `stage(name)`
+        - Read the results with .summary(), or .to_prometheus() for a metrics endpoint
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        """
+        Parameters
+        ----------
+        buckets:
+            The increasing upper bounds, in seconds, of the histogram buckets. Default is `BUCKETS`.
+
+        Returns
+        -------
+        self, an empty StageProfile.
+        """
+
+        self.buckets = tuple(buckets)
+
+        self._lock = threading.Lock()
+
+        #Maps each stage to [per-bucket counts, +Inf bucket last; total seconds; calls; max seconds]
+        self._stages: Dict[str, list] = {}
+
+    def stage(self, name: str) -> _StageTimer:
+        """
+        Gives a context manager timing the `name` stage.
+        """
+
+        return _StageTimer(self, name)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Records one pass through the `name` stage, that took `seconds`.
+        """
+
+        bucket = bisect.bisect_left(self.buckets, seconds)
+
+        with self._lock:
+            entry = self._stages.get(name)
+
+            if entry is None:
+                entry = self._stages[name] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0]
+
+            entry[0][bucket] += 1
+            entry[1] += seconds
+            entry[2] += 1
+            entry[3] = max(entry[3], seconds)
+
+    def snapshot(self) -> Dict[str, tuple]:
+        """
+        Gives a picklable copy of the recorded times, for `merge` into another profile.
+        """
+
+        with self._lock:
+            return {name: (list(counts), total, calls, longest) for name, (counts, total, calls, longest) in self._stages.items()}
+
+    def merge(self, snapshot: Dict[str, tuple]) -> None:
+        """
+        Adds the times of a `snapshot`, for example one taken in a worker process.
+        Both profiles must use the same buckets.
+        """
+
+        with self._lock:
+            for name, (counts, total, calls, longest) in snapshot.items():
+                entry = self._stages.get(name)
+
+                if entry is None:
+                    entry = self._stages[name] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0]
+
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += calls
+                entry[3] = max(entry[3], longest)
+
+    def summary(self) -> List[dict]:
+        """
+        Summarizes each recorded stage, in pipeline order.
+
+        Returns
+        -------
+        rows, a list of dicts with the "stage" name, its number of "calls", and its
+        "total_seconds", "mean_seconds" and "max_seconds".
+        """
+
+        snapshot = self.snapshot()
+        order = {name: i for i, name in enumerate(STAGES)}
+
+        rows = []
+        for name in sorted(snapshot, key=lambda name: (order.get(name, len(STAGES)), name)):
+            _, total, calls, longest = snapshot[name]
+
+            rows.append({
+                "stage": name,
+                "calls": calls,
+                "total_seconds": total,
+                "mean_seconds": total / calls,
+                "max_seconds": longest,
+            })
+
+        return rows
+
+    def to_prometheus(self, metric: str = "number_generator_stage_seconds") -> str:
+        """
+        Renders the recorded times as a Prometheus histogram, labelled by stage, in
+        the Prometheus text exposition format.
+        """
+
+        lines = [
+            f"# HELP {metric} Time spent in each stage of image generation.",
+            f"# TYPE {metric} histogram",
+        ]
+
+        for name, (counts, total, calls, _) in self.snapshot().items():
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+
+            lines.append(f'{metric}_sum{{stage="{name}"}} {total!r}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {calls}')
+
+        return "\n".join(lines) + "\n"
+
+
+def enable_profiling(profile: Optional[StageProfile] = None) -> StageProfile:
+    """
+    Starts recording stage times, process-wide, into `profile` or a new StageProfile.
+
+    Returns
+    -------
+    profile, the now active StageProfile.
+    """
+
+    global _active_profile
+
+    if profile is None:
+        profile = StageProfile()
+
+    _active_profile = profile
+
+    return profile
+
+
+def disable_profiling() -> None:
+    """
+    Stops recording stage times.
+    """
+
+    global _active_profile
+
+    _active_profile = None
+
+
+def get_profile() -> Optional[StageProfile]:
+    """
+    Gives the active StageProfile, or None while profiling is disabled.
+    """
+
+    return _active_profile
+
+
+def stage(name: str):
+    """
+    Gives a context manager timing the `name` stage into the active profile, or a
+    shared no-op one while profiling is disabled.
+    """
+
+    if _active_profile is None:
+        return _NULL_STAGE
+
+    return _active_profile.stage(name)
+
+
+def run_profiled(fn: Callable, *args, **kwargs) -> Tuple[object, Dict[str, tuple]]:
+    """
+    Runs `fn(*args, **kwargs)` with a fresh profile, for example in a worker process,
+    restoring the previous profile afterwards.
+
+    Returns
+    -------
+    (result, snapshot), the result of the call, and the snapshot of the stage times it
+    recorded, to `merge` into the caller's profile.
+    """
+
+    previous = get_profile()
+    profile = enable_profiling()
+
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        if previous is None:
+            disable_profiling()
+        else:
+            enable_profiling(previous)
+
+    return result, profile.snapshot()
+
+
+def format_summary(profile: StageProfile) -> str:
+    """
+    Formats the summary of a profile as a text table, one row per stage.
+    """
+
+    rows = profile.summary()
+    overall = sum(row["total_seconds"] for row in rows) or 1.0
+
+    lines = [f"{'stage':<10}{'calls':>10}{'total s':>12}{'mean ms':>12}{'max ms':>12}{'share':>8}"]
+
+    for row in rows:
+        lines.append(
+            f"{row['stage']:<10}{row['calls']:>10}{row['total_seconds']:>12.4f}"
+            f"{1e3 * row['mean_seconds']:>12.4f}{1e3 * row['max_seconds']:>12.4f}"
+            f"{100 * row['total_seconds'] / overall:>7.1f}%"
+        )
+
+    return "\n".join(lines)
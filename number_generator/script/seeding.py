@@ -0,0 +1,103 @@
+from typing import Dict, List, Optional, Sequence, Union
+import numpy as np
+
+#The stages that each draw from their own stream. A stage's stream is the child of its
+#position, so new stages must only ever be appended, or existing seeds would change.
+STAGES = ("digits", "sample", "spacing", "padding", "augment")
+_STAGE_KEYS = {name: i for i, name in enumerate(STAGES)}
+
+#The stages that int seeds drive directly, as they did before per-stage streams existed
+_LEGACY_STAGES = ("digits", "sample", "spacing", "padding")
+
+#Anything accepted as a `random_seed` by the generation functions
+Seed = Union[None, int, np.random.SeedSequence, np.random.Generator]
+
+
+def sample_seed(base_seed: Optional[int], sample_index: int) -> np.random.SeedSequence:
+    """
+    Gives the seed of the `sample_index`-th sample of a job seeded with `base_seed`.
+
+    The seed is the child `np.random.SeedSequence(base_seed).spawn` gives for that
+    index, built directly from its spawn key. It therefore only depends on
+    `(base_seed, sample_index)`, and a job split over threads, processes or machines
+    generates the same samples without any coordination.
+
+    Parameters
+    ----------
+    base_seed:
+        The int seed of the job, or a SeedSequence to address the samples under.
+        None draws fresh entropy, so the sample is not reproducible.
+    sample_index:
+        The non-negative int index of the sample within the job.
+
+    Returns
+    -------
+    seed, a SeedSequence to give as the `random_seed` of the sample.
+    """
+
+    if isinstance(base_seed, np.random.SeedSequence):
+        return np.random.SeedSequence(base_seed.entropy, spawn_key=base_seed.spawn_key + (sample_index,), pool_size=base_seed.pool_size)
+
+    return np.random.SeedSequence(base_seed, spawn_key=(sample_index,))
+
+
+def sample_seeds(base_seed: Optional[int], start: int, stop: int) -> List[np.random.SeedSequence]:
+    """
+    Gives the seeds of samples `start` to `stop` (excluded) of a job, see `sample_seed`.
+    """
+
+    if base_seed is None:
+        base_seed = np.random.SeedSequence()
+
+    return [sample_seed(base_seed, i) for i in range(start, stop)]
+
+
+def stage_rngs(seed: np.random.SeedSequence, stages: Sequence[str] = STAGES) -> Dict[str, np.random.Generator]:
+    """
+    Gives an independent random number generator per stage, each seeded with the
+    child of `seed` at the stage's position in `STAGES`, so that a stage drawing more
+    or fewer numbers never shifts the draws of another.
+
+    Parameters
+    ----------
+    seed:
+        The SeedSequence of a sample, see `sample_seed`.
+    stages:
+        The names of the stages to build generators for, as building one costs
+        tens of microseconds. Default is all of `STAGES`.
+
+    Returns
+    -------
+    rngs, a dict from each stage name to its numpy Generator.
+    """
+
+    return {
+        name: np.random.default_rng(
+            np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (_STAGE_KEYS[name],), pool_size=seed.pool_size)
+        )
+        for name in stages
+    }
+
+
+def stage_streams(random_seed: Seed, stages: Sequence[str] = STAGES) -> Dict[str, Seed]:
+    """
+    Gives what each of the given `stages` should seed its draws with.
+
+    A SeedSequence, e.g. from `sample_seed`, gets one independent generator per stage.
+    Anything else is handed as is to the stages that existed before per-stage streams,
+    which keeps the images of int seeds the same as earlier versions of this library.
+    Later stages get an independent child of an int seed instead.
+    """
+
+    if isinstance(random_seed, np.random.SeedSequence):
+        return stage_rngs(random_seed, stages)
+
+    streams = {}
+
+    for name in stages:
+        if name not in _LEGACY_STAGES and isinstance(random_seed, (int, np.integer)):
+            streams[name] = np.random.SeedSequence(random_seed, spawn_key=(_STAGE_KEYS[name],))
+        else:
+            streams[name] = random_seed
+
+    return streams
@@ -0,0 +1,285 @@
+from typing import Dict, List, Optional
+import numpy as np
+import io
+import json
+import os
+import tarfile
+from .encoding import FILE_EXTENSIONS, encode_image
+
+SHARD_FORMATS = ("tar", "npz", "npy")
+
+MANIFEST_NAME = "manifest.json"
+
+
+class ShardedDatasetWriter:
+    """
+    A helper class to write a large generated dataset as fixed-size shards, with a
+    manifest that allows an interrupted run to be resumed.
+
+    Supported formats:
+        - "tar": one `shard-XXXXX.tar` per shard, holding a `{index}.png` image (or another
+          `image_encoding`) and a `{index}.json` label member for every image.
+        - "npz": one `shard-XXXXX.npz` per shard, holding `images`, `labels` and `indices` arrays.
+        - "npy": a single `images.npy` (num_images, height, width) uint8 array and a
+          `labels.npy` array for the whole run, both filled shard by shard through
+          memory maps.
+
+    General order of use:
+        - Initialize ShardedDatasetWriter with the run parameters
+        - Call .pending_shards() to find the shards still to generate
+        - Call .write_shard() for each of them, in any order
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        shard_format: str,
+        shard_size: int,
+        num_images: int,
+        image_shape: tuple,
+        num_digits: int,
+        parameters: Optional[Dict] = None,
+        resume: bool = False,
+        image_encoding: str = "png",
+        png_level: Optional[int] = None
+    ):
+        """
+        Prepares the output folder and manifest of a sharded run.
+
+        Parameters
+        ----------
+        output_path:
+            A string path to the folder to write shards into. Created if missing.
+        shard_format:
+            One of "tar", "npz" or "npy".
+        shard_size:
+            The number of images per shard. The last shard may be smaller.
+        num_images:
+            The total number of images of the run.
+        image_shape:
+            The (height, width) of every image.
+        num_digits:
+            The number of digit labels of every image.
+        parameters:
+            An optional dict of JSON-serializable generation parameters to store in the
+            manifest. Resuming requires them to match. Default is None.
+        resume:
+            Whether to continue a previous run found in `output_path`, skipping its
+            completed shards. If False, an existing manifest is an error. Default is False.
+        image_encoding:
+            The encoding of the image members of tar shards, see `encode_image`. Default is "png".
+        png_level:
+            An optional PNG compression level for tar shards. Default is None.
+
+        Returns
+        -------
+        self, a ShardedDatasetWriter ready to write shards.
+        """
+
+        if shard_format not in SHARD_FORMATS:
+            raise ValueError(f"Unknown shard format {shard_format}, expected one of {SHARD_FORMATS}")
+
+        if shard_size <= 0:
+            raise ValueError("shard_size must be positive")
+
+        self.output_path = output_path
+        self.manifest_path = os.path.join(output_path, MANIFEST_NAME)
+
+        self.manifest = {
+            "format": shard_format,
+            "shard_size": shard_size,
+            "num_images": num_images,
+            "image_shape": list(image_shape),
+            "num_digits": num_digits,
+            "parameters": parameters or {},
+            "image_encoding": image_encoding,
+            "png_level": png_level,
+            "shards": {}
+        }
+
+        os.makedirs(output_path, exist_ok=True)
+
+        if os.path.exists(self.manifest_path):
+            if not resume:
+                raise RuntimeError(f"{self.manifest_path} already exists, pass resume to continue that run")
+
+            with open(self.manifest_path, "r") as f:
+                previous = json.load(f)
+
+            for key in ("format", "shard_size", "num_images", "image_shape", "num_digits", "parameters", "image_encoding", "png_level"):
+                if previous[key] != self.manifest[key]:
+                    raise RuntimeError(f"Cannot resume: {key} differs from the previous run ({previous[key]})")
+
+            self.manifest["shards"] = previous["shards"]
+
+        if shard_format == "npy":
+            self._create_arrays(overwrite=not self.manifest["shards"])
+
+        self._write_manifest()
+
+    @property
+    def num_shards(self) -> int:
+        return -(-self.manifest["num_images"] // self.manifest["shard_size"])
+
+    @property
+    def complete(self) -> bool:
+        return len(self.manifest["shards"]) == self.num_shards
+
+    def shard_range(self, shard: int) -> range:
+        """
+        Returns the range of image indices held by `shard`.
+        """
+
+        start = shard * self.manifest["shard_size"]
+
+        return range(start, min(start + self.manifest["shard_size"], self.manifest["num_images"]))
+
+    def shard_file(self, shard: int) -> str:
+        """
+        Returns the file name, within the output folder, that holds `shard`.
+        """
+
+        if self.manifest["format"] == "npy":
+            return "images.npy"
+
+        return f"shard-{shard:05d}.{self.manifest['format']}"
+
+    def pending_shards(self) -> List[int]:
+        """
+        Returns the shard numbers that have not been completed yet.
+        """
+
+        return [shard for shard in range(self.num_shards) if str(shard) not in self.manifest["shards"]]
+
+    def write_shard(self, shard: int, images: np.ndarray, labels: np.ndarray) -> None:
+        """
+        Writes one shard and records it as completed in the manifest.
+
+        Parameters
+        ----------
+        shard:
+            The shard number.
+        images:
+            The (len(shard_range), height, width) uint8 images of the shard.
+        labels:
+            The (len(shard_range), num_digits) digit labels of the shard.
+
+        Returns
+        -------
+        None
+        """
+
+        self.write_shard_file(shard, images, labels)
+        self.mark_complete(shard)
+
+    def write_shard_file(self, shard: int, images: np.ndarray, labels: np.ndarray) -> str:
+        """
+        Writes one shard to disk, without touching the manifest. Shard files are
+        written under a temporary name and then renamed, so an interrupted write
+        never leaves a partial shard behind. Safe to call from worker processes.
+
+        Returns
+        -------
+        name, the file name of the shard within the output folder.
+        """
+
+        indices = self.shard_range(shard)
+
+        if images.shape[0] != len(indices) or labels.shape[0] != len(indices):
+            raise ValueError(f"Shard {shard} holds {len(indices)} images, got {images.shape[0]}")
+
+        images = np.asarray(images, dtype=np.uint8)
+        labels = np.asarray(labels, dtype=np.uint8)
+
+        shard_format = self.manifest["format"]
+
+        if shard_format == "npy":
+            image_array = np.load(os.path.join(self.output_path, "images.npy"), mmap_mode="r+")
+            label_array = np.load(os.path.join(self.output_path, "labels.npy"), mmap_mode="r+")
+
+            image_array[indices.start:indices.stop] = images
+            label_array[indices.start:indices.stop] = labels
+
+            image_array.flush()
+            label_array.flush()
+
+            return self.shard_file(shard)
+
+        name = self.shard_file(shard)
+        path = os.path.join(self.output_path, name)
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            if shard_format == "npz":
+                np.savez(f, images=images, labels=labels, indices=np.arange(indices.start, indices.stop))
+            else:
+                encoding, png_level = self.manifest["image_encoding"], self.manifest["png_level"]
+                extension = FILE_EXTENSIONS[encoding]
+
+                with tarfile.open(fileobj=f, mode="w") as tar:
+                    for i, image, digits in zip(indices, images, labels):
+                        add_tar_member(tar, f"{i:08d}.{extension}", encode_image(image, encoding, png_level))
+                        add_tar_member(tar, f"{i:08d}.json", label_json(i, digits))
+
+        os.replace(tmp_path, path)
+
+        return name
+
+    def mark_complete(self, shard: int) -> None:
+        """
+        Records a written shard as completed in the manifest.
+        """
+
+        indices = self.shard_range(shard)
+
+        self.manifest["shards"][str(shard)] = {"file": self.shard_file(shard), "start": indices.start, "count": len(indices)}
+        self._write_manifest()
+
+    def _create_arrays(self, overwrite: bool) -> None:
+        """
+        Creates the run-wide npy arrays. Existing arrays are kept when resuming a run
+        that already completed shards.
+        """
+
+        num_images = self.manifest["num_images"]
+
+        for name, shape in (
+            ("images.npy", (num_images, *self.manifest["image_shape"])),
+            ("labels.npy", (num_images, self.manifest["num_digits"]))
+        ):
+            path = os.path.join(self.output_path, name)
+
+            if overwrite or not os.path.exists(path):
+                np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape).flush()
+
+    def _write_manifest(self) -> None:
+        """
+        Writes the manifest atomically, so it always describes fully written shards.
+        """
+
+        self.manifest["complete"] = self.complete
+
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+        os.replace(tmp_path, self.manifest_path)
+
+
+def label_json(index: int, digits) -> bytes:
+    """
+    Encodes the label of an image as the JSON document stored next to it in archives.
+    """
+
+    return json.dumps({"index": int(index), "digits": [int(d) for d in digits]}).encode()
+
+
+def add_tar_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    """
+    Adds an in-memory file to an open tar archive.
+    """
+
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+
+    tar.addfile(info, io.BytesIO(data))
@@ -0,0 +1,206 @@
+from typing import Dict, Optional, Tuple
+import inspect
+import json
+import os
+import numpy as np
+
+from .dataload import MNIST_Loader
+from .labelindex import LabelIndex
+
+#Shared memory is only in the standard library from Python 3.8
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+#The environment variable handing the descriptor of a shared dataset to worker processes
+SHARED_DATASET_ENV = "NUMBER_GENERATOR_SHARED_DATASET"
+
+#Each array of a shared dataset is aligned to this many bytes
+_ALIGNMENT = 64
+
+#Python 3.13 can open shared memory without the resource tracker owning it
+_UNTRACKED = shared_memory is not None and "track" in inspect.signature(shared_memory.SharedMemory).parameters
+
+
+class SharedDataset:
+    """
+    A loaded dataset copied into one block of shared memory, so that many processes
+    use a single copy of it, attached read-only, instead of loading their own.
+
+    The block holds the images, the label index and the trim bounds, and the
+    descriptor the identity of the data, everything a loader needs, so attaching
+    never touches the dataset files.
+
+    General order of use:
+        - In the parent, `SharedDataset.create` from a loaded MNIST_Loader
+        - Hand its `descriptor` to the workers, e.g. in the NUMBER_GENERATOR_SHARED_DATASET
+          environment variable, which `preload_MNIST` attaches to
+        - In each worker, `SharedDataset.attach` to the descriptor and use its `loader`
+        - In the parent, `close` and `unlink` it once the workers are done
+    """
+
+    def __init__(
+        self,
+        memory,
+        layout: Dict[str, Tuple[int, Tuple[int, ...], str]],
+        download_directory: str,
+        dataset_id: Optional[str] = None
+    ):
+        """
+        Wraps a block of shared memory. Use `create` or `attach` instead.
+        """
+
+        self.memory = memory
+        self.layout = layout
+        self.download_directory = download_directory
+        self.dataset_id = dataset_id
+
+        self.arrays = {}
+
+        for name, (offset, shape, dtype) in layout.items():
+            array = np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+            array.flags.writeable = False
+            self.arrays[name] = array
+
+    @classmethod
+    def create(cls, loader: MNIST_Loader) -> "SharedDataset":
+        """
+        Copies the data of a loaded MNIST_Loader into a new block of shared memory.
+
+        Parameters
+        ----------
+        loader:
+            The loaded MNIST_Loader to share. A loader reading a glyph pack is shared
+            as the full images the pack holds.
+
+        Returns
+        -------
+        shared, the SharedDataset, which owns the block until `unlink` is called.
+        """
+
+        arrays = {
+            "images": np.asarray(loader.image_array, dtype=np.uint8),
+            "order": np.asarray(loader.label_index.order, dtype=np.int32),
+            "counts": np.asarray(loader.label_index.counts, dtype=np.int64),
+            "trim_bounds": np.asarray(loader.trim_bounds),
+        }
+
+        layout = {}
+        size = 0
+
+        for name, array in arrays.items():
+            size = -(-size // _ALIGNMENT) * _ALIGNMENT
+            layout[name] = (size, array.shape, array.dtype.str)
+            size += array.nbytes
+
+        shared = cls(_open_memory(size=max(size, 1)), layout, os.path.abspath(loader.download_directory), loader.dataset_id)
+
+        for name, array in arrays.items():
+            offset, shape, dtype = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=shared.memory.buf, offset=offset)[...] = array
+
+        return shared
+
+    @classmethod
+    def attach(cls, descriptor: str) -> "SharedDataset":
+        """
+        Attaches to the SharedDataset a `descriptor` string describes.
+        """
+
+        described = json.loads(descriptor)
+        layout = {name: (offset, tuple(shape), dtype) for name, (offset, shape, dtype) in described["layout"].items()}
+
+        return cls(_open_memory(name=described["name"]), layout, described["download_directory"], described["dataset_id"])
+
+    @property
+    def descriptor(self) -> str:
+        """
+        A string describing the shared dataset, to `attach` to it from other processes.
+        """
+
+        return json.dumps({
+            "name": self.memory.name,
+            "layout": self.layout,
+            "download_directory": self.download_directory,
+            "dataset_id": self.dataset_id,
+        })
+
+    def loader(self) -> MNIST_Loader:
+        """
+        Builds a loaded MNIST_Loader over the shared arrays, without reading any file.
+        """
+
+        loader = MNIST_Loader(download_directory=self.download_directory)
+
+        loader.image_array = self.arrays["images"]
+        loader.label_index = LabelIndex.from_order(self.arrays["order"], self.arrays["counts"])
+        loader.trim_bounds = self.arrays["trim_bounds"]
+        loader.dataset_id = self.dataset_id
+
+        #Keeps the shared memory mapped for as long as the loader is in use
+        loader.shared_dataset = self
+
+        return loader
+
+    def close(self) -> None:
+        """
+        Unmaps the shared memory from this process. Arrays of it must not be used after.
+        """
+
+        self.arrays.clear()
+        self.memory.close()
+
+    def unlink(self) -> None:
+        """
+        Frees the shared memory once every process has closed it. Called once, by the
+        process that created it.
+        """
+
+        if not _UNTRACKED and os.name == "posix":
+            #Re-registered only to balance the unregistering `unlink` does
+            from multiprocessing import resource_tracker
+
+            resource_tracker.register(self.memory._name, "shared_memory")
+
+        self.memory.unlink()
+
+
+def _open_memory(name: Optional[str] = None, size: int = 0):
+    """
+    Creates a block of shared memory of `size` bytes, or opens the one called `name`.
+
+    Before Python 3.13, every process opening a block registers it with its resource
+    tracker, which unlinks it when the process exits, pulling it from under the other
+    processes. The block is therefore unregistered straight away, and its lifetime left
+    to the creator's `unlink`.
+    """
+
+    if shared_memory is None:
+        raise RuntimeError("Sharing the dataset requires multiprocessing.shared_memory, from Python 3.8")
+
+    if _UNTRACKED:
+        return shared_memory.SharedMemory(name=name, create=name is None, size=size, track=False)
+
+    memory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+
+    if os.name == "posix":
+        from multiprocessing import resource_tracker
+
+        resource_tracker.unregister(memory._name, "shared_memory")
+
+    return memory
+
+
+def attach_shared_loader(download_directory: str) -> Optional[MNIST_Loader]:
+    """
+    Gives a loader over the shared dataset the NUMBER_GENERATOR_SHARED_DATASET environment
+    variable describes, if it is set and shares `download_directory`, and None otherwise.
+    """
+
+    descriptor = os.environ.get(SHARED_DATASET_ENV)
+
+    if not descriptor or json.loads(descriptor)["download_directory"] != os.path.abspath(download_directory):
+        return None
+
+    return SharedDataset.attach(descriptor).loader()
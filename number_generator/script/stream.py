@@ -0,0 +1,230 @@
+from typing import Iterator, Optional, Tuple
+from .dataload import get_loader
+from .generate import generate_numbers_sequence_batch
+import numpy as np
+import multiprocessing
+import queue
+import threading
+import traceback
+
+
+def generate_stream_batch(
+    batch: int,
+    entropy: int,
+    batch_size: int,
+    sequence_length: int,
+    spacing_range: Tuple[int, int],
+    image_width: int,
+    download_directory: str = "mnist/",
+    dtype=np.uint8
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generates the `batch`-th batch of a stream. Each batch draws from its own random
+    stream, derived from the stream's entropy and the batch number, so any worker can
+    produce any batch and get the same result.
+
+    Returns
+    -------
+    (images, labels), a (batch_size, 28, image_width) image array and the
+    (batch_size, sequence_length) matrix of the digits they show.
+    """
+
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(batch,)))
+
+    labels = rng.integers(low=0, high=10, size=(batch_size, sequence_length))
+
+    images = generate_numbers_sequence_batch(
+        labels,
+        spacing_range,
+        image_width,
+        random_seed=rng,
+        loader=get_loader(download_directory),
+        dtype=dtype
+    )
+
+    return images, labels
+
+
+def _produce(worker: int, num_workers: int, batches, stop, arguments: tuple) -> None:
+    """
+    The body of a stream worker: generates every `num_workers`-th batch, starting at
+    `worker`, until the stream is stopped. Runs in a thread or in a process.
+    """
+
+    batch = worker
+
+    #A stopped process should exit at once, rather than wait to flush unwanted batches
+    if hasattr(batches, "cancel_join_thread"):
+        batches.cancel_join_thread()
+
+    try:
+        while not stop.is_set():
+            item = (batch, generate_stream_batch(batch, *arguments))
+
+            #Wait for room in the queue, but keep checking whether the stream was stopped
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+            batch += num_workers
+    except Exception:
+        batches.put((None, traceback.format_exc()))
+
+
+class SequenceStream:
+    """
+    An endless iterable of (images, labels) training batches, generated by background
+    workers into a bounded prefetch queue, so the consumer rarely waits on generation.
+
+    Batches come out in the same order, with the same contents, for a given random seed,
+    whatever the number of workers.
+
+    General order of use:
+        - Initialize SequenceStream with the batch parameters
+        - Iterate over it, e.g. `for images, labels in stream:`
+        - Call .close(), or use it as a context manager, to stop the workers
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 256,
+        sequence_length: int = 10,
+        spacing_range: Tuple[int, int] = (0, 10),
+        image_width: int = 512,
+        random_seed: Optional[int] = None,
+        prefetch: int = 8,
+        num_workers: int = 1,
+        backend: str = "thread",
+        download_directory: str = "mnist/",
+        dtype=np.uint8
+    ):
+        """
+        Sets up the stream. Workers start on the first iteration.
+
+        Parameters
+        ----------
+        batch_size:
+            The number of images per batch. Default is 256.
+        sequence_length:
+            The number of uniformly random digits per image. Default is 10, the length
+            of a Japanese phone number.
+        spacing_range:
+            a (minimum, maximum) int pair (tuple), representing the min and max spacing
+            between digits. Unit should be pixel. Default is (0, 10).
+        image_width:
+            specifies the width of the images in pixels. Default is 512.
+        random_seed:
+            An optional parameter to initialize random number generation. Default is None.
+        prefetch:
+            The maximum number of generated batches waiting to be consumed, split
+            between the workers, each holding at least one. Default is 8.
+        num_workers:
+            The number of background workers generating batches. Default is 1.
+        backend:
+            "thread" to generate in background threads, or "process" to generate in
+            background processes, which avoids contention on the GIL. Default is "thread".
+        download_directory:
+            The folder holding the MNIST data. Default is 'mnist/'
+        dtype:
+            The numpy dtype of the images, see `generate_numbers_sequence`. Default is np.uint8.
+
+        Returns
+        -------
+        self, a SequenceStream ready to iterate over.
+        """
+
+        if backend not in ("thread", "process"):
+            raise ValueError(f"Unknown backend {backend}, expected 'thread' or 'process'")
+
+        self.prefetch = prefetch
+        self.num_workers = num_workers
+        self.backend = backend
+
+        entropy = np.random.SeedSequence(random_seed).entropy
+
+        self._arguments = (entropy, batch_size, sequence_length, tuple(spacing_range), image_width, download_directory, dtype)
+        self._workers = []
+        self._queues = []
+        self._next_batch = 0
+
+    def __enter__(self) -> "SequenceStream":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        if not self._workers:
+            self._start()
+
+        while True:
+            yield self._get(self._next_batch)
+            self._next_batch += 1
+
+    def _start(self) -> None:
+        """
+        Starts the background workers.
+        """
+
+        if self.backend == "thread":
+            queue_class = queue.Queue
+            self._stop = threading.Event()
+            worker_class = threading.Thread
+        else:
+            #Load (and if needed download) the data once, rather than racing in every worker
+            get_loader(self._arguments[5])
+
+            queue_class = multiprocessing.Queue
+            self._stop = multiprocessing.Event()
+            worker_class = multiprocessing.Process
+
+        #Each worker fills its own queue, in batch order, so no batch is ever held back to reorder
+        self._queues = [
+            queue_class(maxsize=max(self.prefetch // self.num_workers + (worker < self.prefetch % self.num_workers), 1))
+            for worker in range(self.num_workers)
+        ]
+
+        for worker in range(self.num_workers):
+            runner = worker_class(
+                target=_produce,
+                args=(worker, self.num_workers, self._queues[worker], self._stop, self._arguments),
+                daemon=True
+            )
+            runner.start()
+
+            self._workers.append(runner)
+
+    def _get(self, batch: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Waits for the given batch, the next one in the queue of the worker producing it.
+        """
+
+        number, item = self._queues[batch % self.num_workers].get()
+
+        if number is None:
+            self.close()
+            raise RuntimeError(f"A stream worker failed:\n{item}")
+
+        return item
+
+    def close(self) -> None:
+        """
+        Stops the background workers.
+        """
+
+        if not self._workers:
+            return
+
+        self._stop.set()
+
+        for worker in self._workers:
+            worker.join(timeout=5)
+
+            #A process still flushing batches into the queue would otherwise never exit
+            if self.backend == "process" and worker.is_alive():
+                worker.terminate()
+
+        self._workers = []
@@ -0,0 +1,16 @@
+from number_generator.script.dataload import MNIST_Loader
+from benchmarks.fixtures import write_synthetic_mnist
+import pytest
+
+@pytest.fixture
+def synthetic_mnist(tmp_path):
+    """
+    A small, loaded MNIST_Loader over random IDX files, so tests can run offline
+    """
+
+    write_synthetic_mnist(str(tmp_path), num_images=600, random_seed=12345)
+
+    mnist = MNIST_Loader(download_directory=str(tmp_path))
+    mnist.load_MNIST()
+
+    return mnist
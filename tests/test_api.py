@@ -0,0 +1,520 @@
+from number_generator.api.api import app, render_sequence, render_phone_number
+from number_generator.api.coalescer import Coalescer
+from number_generator.api.executor import BoundedExecutor, ExecutorBusy
+from number_generator.api.pool import WarmPool
+from number_generator.api.cache import ResponseCache
+from number_generator.api.jobs import JobQueue, host_id
+from number_generator.api.api_models import GenerateJobRequest
+from number_generator.script.dataload import MNIST_Loader, get_loader
+from number_generator.script.shared import SHARED_DATASET_ENV, SharedDataset, shared_memory
+from number_generator.script.glyphpack import PACK_NAME, build_glyph_pack
+from number_generator import generate_phone_number_batch, sample_seeds, invalidate_loader
+from fastapi.testclient import TestClient
+import asyncio
+import cv2
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+import numpy as np
+import pytest
+
+def test_api_seq():
+    """
+    Tests the API for creating a sequence
+    """
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/generate-numbers-sequence",
+            json={"sequence": [1, 2, 3, 4, 5], "min_spacing": 0, "max_spacing": 10, "image_width": 256, "random_seed": 12345}
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+
+    image = cv2.imdecode(np.frombuffer(response.content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+    assert image.shape == (28, 256)
+
+
+def test_api_busy():
+    """
+    Tests that the API answers 503 with a Retry-After header once the worker queue is full
+    """
+
+    with TestClient(app) as client:
+        app.state.executor.shutdown()
+        app.state.executor = BoundedExecutor(max_workers=1, max_pending=0)
+
+        response = client.post(
+            "/generate-phone-number",
+            json={"min_spacing": 1, "max_spacing": 10, "image_width": 512, "random_seed": 12345}
+        )
+
+        batch = client.post(
+            "/generate-phone-number-batch",
+            json={"count": 10, "min_spacing": 1, "max_spacing": 10, "image_width": 512, "random_seed": 12345}
+        )
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert batch.status_code == 503
+
+
+def test_api_cache():
+    """
+    Tests that seeded requests are cached and carry an ETag, and that unseeded requests bypass the cache
+    """
+
+    request = {"min_spacing": 1, "max_spacing": 10, "image_width": 512, "random_seed": 12345}
+
+    with TestClient(app) as client:
+        first = client.post("/generate-phone-number", json=request)
+        second = client.post("/generate-phone-number", json=request)
+
+        assert first.content == second.content
+        assert first.headers["etag"] == second.headers["etag"]
+        assert app.state.cache.hits == 1
+
+        not_modified = client.post("/generate-phone-number", json=request, headers={"If-None-Match": first.headers["etag"]})
+
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+
+        unseeded = client.post("/generate-phone-number", json=dict(request, random_seed=None))
+
+        assert unseeded.status_code == 200
+        assert "etag" not in unseeded.headers
+        assert len(app.state.cache) == 1
+
+
+def test_api_batch():
+    """
+    Tests the batch endpoints in each archive format
+    """
+
+    request = {"sequences": [[1, 2, 3], [4], [5, 6, 7, 8, 9, 0]], "min_spacing": 0, "max_spacing": 10, "image_width": 256, "random_seed": 12345}
+
+    with TestClient(app) as client:
+        response = client.post("/generate-numbers-sequence-batch", json=dict(request, format="zip"))
+
+        assert response.status_code == 200
+
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            assert len(archive.namelist()) == 6
+            assert json.loads(archive.read("00000002.json"))["digits"] == [5, 6, 7, 8, 9, 0]
+
+        response = client.post("/generate-numbers-sequence-batch", json=dict(request, format="npz"))
+
+        with np.load(io.BytesIO(response.content)) as archive:
+            assert archive["images"].shape == (3, 28, 256)
+            assert archive["labels"][1].tolist() == [4, -1, -1, -1, -1, -1]
+
+        response = client.post(
+            "/generate-phone-number-batch",
+            json={"count": 300, "min_spacing": 1, "max_spacing": 10, "image_width": 512, "random_seed": 12345, "format": "tar"}
+        )
+
+        with tarfile.open(fileobj=io.BytesIO(response.content)) as archive:
+            names = archive.getnames()
+            image = cv2.imdecode(np.frombuffer(archive.extractfile("00000299.png").read(), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+        assert len(names) == 600
+        assert image.shape == (28, 512)
+
+        response = client.post("/generate-numbers-sequence-batch", json=dict(request, sequences=[[1, 10]]))
+
+        assert response.status_code == 422
+
+        #Too narrow for a sequence past the first chunk, rejected before streaming anything
+        response = client.post("/generate-numbers-sequence-batch", json=dict(request, sequences=[[1, 2]] * 300 + [[7] * 40], image_width=100))
+
+        assert response.status_code == 422
+        assert "Sequence 300" in response.json()["detail"]
+
+        response = client.post("/generate-phone-number-batch", json={"count": 10, "min_spacing": 1, "max_spacing": 10, "image_width": 30})
+
+        assert response.status_code == 422
+
+        #Negative or inverted spacings would overlap the digits
+        response = client.post("/generate-numbers-sequence", json={"sequence": [1, 2, 3], "min_spacing": -30, "max_spacing": -30, "image_width": 256})
+
+        assert response.status_code == 422
+
+        response = client.post("/generate-phone-number", json={"min_spacing": 9, "max_spacing": 2, "image_width": 512})
+
+        assert response.status_code == 422
+
+
+def test_api_pack_only(synthetic_mnist, tmp_path, monkeypatch):
+    """
+    Tests that the API starts from a download directory holding only a glyph pack, salting its cache with the pack's source
+    """
+
+    os.makedirs(tmp_path / "mnist")
+    build_glyph_pack(synthetic_mnist.image_path, synthetic_mnist.label_path, str(tmp_path / "mnist" / PACK_NAME))
+    monkeypatch.chdir(tmp_path)
+
+    with TestClient(app) as client:
+        response = client.post("/generate-phone-number", json={"min_spacing": 1, "max_spacing": 10, "image_width": 512, "random_seed": 12345})
+
+        assert response.status_code == 200
+        assert app.state.cache_salt == get_loader().glyph_pack.source_id
+
+
+@pytest.mark.skipif(shared_memory is None, reason="needs multiprocessing.shared_memory")
+def test_api_shared_dataset(synthetic_mnist, tmp_path, monkeypatch):
+    """
+    Tests that the API starts attached to a shared dataset without the dataset files, as a worker of the pre-fork server
+    """
+
+    os.makedirs(tmp_path / "mnist")
+    monkeypatch.chdir(tmp_path)
+
+    for path in [synthetic_mnist.image_path, synthetic_mnist.label_path]:
+        os.replace(path, os.path.join("mnist", os.path.basename(path)))
+
+    loader = MNIST_Loader()
+    loader.load_MNIST()
+    shared = SharedDataset.create(loader)
+
+    try:
+        os.remove(loader.image_path)
+        os.remove(loader.label_path)
+        monkeypatch.setenv(SHARED_DATASET_ENV, shared.descriptor)
+
+        with TestClient(app) as client:
+            response = client.post("/generate-phone-number", json={"min_spacing": 1, "max_spacing": 10, "image_width": 512, "random_seed": 12345})
+
+            assert response.status_code == 200
+            assert get_loader().shared_dataset is not None
+            assert app.state.cache_salt == loader.dataset_id
+    finally:
+        invalidate_loader()
+        shared.close()
+        shared.unlink()
+
+
+def test_api_encodings():
+    """
+    Tests choosing the response encoding through the Accept header and the request fields
+    """
+
+    request = {"min_spacing": 1, "max_spacing": 10, "image_width": 512, "random_seed": 12345}
+
+    with TestClient(app) as client:
+        png = client.post("/generate-phone-number", json=request)
+        npy = client.post("/generate-phone-number", json=request, headers={"Accept": "application/x-npy"})
+        pgm = client.post("/generate-phone-number", json=dict(request, encoding="pgm"))
+        uncompressed = client.post("/generate-phone-number", json=dict(request, png_level=0))
+
+    assert npy.headers["content-type"] == "application/x-npy"
+    assert npy.headers["etag"] != png.headers["etag"]
+
+    image = np.load(io.BytesIO(npy.content))
+
+    assert image.shape == (28, 512)
+    assert (cv2.imdecode(np.frombuffer(png.content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE) == image).all()
+    assert pgm.content == b"P5\n512 28\n255\n" + image.tobytes()
+    assert len(uncompressed.content) > len(png.content)
+
+
+def test_api_augment():
+    """
+    Tests that augmentations are applied reproducibly, and change the image and its ETag
+    """
+
+    request = {"min_spacing": 1, "max_spacing": 10, "image_width": 512, "random_seed": 12345, "encoding": "npy"}
+
+    with TestClient(app) as client:
+        clean = client.post("/generate-phone-number", json=request)
+        augmented = client.post("/generate-phone-number", json=dict(request, augment=["rotation", "noise"]))
+
+        #Generated again rather than served from the cache
+        app.state.cache = ResponseCache(app.state.settings.cache_bytes)
+        again = client.post("/generate-phone-number", json=dict(request, augment=["rotation", "noise"]))
+        unknown = client.post("/generate-phone-number", json=dict(request, augment=["sepia"]))
+
+    assert augmented.status_code == 200
+    assert augmented.content == again.content
+    assert augmented.content != clean.content
+    assert augmented.headers["etag"] != clean.headers["etag"]
+    assert np.load(io.BytesIO(augmented.content)).shape == (28, 512)
+    assert unknown.status_code == 422
+
+
+def test_api_metrics():
+    """
+    Tests that /metrics serves a Prometheus histogram of each generation stage
+    """
+
+    #Loaded cold at startup, whose one-off cost must not count towards the per-image stages
+    invalidate_loader()
+
+    with TestClient(app) as client:
+        client.post("/generate-phone-number", json={"min_spacing": 1, "max_spacing": 10, "image_width": 512})
+
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    for stage in ["sample", "trim", "spacing", "padding", "compose", "encode"]:
+        assert f'number_generator_stage_seconds_count{{stage="{stage}"}} 1' in response.text
+        assert f'number_generator_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} 1' in response.text
+
+    assert 'number_generator_stage_seconds_count{stage="load"}' in response.text
+
+
+def run_async(coroutine):
+    """
+    Runs a coroutine on its own event loop, leaving the current one to TestClient
+    """
+
+    loop = asyncio.new_event_loop()
+
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_api_coalescer():
+    """
+    Tests that concurrent requests are generated together, each getting the image it gets on its own
+    """
+
+    batch_sizes = []
+
+    async def run(fn, *args):
+        batch_sizes.append(len(args[0]))
+        return fn(*args)
+
+    async def render_all(coalescer, requests):
+        return await asyncio.gather(*(coalescer.render(*request) for request in requests), return_exceptions=True)
+
+    requests = [([1, 2, 3], (0, 10), 256, 12345, [], "npy", None)] * 3
+    requests += [(None, (0, 10), 256, seed, ["noise"], "png", 1) for seed in range(3)]
+    requests += [([4, 5], (0, 10), 256, None, [], "raw", None), ([1] * 40, (0, 10), 256, 1, [], "raw", None)]
+
+    images = run_async(render_all(Coalescer(run, max_batch=2, window=0.01), requests))
+
+    assert sorted(batch_sizes) == [1, 1, 2, 2, 2]
+    assert images[:3] == [render_sequence(*requests[0])] * 3
+    assert images[3:6] == [render_phone_number(*request[1:]) for request in requests[3:6]]
+    assert len(images[6]) == 28 * 256
+
+    #Too wide for the image, which fails it alone
+    assert isinstance(images[7], ValueError)
+
+    #A lone request does not wait for the window
+    batch_sizes.clear()
+    coalescer = Coalescer(run, window=60)
+    image = run_async(asyncio.wait_for(coalescer.render(*requests[0]), 5))
+
+    assert image == images[0]
+    assert batch_sizes == [1]
+
+
+def test_api_pool():
+    """
+    Tests that the warm pool refills in the background, serves fresh images, and counts its hits
+    """
+
+    async def fill_and_pop():
+        executor = BoundedExecutor(max_workers=2)
+        pool = WarmPool(lambda: executor, size=4, max_configurations=1, refill_batch=3)
+
+        try:
+            assert pool.pop(None, (1, 10), 400, [], "raw") is None
+
+            for _ in range(1000):
+                if len(pool) == 4:
+                    break
+
+                await asyncio.sleep(0.01)
+
+            images = [pool.pop(None, (1, 10), 400, [], "raw") for _ in range(4)]
+
+            #A new configuration evicts the least recently used one
+            assert pool.pop([1, 2], (1, 10), 400, [], "raw") is None
+            assert len(pool._buffers) == 1
+
+            return images, pool.hits, pool.misses, pool.hit_rate, pool.to_prometheus()
+        finally:
+            pool.close()
+            executor.shutdown()
+
+    images, hits, misses, hit_rate, metrics = run_async(fill_and_pop())
+
+    assert all(image is not None and len(image) == 28 * 400 for image in images)
+    assert len(set(images)) == 4
+    assert (hits, misses, hit_rate) == (4, 2, 4 / 6)
+    assert 'number_generator_pool_requests_total{result="hit"} 4' in metrics
+
+
+def wait_for_job(status, until=("completed", "failed", "cancelled")):
+    """
+    Polls a job status function until the job reaches one of the `until` statuses
+    """
+
+    for _ in range(1000):
+        job = status()
+
+        if job["status"] in until:
+            return job
+
+        time.sleep(0.01)
+
+    raise TimeoutError(job)
+
+
+def test_api_jobs(tmp_path, monkeypatch):
+    """
+    Tests submitting a job, following its progress, downloading its shards and cancelling
+    """
+
+    monkeypatch.setenv("NUMBER_GENERATOR_JOBS_PATH", str(tmp_path))
+
+    request = {"count": 25, "min_spacing": 1, "max_spacing": 10, "image_width": 400, "random_seed": 12345, "format": "npz", "shard_size": 10}
+
+    with TestClient(app) as client:
+        response = client.post("/jobs", json=request)
+        assert response.status_code == 202
+
+        job_id = response.json()["id"]
+        job = wait_for_job(lambda: client.get(f"/jobs/{job_id}").json())
+
+        assert (job["status"], job["completed"], job["shards"], job["completed_shards"]) == ("completed", 25, 3, [0, 1, 2])
+
+        response = client.get(f"/jobs/{job_id}/shards/1")
+        assert response.status_code == 200
+
+        with np.load(io.BytesIO(response.content)) as shard:
+            expected = generate_phone_number_batch(10, (1, 10), 400, return_digits=True, sample_seeds=sample_seeds(12345, 10, 20))
+
+            np.testing.assert_array_equal(shard["images"], expected[0])
+            np.testing.assert_array_equal(shard["labels"], expected[1])
+
+        assert client.get(f"/jobs/{job_id}/shards/3").status_code == 404
+
+        #Invalid jobs are rejected before they are queued
+        assert client.post("/jobs", json=dict(request, min_spacing=9, max_spacing=2)).status_code == 422
+        assert client.post("/jobs", json=dict(request, image_width=30)).status_code == 422
+        assert client.post("/jobs", json=dict(request, sequences=[[1] * 40], image_width=100)).status_code == 422
+        assert client.get("/jobs/0123").status_code == 404
+        assert client.post(f"/jobs/{job_id}/cancel").json()["status"] == "completed"
+
+        #Sequences are drawn in turn
+        response = client.post("/jobs", json=dict(request, count=3, sequences=[[1, 2], [3, 4]], format="tar"))
+        job = wait_for_job(lambda: client.get(f"/jobs/{response.json()['id']}").json())
+
+        with tarfile.open(fileobj=io.BytesIO(client.get(f"/jobs/{job['id']}/shards/0").content)) as tar:
+            labels = [json.load(tar.extractfile(f"{i:08d}.json"))["digits"] for i in range(3)]
+
+        assert labels == [[1, 2], [3, 4], [1, 2]]
+
+    #A queued job is cancelled before it runs
+    queue = JobQueue(str(tmp_path))
+    job = queue.submit(GenerateJobRequest(**request))
+
+    assert job["status"] == "queued" and job["request"]["random_seed"] == 12345
+    assert queue.cancel(job["id"])["status"] == "cancelled"
+
+    queue.start()
+    queue.stop()
+
+    assert queue.status(job["id"])["completed_shards"] == []
+
+
+def test_api_jobs_owner(tmp_path):
+    """
+    Tests that only the jobs of dead processes of this host, or of an earlier boot of it, are requeued on start
+    """
+
+    queue = JobQueue(str(tmp_path), workers=0)
+    request = GenerateJobRequest(count=10, min_spacing=1, max_spacing=10, image_width=400, random_seed=1)
+
+    hostname = host_id().rsplit("/", 1)[0]
+    owners = {
+        "alive": (os.getppid(), host_id()),
+        "other host": (2 ** 22 + 1, "elsewhere/boot"),
+        "rebooted": (os.getppid(), f"{hostname}/earlier-boot"),
+    }
+
+    jobs = {}
+    for name, (owner, owner_host) in owners.items():
+        jobs[name] = queue.submit(request)["id"]
+        queue._execute("UPDATE jobs SET status = 'running', owner = ?, owner_host = ? WHERE id = ?", (owner, owner_host, jobs[name]))
+
+    queue.start()
+    queue.stop()
+
+    statuses = {name: queue.status(job_id)["status"] for name, job_id in jobs.items()}
+    assert statuses == {"alive": "running", "other host": "running", "rebooted": "queued"}
+
+
+def test_api_jobs_resume(tmp_path, monkeypatch):
+    """
+    Tests that a job interrupted by a shutdown resumes from its completed shards on the next start
+    """
+
+    import number_generator.api.jobs as jobs
+
+    queue = JobQueue(str(tmp_path))
+    generate_job_images = jobs.generate_job_images
+
+    def interrupted(indices, gen_request):
+        generated = generate_job_images(indices, gen_request)
+
+        if indices[0] == 10:
+            queue._stopping.set()
+
+        return generated
+
+    monkeypatch.setattr(jobs, "generate_job_images", interrupted)
+
+    job = queue.submit(GenerateJobRequest(count=45, min_spacing=1, max_spacing=10, image_width=400, format="npz", shard_size=10))
+    queue.start()
+    wait_for_job(lambda: queue.status(job["id"]), until=("running",))
+
+    for thread in queue._threads:
+        thread.join()
+
+    queue.stop()
+
+    job = queue.status(job["id"])
+    assert (job["status"], job["completed_shards"]) == ("running", [0, 1])
+
+    monkeypatch.setattr(jobs, "generate_job_images", generate_job_images)
+
+    #Resumed on a pool that is busy for its first call, which is tried again
+    calls = []
+
+    def run(fn, *args):
+        calls.append(fn)
+
+        if len(calls) == 1:
+            raise ExecutorBusy()
+
+        return fn(*args)
+
+    queue = JobQueue(str(tmp_path), poll_interval=0.01, run=run)
+    queue.start()
+
+    try:
+        job = wait_for_job(lambda: queue.status(job["id"]))
+    finally:
+        queue.stop()
+
+    assert calls == [generate_job_images] * 4
+    assert (job["status"], job["completed"], job["completed_shards"]) == ("completed", 45, [0, 1, 2, 3, 4])
+
+    #The unseeded job drew its seed at submission, so the resumed shards match it
+    with np.load(queue.shard_path(job["id"], 4)) as shard:
+        expected = generate_phone_number_batch(5, (1, 10), 400, sample_seeds=sample_seeds(job["request"]["random_seed"], 40, 45))
+
+        np.testing.assert_array_equal(shard["images"], expected)
@@ -1,6 +1,11 @@
 from number_generator.cli.cli import app
+from number_generator.script.dataload import invalidate_loader
 from typer.testing import CliRunner
 from os import path
+import json
+import subprocess
+import sys
+import numpy as np
 runner = CliRunner()
 
 def test_cli_seq():
@@ -34,3 +39,170 @@ def test_cli_seq():
     assert path.isfile("cli_seq_test.png")
 
     #Can be expanded by reading the image, and comparing the contents to expectations
+
+
+
+def test_cli_profile(tmp_path):
+    """
+    Tests that --profile prints a table of the time spent in each generation stage
+    """
+
+    #Loaded cold, whose one-off cost must not count towards the per-image stages
+    invalidate_loader()
+
+    result = runner.invoke(
+        app,
+        [
+            "generate-phone-numbers",
+            "--min-spacing", "0",
+            "--max-spacing", "10",
+            "--image-width", "512",
+            "--num-images", "5",
+            "--output-path", str(tmp_path),
+            "--no-verbose",
+            "--profile"
+        ]
+    )
+
+    assert result.exit_code == 0
+
+    rows = {line.split()[0]: line.split()[1] for line in result.stdout.splitlines()[1:] if line.strip()}
+
+    for stage in ["sample", "trim", "spacing", "padding", "compose", "encode"]:
+        assert rows[stage] == "5"
+
+    assert "load" in rows
+
+def test_cli_phone_workers(tmp_path):
+    """
+    Tests that a seeded run of the phone number CLI saves the same images whatever the worker count
+    """
+
+    outputs = []
+
+    for workers in ["1", "3"]:
+        output_path = tmp_path / f"workers_{workers}"
+        output_path.mkdir()
+
+        result = runner.invoke(
+            app,
+            [
+                "generate-phone-numbers",
+                "--min-spacing", "0",
+                "--max-spacing", "10",
+                "--image-width", "512",
+                "--num-images", "20",
+                "--random-seed", "12345",
+                "--output-path", str(output_path),
+                "--workers", workers,
+                "--no-verbose"
+            ]
+        )
+
+        assert result.exit_code == 0
+
+        outputs.append({f.name: f.read_bytes() for f in output_path.iterdir()})
+
+    assert len(outputs[0]) == 20
+    assert outputs[0] == outputs[1]
+
+
+def test_cli_phone_shards_resume(tmp_path):
+    """
+    Tests that an interrupted sharded run resumes from its completed shards and reproduces the missing ones
+    """
+
+    arguments = [
+        "generate-phone-numbers",
+        "--min-spacing", "0",
+        "--max-spacing", "10",
+        "--image-width", "512",
+        "--num-images", "25",
+        "--random-seed", "12345",
+        "--output-path", str(tmp_path),
+        "--output-format", "npz",
+        "--shard-size", "10",
+        "--no-verbose"
+    ]
+
+    result = runner.invoke(app, arguments)
+
+    assert result.exit_code == 0
+    assert sorted(f.name for f in tmp_path.iterdir()) == ["manifest.json", "shard-00000.npz", "shard-00001.npz", "shard-00002.npz"]
+
+    with np.load(tmp_path / "shard-00001.npz") as shard:
+        images, labels = shard["images"], shard["labels"]
+
+    assert images.shape == (10, 28, 512)
+    assert labels.shape == (10, 10)
+
+    #Simulate a run interrupted before the second shard completed
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    del manifest["shards"]["1"]
+    (tmp_path / "manifest.json").write_text(json.dumps(manifest))
+    (tmp_path / "shard-00001.npz").unlink()
+
+    assert runner.invoke(app, arguments).exit_code != 0
+
+    result = runner.invoke(app, arguments + ["--resume"])
+
+    assert result.exit_code == 0
+    assert json.loads((tmp_path / "manifest.json").read_text())["complete"]
+
+    with np.load(tmp_path / "shard-00001.npz") as shard:
+        assert (shard["images"] == images).all()
+        assert (shard["labels"] == labels).all()
+
+
+def test_cli_phone_shard_sizes(tmp_path):
+    """
+    Tests that a seeded sharded run holds the same images whatever its shard size and worker count
+    """
+
+    outputs = []
+
+    for shard_size, workers in [("25", "1"), ("4", "1"), ("7", "2")]:
+        output_path = tmp_path / f"shards_{shard_size}"
+
+        result = runner.invoke(
+            app,
+            [
+                "generate-phone-numbers",
+                "--min-spacing", "0",
+                "--max-spacing", "10",
+                "--image-width", "512",
+                "--num-images", "25",
+                "--random-seed", "12345",
+                "--output-path", str(output_path),
+                "--output-format", "npz",
+                "--shard-size", shard_size,
+                "--workers", workers,
+                "--no-verbose"
+            ]
+        )
+
+        assert result.exit_code == 0
+
+        shards = []
+        for shard_path in sorted(output_path.glob("shard-*.npz")):
+            with np.load(shard_path) as shard:
+                shards.append(shard["images"])
+
+        outputs.append(np.concatenate(shards))
+
+    assert outputs[0].shape == (25, 28, 512)
+
+    for other in outputs[1:]:
+        assert (other == outputs[0]).all()
+
+
+def test_cli_lazy_imports():
+    """
+    Tests that loading the CLI, e.g. for --help, does not import the heavy generation dependencies
+    """
+
+    code = "import sys, number_generator.cli.cli; print(' '.join(sorted(sys.modules)))"
+    modules = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.split()
+
+    for module in ["numpy", "cv2", "idx2numpy", "wget", "fastapi"]:
+        assert module not in modules
@@ -0,0 +1,244 @@
+from number_generator.script.idxreader import read_idx, write_idx
+from number_generator.script.labelindex import LabelIndex
+from number_generator.script.imageprocessor import trim_image
+from number_generator.script.dataload import MNIST_Loader, preload_MNIST
+from number_generator.script.shared import SHARED_DATASET_ENV, SharedDataset, shared_memory
+from number_generator.script.glyphpack import build_glyph_pack
+from number_generator.script import glyphpack
+from number_generator.script.generate import generate_numbers_sequence, generate_numbers_sequence_batch
+import gzip
+import hashlib
+import multiprocessing
+import os
+import zipfile
+import pytest
+import numpy as np
+
+def test_idx_roundtrip(tmp_path):
+    """
+    Makes sure the IDX reader returns the written array, both memory-mapped and eagerly loaded
+    """
+
+    rng = np.random.default_rng(12345)
+    array = rng.integers(0, 256, size=(50, 28, 28)).astype(np.uint8)
+
+    path = str(tmp_path / "images-idx3-ubyte")
+    write_idx(path, array)
+
+    mapped = read_idx(path, mmap=True)
+    eager = read_idx(path, mmap=False)
+
+    assert isinstance(mapped, np.memmap)
+    assert mapped.shape == (50, 28, 28)
+    assert (mapped == array).all()
+    assert (eager == array).all()
+
+
+def test_label_index_matches_mapping():
+    """
+    Makes sure the label index lists the same rows, in the same order, as the dict-of-lists mapping it replaced
+    """
+
+    rng = np.random.default_rng(12345)
+    labels = rng.integers(0, 10, size=5000).astype(np.uint8)
+
+    digit_mapping = {}
+    for e, label in enumerate(labels):
+        digit_mapping[label] = [e] + digit_mapping.get(label, [])
+
+    index = LabelIndex(labels)
+
+    assert index.order.dtype == np.int32
+    assert len(index) == 5000
+
+    for label in range(10):
+        assert index.count(label) == len(digit_mapping[label])
+        assert index.indices(label).tolist() == digit_mapping[label]
+
+
+def test_fetch_digits_matches_fetch_digit(synthetic_mnist):
+    """
+    Makes sure the batched fetch draws the same digits as repeated single fetches
+    """
+
+    digits = [3, 1, 4, 1, 5, 9, 2, 6]
+
+    batch = synthetic_mnist.fetch_digits(digits, rng=np.random.default_rng(12345))
+
+    rng = np.random.default_rng(12345)
+    single = np.stack([synthetic_mnist.fetch_digit(d, rng=rng) for d in digits])
+
+    assert batch.shape == (8, 28, 28)
+    assert (batch == single).all()
+
+    matrix = synthetic_mnist.fetch_digits(np.tile(digits, (4, 1)), rng=np.random.default_rng(12345))
+
+    assert matrix.shape == (4, 8, 28, 28)
+    assert (matrix[0] == single).all()
+
+
+def test_trim_bounds(synthetic_mnist):
+    """
+    Makes sure the precomputed trim bounds cut the same columns as trim_image, and are cached on disk
+    """
+
+    for e in range(0, 600, 7):
+        left, right = synthetic_mnist.trim_bounds[e]
+        image = synthetic_mnist.image_array[e]
+
+        assert (image[:, left:right+1] == trim_image(image)).all()
+
+    assert os.path.exists(synthetic_mnist.bounds_path)
+
+    reloaded = MNIST_Loader(download_directory=synthetic_mnist.download_directory)
+    reloaded.load_MNIST()
+
+    assert (reloaded.trim_bounds == synthetic_mnist.trim_bounds).all()
+
+
+def test_fetch_local_sources(tmp_path):
+    """
+    Makes sure the dataset is extracted from a local zip or mirror folder, and that a checksum mismatch leaves nothing behind
+    """
+
+    rng = np.random.default_rng(12345)
+    files = {
+        "train-images-idx3-ubyte": rng.integers(0, 256, size=(100, 28, 28)).astype(np.uint8),
+        "train-labels-idx1-ubyte": rng.integers(0, 10, size=100).astype(np.uint8),
+    }
+
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+
+    checksums = {}
+    for name, array in files.items():
+        write_idx(str(tmp_path / name), array)
+
+        with open(tmp_path / name, "rb") as f:
+            compressed = gzip.compress(f.read())
+
+        (mirror / f"{name}.gz").write_bytes(compressed)
+        checksums[name] = hashlib.md5(compressed).hexdigest()
+
+    zip_path = str(tmp_path / "mnist.zip")
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        for name in files:
+            archive.write(str(mirror / f"{name}.gz"), f"{name}.gz")
+
+    for source in [str(mirror), zip_path]:
+        download_directory = str(tmp_path / f"from_{os.path.basename(source)}")
+
+        mnist = MNIST_Loader(download_directory=download_directory, source=source, checksums=checksums)
+        mnist.load_MNIST()
+
+        assert (mnist.image_array == files["train-images-idx3-ubyte"]).all()
+        assert len(mnist.label_index) == 100
+
+    #The synthetic files do not match the checksums of the real dataset
+    download_directory = str(tmp_path / "mismatch")
+
+    with pytest.raises(ValueError):
+        MNIST_Loader(download_directory=download_directory, source=zip_path).load_MNIST()
+
+    assert os.listdir(download_directory) == []
+
+
+def test_glyph_pack(synthetic_mnist, tmp_path, monkeypatch):
+    """
+    Makes sure a loader reading a glyph pack serves the same data, and generates the same images, as one reading the IDX files
+    """
+
+    build_glyph_pack(synthetic_mnist.image_path, synthetic_mnist.label_path, synthetic_mnist.pack_path)
+
+    packed = MNIST_Loader(download_directory=synthetic_mnist.download_directory)
+    packed.load_MNIST()
+
+    assert packed.glyph_pack is not None
+    assert packed.glyph_pack.source_matches(synthetic_mnist.image_path, synthetic_mnist.label_path, full=True)
+
+    assert (packed.label_index.order == synthetic_mnist.label_index.order).all()
+    assert (packed.trim_bounds == synthetic_mnist.trim_bounds).all()
+    assert (np.asarray(packed.image_array) == synthetic_mnist.image_array).all()
+    assert (packed.fetch_digits([3, 1, 4], np.random.default_rng(5)) == synthetic_mnist.fetch_digits([3, 1, 4], np.random.default_rng(5))).all()
+
+    for dtype in [np.uint8, np.float32, np.float64]:
+        for seed in range(5):
+            expected = generate_numbers_sequence([1, 2, 3, 4, 5], (0, 10), 256, random_seed=seed, loader=synthetic_mnist, dtype=dtype)
+            image = generate_numbers_sequence([1, 2, 3, 4, 5], (0, 10), 256, random_seed=seed, loader=packed, dtype=dtype)
+
+            assert image.dtype == expected.dtype
+            assert (image == expected).all()
+
+    digits = np.random.default_rng(0).integers(0, 10, size=(50, 10))
+    expected = generate_numbers_sequence_batch(digits, (0, 10), 512, random_seed=12345, loader=synthetic_mnist)
+
+    assert (generate_numbers_sequence_batch(digits, (0, 10), 512, random_seed=12345, loader=packed) == expected).all()
+
+    assert packed.dataset_id == packed.glyph_pack.source_id == synthetic_mnist.dataset_id
+
+    #Touched files are hashed once, then recorded, so later loads skip hashing them
+    stat = os.stat(synthetic_mnist.image_path)
+    os.utime(synthetic_mnist.image_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert MNIST_Loader(download_directory=synthetic_mnist.download_directory).load_pack()
+
+    def fail(path):
+        raise AssertionError(f"{path} hashed again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(glyphpack, "file_sha256", fail)
+
+        assert MNIST_Loader(download_directory=synthetic_mnist.download_directory).load_pack()
+
+    #Different images of the same size are read from the IDX files, not the stale pack
+    inverted = 255 - np.asarray(synthetic_mnist.image_array)
+    write_idx(synthetic_mnist.image_path, inverted)
+
+    changed = MNIST_Loader(download_directory=synthetic_mnist.download_directory)
+    changed.load_MNIST()
+
+    assert changed.glyph_pack is None
+    assert (np.asarray(changed.image_array) == inverted).all()
+
+
+def _generate_attached(descriptor, download_directory):
+    """
+    Generates an image in a fresh process, from the shared dataset only
+    """
+
+    os.environ[SHARED_DATASET_ENV] = descriptor
+    loader = preload_MNIST(download_directory)
+
+    return loader.shared_dataset is not None, generate_numbers_sequence([1, 2, 3], (0, 5), 120, random_seed=7, loader=loader)
+
+
+@pytest.mark.skipif(shared_memory is None, reason="needs multiprocessing.shared_memory")
+def test_shared_dataset(synthetic_mnist):
+    expected = generate_numbers_sequence([1, 2, 3], (0, 5), 120, random_seed=7, loader=synthetic_mnist)
+
+    shared = SharedDataset.create(synthetic_mnist)
+
+    try:
+        #Workers must not need the dataset files
+        os.remove(synthetic_mnist.image_path)
+        os.remove(synthetic_mnist.label_path)
+
+        with multiprocessing.get_context("spawn").Pool(2) as pool:
+            results = pool.starmap(_generate_attached, [(shared.descriptor, synthetic_mnist.download_directory)] * 2)
+
+        for attached, image in results:
+            assert attached
+            np.testing.assert_array_equal(image, expected)
+
+        #Still there after the workers exit, and read-only
+        attached = SharedDataset.attach(shared.descriptor)
+        loader = attached.loader()
+
+        np.testing.assert_array_equal(loader.image_array, np.asarray(synthetic_mnist.image_array))
+        assert not loader.image_array.flags.writeable
+
+        del loader
+        attached.close()
+    finally:
+        shared.close()
+        shared.unlink()
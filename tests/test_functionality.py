@@ -1,4 +1,14 @@
 from number_generator import generate_numbers_sequence, generate_phone_number
+from number_generator import get_loader, invalidate_loader
+from number_generator import generate_numbers_sequence_batch, generate_phone_number_batch
+from number_generator import SequenceStream
+from number_generator import sample_seed, sample_seeds
+from number_generator import Augmentation
+from number_generator.script.augment import AUGMENTATIONS, _grid_shape, _interpolation
+from itertools import islice
+import time
+import numpy as np
+import pytest
 
 def test_gen_seq():
     """
@@ -40,3 +50,189 @@ def test_gen_pn():
 
     assert image.shape == (28, 512) #Makes sure the image is the correct shape
     assert 232.70179 < image.mean() < 232.70180 #Could be changed for an exact comparison, but this should be enough
+
+
+def test_shared_loader():
+    """
+    Makes sure the loader is only built once, and that an injected loader gives the same image
+    """
+
+    loader = get_loader()
+
+    assert get_loader() is loader
+
+    image_shared = generate_numbers_sequence([1, 2, 3], (0, 10), 128, random_seed=12345, verbose=False)
+    image_injected = generate_numbers_sequence([1, 2, 3], (0, 10), 128, random_seed=12345, verbose=False, loader=loader)
+
+    assert (image_shared == image_injected).all()
+
+    invalidate_loader()
+
+    assert get_loader() is not loader
+
+
+def test_gen_batch(synthetic_mnist):
+    """
+    Basic test for batch generation
+    """
+
+    digit_matrix = [[1, 2, 3, 4, 5], [5, 4, 3, 2, 1], [0, 0, 0, 0, 0]]
+
+    images = generate_numbers_sequence_batch(digit_matrix, (0, 10), 256, random_seed=12345, loader=synthetic_mnist)
+    again = generate_numbers_sequence_batch(digit_matrix, (0, 10), 256, random_seed=12345, loader=synthetic_mnist)
+    scaled = generate_numbers_sequence_batch(
+        digit_matrix, (0, 10), 256, random_seed=12345, loader=synthetic_mnist, dtype=np.float32
+    )
+
+    assert images.shape == (3, 28, 256)
+    assert images.dtype == np.uint8
+    assert (images == again).all()
+    assert np.allclose(scaled, images / 255)
+
+    images, digits = generate_phone_number_batch(
+        100, (0, 10), 512, random_seed=12345, loader=synthetic_mnist, return_digits=True, dtype=np.float32
+    )
+
+    assert images.shape == (100, 28, 512)
+    assert digits.shape == (100, 10)
+    assert images.min() >= 0 and images.max() <= 1
+
+
+def test_gen_batch_sample_seeds(synthetic_mnist):
+    """
+    Makes sure per-sample seeds give the same images however a job is split into batches
+    """
+
+    images, digits = generate_phone_number_batch(
+        30, (0, 10), 512, loader=synthetic_mnist, return_digits=True, sample_seeds=sample_seeds(12345, 0, 30)
+    )
+
+    #Shards of any size, generated in any order, rebuild the same job
+    for shard_size in [1, 7, 30]:
+        shards = {}
+        for start in reversed(range(0, 30, shard_size)):
+            stop = min(start + shard_size, 30)
+            shards[start] = generate_phone_number_batch(
+                stop - start, (0, 10), 512, loader=synthetic_mnist, sample_seeds=sample_seeds(12345, start, stop)
+            )
+
+        assert (np.concatenate([shards[start] for start in sorted(shards)]) == images).all()
+
+    for i in [0, 13, 29]:
+        image = generate_phone_number((0, 10), 512, random_seed=sample_seed(12345, i), loader=synthetic_mnist, dtype=np.uint8)
+        sequence = generate_numbers_sequence(digits[i], (0, 10), 512, random_seed=sample_seed(12345, i), loader=synthetic_mnist, dtype=np.uint8)
+
+        assert (image == images[i]).all()
+        assert (sequence == images[i]).all()
+
+    assert not (images[0] == images[1]).all()
+    assert sample_seed(12345, 3).generate_state(4).tolist() == np.random.SeedSequence(12345).spawn(4)[3].generate_state(4).tolist()
+
+
+def test_gen_augment(synthetic_mnist):
+    """
+    Makes sure augmentations are reproducible, and augment an image the same in any batch
+    """
+
+    clean = generate_phone_number_batch(20, (0, 10), 512, random_seed=12345, loader=synthetic_mnist)
+    unaugmented = generate_phone_number_batch(20, (0, 10), 512, random_seed=12345, loader=synthetic_mnist, augment=[])
+
+    assert (clean == unaugmented).all()
+
+    for name in AUGMENTATIONS:
+        images = generate_phone_number_batch(20, (0, 10), 512, random_seed=12345, loader=synthetic_mnist, augment=[name])
+        again = generate_phone_number_batch(20, (0, 10), 512, random_seed=12345, loader=synthetic_mnist, augment=[name])
+
+        assert images.shape == clean.shape
+        assert (images == again).all()
+        assert not (images == clean).all()
+
+    seeds = sample_seeds(12345, 0, 20)
+    images = generate_phone_number_batch(20, (0, 10), 512, loader=synthetic_mnist, sample_seeds=seeds, augment=AUGMENTATIONS)
+
+    for i in [0, 19]:
+        image = generate_phone_number((0, 10), 512, random_seed=seeds[i], loader=synthetic_mnist, dtype=np.uint8, augment=AUGMENTATIONS)
+
+        assert (image == images[i]).all()
+
+    scaled = generate_numbers_sequence(
+        [1, 2, 3], (0, 10), 128, random_seed=12345, loader=synthetic_mnist, dtype=np.float32,
+        augment=Augmentation(["noise"], {"noise": 0.5})
+    )
+
+    assert scaled.min() >= 0 and scaled.max() <= 1
+
+    #The elastic field is interpolated one axis at a time, in memory linear in the width
+    wide = generate_numbers_sequence([1, 2, 3], (0, 10), 15000, random_seed=12345, loader=synthetic_mnist, augment=["elastic"])
+
+    assert wide.shape == (28, 15000)
+    assert sum(array.nbytes for array in _interpolation(15000)) == 15000 * 24
+
+    #Every pixel interpolates between control points of the drawn grid, even along a single pixel
+    for size in [1, 2, 28, 15000]:
+        assert _interpolation(size)[1].max() < _grid_shape(size, size)[0]
+
+    with pytest.raises(ValueError):
+        Augmentation(["sepia"])
+
+
+def test_stream(synthetic_mnist):
+    """
+    Makes sure a seeded stream yields the same batches whatever its workers
+    """
+
+    batches = []
+
+    for num_workers, backend in [(1, "thread"), (3, "thread"), (2, "process")]:
+        with SequenceStream(
+            batch_size=16,
+            sequence_length=4,
+            image_width=256,
+            random_seed=12345,
+            prefetch=2,
+            num_workers=num_workers,
+            backend=backend,
+            download_directory=synthetic_mnist.download_directory
+        ) as stream:
+            batches.append(list(islice(stream, 5)))
+
+    for images, labels in batches[0]:
+        assert images.shape == (16, 28, 256)
+        assert labels.shape == (16, 4)
+
+    for other in batches[1:]:
+        for (images, labels), (other_images, other_labels) in zip(batches[0], other):
+            assert (images == other_images).all()
+            assert (labels == other_labels).all()
+
+
+def test_stream_bounded(synthetic_mnist, monkeypatch):
+    """
+    Makes sure a slow worker does not let the others run ahead of the prefetch limit
+    """
+
+    import number_generator.script.stream as stream_module
+
+    generate_stream_batch = stream_module.generate_stream_batch
+
+    def slow_first_worker(batch, *args):
+        if batch % 3 == 0:
+            time.sleep(0.05)
+
+        return generate_stream_batch(batch, *args)
+
+    monkeypatch.setattr(stream_module, "generate_stream_batch", slow_first_worker)
+
+    with SequenceStream(
+        batch_size=4,
+        sequence_length=4,
+        image_width=256,
+        random_seed=12345,
+        prefetch=4,
+        num_workers=3,
+        download_directory=synthetic_mnist.download_directory
+    ) as stream:
+        for images, labels in islice(stream, 12):
+            time.sleep(0.01)
+
+            assert sum(batches.qsize() for batches in stream._queues) <= 4
@@ -0,0 +1,53 @@
+from number_generator.script.imageprocessor import space_images, pad_image_bounds, invert_image
+from number_generator.script.imageprocessor import draw_spacings, draw_left_padding, sequence_width, compose_images
+from number_generator.script.generate import generate_numbers_sequence, generate_numbers_sequence_batch
+import numpy as np
+import pytest
+
+def test_compose_matches_pipeline(synthetic_mnist):
+    """
+    Makes sure the single-allocation compositor gives the same image as spacing, padding and inverting in turn
+    """
+
+    random_seed = 12345
+    indices = synthetic_mnist.sample_indices([1, 2, 3, 4, 5], rng=np.random.default_rng(random_seed))
+
+    images = synthetic_mnist.image_array[indices]
+    bounds = synthetic_mnist.trim_bounds[indices]
+
+    expected = space_images(images, (0, 10), random_seed=random_seed)
+    expected = pad_image_bounds(expected, 256, random_seed=random_seed)
+    expected = invert_image(expected)
+
+    spacings = draw_spacings(5, (0, 10), random_seed=random_seed)
+    left_width = draw_left_padding(sequence_width(bounds, spacings), 256, random_seed=random_seed)
+
+    image = compose_images(images, bounds, spacings, left_width, 256, dtype=np.uint8)
+
+    assert image.shape == (28, 256)
+    assert image.dtype == np.uint8
+    assert (image == expected).all()
+
+    image = compose_images(images, bounds, spacings, left_width, 256, dtype=np.float32)
+
+    assert image.dtype == np.float32
+    assert np.allclose(image, expected / 255)
+
+
+def test_invalid_spacing_range(synthetic_mnist):
+    """
+    Makes sure negative or inverted spacing ranges are rejected by the single image and the batch paths alike
+    """
+
+    for spacing_range in [(-30, -30), (-5, 10), (10, 5)]:
+        with pytest.raises(ValueError):
+            draw_spacings(3, spacing_range)
+
+        with pytest.raises(ValueError):
+            generate_numbers_sequence([1, 2, 3], spacing_range, 256, loader=synthetic_mnist)
+
+        with pytest.raises(ValueError):
+            generate_numbers_sequence_batch([[1, 2, 3]], spacing_range, 256, loader=synthetic_mnist)
+
+        with pytest.raises(ValueError):
+            generate_numbers_sequence_batch([[1, 2, 3]], spacing_range, 256, sample_seeds=[1], loader=synthetic_mnist)